@@ -1 +1,20 @@
-from jdic import Client, WordRequestHandler, KanjiRequestHandler, HttpRequest, SearchType
\ No newline at end of file
+from jdic import Client, WordRequestHandler, KanjiRequestHandler, HttpRequest, SearchType
+from pool import ConnectionPool
+from cache import Cache, MemoryCache, DiskCache, TieredCache
+from executor import Future, WorkerPool, CancelledError, TimeoutError, as_completed
+from asyncclient import AsyncClient
+from local import LocalRequest
+from entries import WordEntry, KanjiEntry
+from metrics import Instrumentation, HistogramCollector
+from radicals import RadicalIndex
+from server import LookupServer, RemoteClient
+from batch import run_batch
+from mirrors import MirrorSet, MirroredRequest
+from scheduler import Scheduler, TokenBucket, Priority
+from compression import DecompressingResponse
+from search import SearchIndex
+from kanjitable import KanjiTable
+from annotate import Annotator
+from snapshot import SnapshotCache, warm_up, write_snapshot, refresh_snapshot
+from deadline import Deadline, DeadlineExceeded
+from indexer import DictionaryIndex, build_index
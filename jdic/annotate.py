@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import collections
+import itertools
+import re
+
+from jdic import SearchType
+from scheduler import Priority
+
+class Annotator(object):
+    """
+    Annotates Japanese documents with the entries of the kanji and candidate words they contain.
+
+    Documents are read a window at a time: the distinct kanji and words of the whole window are looked up
+    together, kanji packed several to a request, then one annotation per document is yielded. Only one
+    window is held in memory, so corpora of any size can be streamed. Results are reused through the
+    client's cache, give the client one to avoid requesting the same kanji again in later windows.
+
+    Candidate words are runs of kanji and runs of katakana, a heuristic without a tokenizer. Override
+    word_pattern to extract others.
+
+    Options:
+        window: number of documents looked up together
+        pack_size: max kanji per request
+        words: also look up candidate words, True by default
+    """
+
+    kanji_pattern = re.compile(u"[\u4E00-\u9FBF]")
+    word_pattern = re.compile(u"[\u4E00-\u9FBF\u3005]{2,}|[\u30A1-\u30FA\u30FC]{2,}")
+
+    def __init__(self, client, options=None):
+        options = options or {}
+        self._client = client
+        self._window = options.get('window', 100)
+        self._pack_size = options.get('pack_size', 20)
+        self._words = options.get('words', True)
+
+    def _distinct(self, pattern, text):
+        return list(collections.OrderedDict.fromkeys(pattern.findall(text)))
+
+    def annotate(self, documents):
+        """
+        Yields an annotation per document, in input order:
+            dict(text, kanji=OrderedDict(kanji -> entries), words=OrderedDict(word -> entries), errors={value: error})
+        Kanji and words are in order of first appearance
+        """
+        documents = iter(documents)
+        while True:
+            window = list(itertools.islice(documents, self._window))
+            if not window:
+                return
+
+            window = [text.decode('utf-8') if isinstance(text, str) else text for text in window]
+            found = [(self._distinct(self.kanji_pattern, text),
+                self._distinct(self.word_pattern, text) if self._words else []) for text in window]
+
+            kanji = collections.OrderedDict.fromkeys(k for document_kanji, words in found for k in document_kanji)
+            results = dict((result['search_value'], result)
+                for result in self._client.get_kanji_many(list(kanji), self._pack_size))
+
+            word_results = {}
+            if self._words:
+                words = collections.OrderedDict.fromkeys(w for document_kanji, document_words in found
+                    for w in document_words)
+                word_results = dict((result['search_value'], result)
+                    for result in self._client.get_many(SearchType.WORD_JP, list(words), priority=Priority.BULK))
+
+            for text, (document_kanji, document_words) in zip(window, found):
+                yield self._annotation(text, document_kanji, document_words, results, word_results)
+
+    def _annotation(self, text, kanji, words, kanji_results, word_results):
+        annotation = dict(text=text, kanji=collections.OrderedDict(), words=collections.OrderedDict(), errors={})
+        for values, results, field in ((kanji, kanji_results, 'kanji'), (words, word_results, 'words')):
+            for value in values:
+                result = results[value]
+                if result['error'] is not None:
+                    annotation['errors'][value] = result['error']
+                else:
+                    annotation[field][value] = result['entries']
+        return annotation
+
+    def annotate_text(self, text):
+        """
+        Annotates a single document
+        """
+        return next(self.annotate([text]))
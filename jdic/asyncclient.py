@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from deadline import Deadline
+from jdic import Client, SearchType
+from executor import WorkerPool
+
+class AsyncClient(object):
+    """
+    Non-blocking version of Client. Each lookup runs on a bounded pool of worker threads
+    and returns a Future for its entries, parsed exactly as Client would.
+
+    Options (on top of the Client options):
+        concurrency: max number of lookups in flight at once
+        timeout: default deadline in seconds for each lookup, counted from when it is submitted
+    """
+    def __init__(self, options=None):
+        options = options or {}
+        self._client = options.get('client') or Client(options)
+        self._timeout = options.get('timeout')
+        self._workers = WorkerPool(options.get('concurrency', 4))
+
+    def _lookup(self, search_type, search_value, deadline):
+        #time spent waiting for a worker counts against the deadline, the lookup only gets what is left
+        return self._client.lookup(search_type, search_value, deadline.remaining() if deadline is not None else None)
+    
+    def _submit(self, search_type, search_value, timeout):
+        deadline = Deadline.after(timeout if timeout is not None else self._timeout)
+        return self._workers.submit(self._lookup, search_type, search_value, deadline)
+
+    def get_word_en(self, word, timeout=None):
+        """
+        Gets the English/Japanese definition for a given word entered in English
+        """
+        return self._submit(SearchType.WORD_EN, word, timeout)
+
+    def get_word_jp(self, word, timeout=None):
+        """
+        Gets the English/Japanese definition for a given word entered in Japanese
+        """
+        return self._submit(SearchType.WORD_JP, word, timeout)
+
+    def get_kanji(self, kanji, timeout=None):
+        """
+        Gets the definition and readings for a given kanji character
+        """
+        return self._submit(SearchType.KANJI_SINGLE, kanji, timeout)
+
+    def get_kanji_by_radical(self, radical, timeout=None):
+        """
+        Gets the definitions and readings for all kanji containing a given kanji radical
+        """
+        return self._submit(SearchType.KANJI_BY_RADICAL, radical, timeout)
+
+    def close(self, wait=True):
+        """
+        Stops the worker threads and closes the underlying client
+        """
+        self._workers.shutdown(wait)
+        self._client.close()
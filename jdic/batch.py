@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import json
+
+from entries import entry_to_dict
+from executor import WorkerPool
+from scheduler import Priority
+
+def read_terms(lines):
+    """
+    Yields the search terms from an iterable of lines, one term per non-blank line
+    """
+    for line in lines:
+        if isinstance(line, str):
+            line = line.decode('utf-8')
+        term = line.strip()
+        if term:
+            yield term
+
+def run_batch(client, search_type, lines, output, workers=8):
+    """
+    Looks up every term read from lines concurrently, writing one JSON object per line to output as lookups finish:
+        {"search_value": ..., "entries": [...]} or {"search_value": ..., "error": "..."}
+
+    Input is read as lookups complete, so memory use stays the same whatever the input size.
+    Returns the number of (lookups, errors)
+    """
+    def lookup(term):
+        try:
+            entries = client.lookup(search_type, term, priority=Priority.BULK)
+            return dict(search_value=term, entries=[entry_to_dict(entry) for entry in entries])
+        except Exception as e:
+            return dict(search_value=term, error='{0}: {1}'.format(type(e).__name__, e))
+
+    executor = WorkerPool(workers)
+    lookups = errors = 0
+    try:
+        for future in executor.imap_unordered(lookup, read_terms(lines)):
+            result = future.result()
+            lookups += 1
+            errors += 'error' in result
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+    except:
+        executor.shutdown(wait=False)
+        raise
+
+    executor.shutdown()
+    return lookups, errors
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import cPickle as pickle
+import collections
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+def key_digest(key):
+    """
+    Returns the sha1 digest of a (search_type, search_value) key
+    """
+    search_type, search_value = key
+    if isinstance(search_value, unicode):
+        search_value = search_value.encode('utf-8')
+    return hashlib.sha1('{0}\0{1}'.format(search_type, search_value)).digest()
+
+class Cache(object):
+    """
+    Base class for caches of parsed jdic entries, keyed on (search_type, search_value).
+
+    get() returns None on a miss. An empty list is a valid (negative) result
+    """
+    def __init__(self, options=None):
+        options = options or {}
+        self._ttl = options.get('ttl', 3600)
+        self._negative_ttl = options.get('negative_ttl', 300)
+        self._stats_lock = threading.Lock()
+        self._stats = dict(hits=0, misses=0, evictions=0, expirations=0)
+
+    def _expiry(self, entries):
+        #empty responses are cached for a shorter time, new entries may still turn up
+        ttl = self._ttl if entries else self._negative_ttl
+        return time.time() + ttl if ttl is not None else None
+
+    def _expired(self, expires):
+        return expires is not None and expires <= time.time()
+
+    def _count(self, stat, amount=1):
+        with self._stats_lock:
+            self._stats[stat] += amount
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def get(self, key):
+        pass
+
+    def set(self, key, entries):
+        pass
+
+    def clear(self):
+        pass
+
+class MemoryCache(Cache):
+    """
+    Bounded in-memory LRU cache with ttl expiry
+
+    Options:
+        maxsize: max number of keys held before the least recently used is evicted
+        ttl: seconds a non-empty result is kept, None to keep until evicted
+        negative_ttl: seconds an empty result is kept
+    """
+    def __init__(self, options=None):
+        super(MemoryCache, self).__init__(options)
+        options = options or {}
+        self._maxsize = options.get('maxsize', 1024)
+        self._lock = threading.Lock()
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None and self._expired(item[0]):
+                item = None
+                self._count('expirations')
+            if item is not None:
+                #re-insert to mark as most recently used
+                self._items[key] = item
+
+        if item is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return item[1]
+
+    def set(self, key, entries, expires=None):
+        expires = expires if expires is not None else self._expiry(entries)
+        evicted = 0
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (expires, entries)
+            while len(self._items) > self._maxsize:
+                self._items.popitem(last=False)
+                evicted += 1
+
+        if evicted:
+            self._count('evictions', evicted)
+
+    def items(self):
+        """
+        Returns a (key, expires, entries) tuple for every item that hasn't expired, least recently used first
+        """
+        with self._lock:
+            return [(key, expires, entries) for key, (expires, entries) in self._items.items()
+                if not self._expired(expires)]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+class DiskCache(Cache):
+    """
+    Persistent cache storing one pickle file per key in a directory, survives restarts
+
+    Options:
+        path: directory to store entries in, a temporary directory is used if not given
+        ttl: seconds a non-empty result is kept, None to keep forever
+        negative_ttl: seconds an empty result is kept
+        compress: zlib compression level (1-9) for stored entries, 0 to store them uncompressed.
+            Files written either way can be read whatever the setting
+    """
+    def __init__(self, options=None):
+        super(DiskCache, self).__init__(options)
+        options = options or {}
+        self._path = options.get('path') or tempfile.mkdtemp(prefix='jdic-cache-')
+        self._compress = options.get('compress', 0)
+        try:
+            os.makedirs(self._path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _filename(self, key):
+        return os.path.join(self._path, key_digest(key).encode('hex'))
+
+    def _load(self, filename):
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            #pickles start with the protocol opcode, compressed entries with a zlib header
+            if data[:1] == '\x78':
+                data = zlib.decompress(data)
+            return pickle.loads(data)
+        except (IOError, EOFError, zlib.error, pickle.UnpicklingError):
+            return None
+
+    def get_item(self, key):
+        """
+        Returns the (expires, entries) tuple stored for the given key, or None
+        """
+        filename = self._filename(key)
+        item = self._load(filename)
+        if item is not None and self._expired(item[0]):
+            self._count('expirations')
+            self._remove(filename)
+            item = None
+
+        self._count('hits' if item is not None else 'misses')
+        return item
+
+    def get(self, key):
+        item = self.get_item(key)
+        return item[1] if item is not None else None
+
+    def set(self, key, entries, expires=None):
+        expires = expires if expires is not None else self._expiry(entries)
+
+        #write to a temporary file first, so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self._path)
+        data = pickle.dumps((expires, entries), pickle.HIGHEST_PROTOCOL)
+        if self._compress:
+            data = zlib.compress(data, self._compress)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, self._filename(key))
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self._path):
+            self._remove(os.path.join(self._path, name))
+
+class TieredCache(Cache):
+    """
+    Two level cache: a MemoryCache in front of an optional DiskCache.
+
+    Disk hits are promoted into memory, with the expiry they were stored with
+    """
+    def __init__(self, memory=None, disk=None):
+        super(TieredCache, self).__init__()
+        self.memory = memory if memory is not None else MemoryCache()
+        self.disk = disk
+
+    def get(self, key):
+        entries = self.memory.get(key)
+        if entries is None and self.disk is not None:
+            item = self.disk.get_item(key)
+            if item is not None:
+                self.memory.set(key, item[1], item[0])
+                entries = item[1]
+
+        self._count('hits' if entries is not None else 'misses')
+        return entries
+
+    def set(self, key, entries):
+        self.memory.set(key, entries)
+        if self.disk is not None:
+            self.disk.set(key, entries)
+
+    def items(self):
+        return self.memory.items()
+
+    def stats(self):
+        stats = super(TieredCache, self).stats()
+        stats['memory'] = self.memory.stats()
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import zlib
+
+#content codings sent in the Accept-Encoding header when compression is enabled
+accept_encoding = 'gzip, deflate'
+
+class DecompressingResponse(object):
+    """
+    File-like wrapper decompressing a gzip or deflate encoded response as it is read.
+
+    Reads are bounded: read(amt) pulls at most amt compressed bytes at a time and returns at most
+    amt decompressed bytes (more only for the final flush), so streaming parses keep their memory use
+    """
+    def __init__(self, response, encoding):
+        self._response = response
+        self._encoding = encoding
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+        self._started = False
+        self._eof = False
+        self.compressed_bytes = 0
+
+    def _decompress(self, data, amt=0):
+        try:
+            output = self._decompressor.decompress(data, amt)
+        except zlib.error:
+            if self._encoding != 'deflate' or self._started:
+                raise
+            #some servers send a raw deflate stream without the zlib header
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            output = self._decompressor.decompress(data, amt)
+        self._started = True
+        return output
+
+    def _read_raw(self, amt=None):
+        data = self._response.read() if amt is None else self._response.read(amt)
+        self.compressed_bytes += len(data)
+        return data
+
+    def read(self, amt=None):
+        if self._eof:
+            return ''
+
+        if amt is None:
+            data = self._decompressor.unconsumed_tail + self._read_raw()
+            self._eof = True
+            return self._decompress(data) + self._decompressor.flush()
+
+        while True:
+            data = self._decompressor.unconsumed_tail
+            if not data:
+                data = self._read_raw(amt)
+                if not data:
+                    self._eof = True
+                    return self._decompressor.flush()
+
+            output = self._decompress(data, amt)
+            if output:
+                return output
+
+    def settimeout(self, timeout):
+        if hasattr(self._response, 'settimeout'):
+            self._response.settimeout(timeout)
+
+    def close(self):
+        self._response.close()
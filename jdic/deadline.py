@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import time
+
+from executor import TimeoutError
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a lookup doesn't complete before its deadline
+    """
+    pass
+
+class Deadline(object):
+    """
+    Time by which a lookup has to complete. The same deadline is handed down to everything the lookup
+    does: waiting for the scheduler, connecting, reading and parsing, retries and mirror failover,
+    so the time spent in each step comes out of a single budget
+    """
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires = time.time() + timeout
+
+    @classmethod
+    def after(cls, timeout):
+        """
+        Returns a deadline timeout seconds from now, None if timeout is None
+        """
+        return cls(timeout) if timeout is not None else None
+
+    def expired(self):
+        return time.time() >= self.expires
+
+    def remaining(self):
+        """
+        Returns the seconds left, raises DeadlineExceeded if there are none
+        """
+        remaining = self.expires - time.time()
+        if remaining <= 0:
+            raise self.exceeded()
+        return remaining
+
+    def check(self):
+        if self.expired():
+            raise self.exceeded()
+
+    def exceeded(self):
+        return DeadlineExceeded('lookup timed out after {0:g} s'.format(self.timeout))
+
+def remaining(deadline, timeout=None):
+    """
+    Returns the smaller of timeout and the seconds left before the deadline, either may be None
+    """
+    if deadline is None:
+        return timeout
+    left = deadline.remaining()
+    return left if timeout is None else min(timeout, left)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Compact entry objects, an opt-in alternative to the dicts returned by the request handlers
+"""
+
+#wordtype tags (n, vs, v5r...) repeat across most entries, keep a single copy of each
+_wordtypes = {}
+
+def intern_wordtype(tag):
+    return _wordtypes.setdefault(tag, tag)
+
+class WordEntry(object):
+    """
+    Word dictionary entry. Supports item access with the same keys as the dict format
+    """
+    __slots__ = ('word', 'reading', 'wordtype', 'definition')
+
+    def __init__(self, word, reading, wordtype, definition):
+        self.word = word
+        self.reading = reading
+        self.wordtype = tuple(intern_wordtype(tag) for tag in wordtype)
+        self.definition = definition
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        return isinstance(other, WordEntry) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.word, self.reading, self.wordtype, self.definition))
+
+    def __repr__(self):
+        return 'WordEntry({0!r}, {1!r})'.format(self.word, self.reading)
+
+    def to_dict(self):
+        return dict(
+            word=self.word,
+            reading=self.reading,
+            wordtype=list(self.wordtype),
+            definition=self.definition
+        )
+
+class KanjiEntry(object):
+    """
+    KANJIDIC entry that keeps the raw line and only parses fields when they are first accessed.
+
+    Besides the dict format keys (kanji, meanings, readings), the KANJIDIC codes are
+    available through codes and properties such as stroke_count, grade and skip
+    """
+    __slots__ = ('raw', '_parser', '_fields', '_codes')
+
+    #multi letter code prefixes, every other code is a single letter followed by its value
+    code_prefixes = ('XDR', 'ZPP', 'ZSP', 'ZBP', 'ZRP', 'DA', 'DB', 'DC', 'DF', 'DG', 'DH', 'DJ', 'DK', 'DM',
+        'DO', 'DP', 'DR', 'DS', 'DT', 'IN', 'MN', 'MP', 'XH', 'XI', 'XJ', 'XN', 'XO')
+
+    def __init__(self, raw, parser):
+        self.raw = raw
+        self._parser = parser
+        self._fields = None
+        self._codes = None
+
+    def _get_fields(self):
+        if self._fields is None:
+            parser = self._parser
+            self._fields = (
+                parser._parse_kanji(self.raw),
+                parser._parse_meanings(self.raw),
+                parser._parse_on_yomi(self.raw),
+                parser._parse_kun_yomi(self.raw)
+            )
+        return self._fields
+
+    @property
+    def kanji(self):
+        return self._get_fields()[0]
+
+    @property
+    def meanings(self):
+        return self._get_fields()[1]
+
+    @property
+    def readings(self):
+        fields = self._get_fields()
+        return dict(on=fields[2], kun=fields[3], names=[])
+
+    @property
+    def nanori(self):
+        """
+        Name readings, listed after the T1 marker
+        """
+        start = self.raw.find(' T1 ')
+        if start < 0:
+            return []
+        end = self.raw.find('{', start)
+        return self.raw[start + 4:end if end >= 0 else len(self.raw)].split()
+
+    @property
+    def codes(self):
+        """
+        Dict of KANJIDIC code -> list of values, e.g. {'S': ['5'], 'Y': ['fu4']...}
+        """
+        if self._codes is None:
+            codes = {}
+            #kanji and JIS code come first, the codes run up to the first reading
+            for token in self.raw.split(' ')[2:]:
+                if not token or ord(token[0]) > 127:
+                    break
+                prefix = token[0]
+                if prefix in 'DIMXZ':
+                    prefix = next((p for p in self.code_prefixes if token.startswith(p)), prefix)
+                codes.setdefault(prefix, []).append(token[len(prefix):])
+            self._codes = codes
+        return self._codes
+
+    def _code(self, prefix, convert=None):
+        values = self.codes.get(prefix)
+        if not values:
+            return None
+        return convert(values[0]) if convert else values[0]
+
+    @property
+    def jis(self):
+        return self.raw.split(' ', 2)[1]
+
+    @property
+    def unicode(self):
+        return self._code('U')
+
+    @property
+    def radical(self):
+        return self._code('B', int)
+
+    @property
+    def grade(self):
+        return self._code('G', int)
+
+    @property
+    def stroke_count(self):
+        return self._code('S', int)
+
+    @property
+    def frequency(self):
+        return self._code('F', int)
+
+    @property
+    def jlpt(self):
+        return self._code('J', int)
+
+    @property
+    def nelson(self):
+        return self._code('N', int)
+
+    @property
+    def skip(self):
+        return self._code('P')
+
+    @property
+    def pinyin(self):
+        return self.codes.get('Y', [])
+
+    @property
+    def korean(self):
+        return self.codes.get('W', [])
+
+    def __getitem__(self, key):
+        if key not in ('kanji', 'meanings', 'readings'):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        return isinstance(other, KanjiEntry) and self.raw == other.raw
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.raw)
+
+    def __repr__(self):
+        return 'KanjiEntry({0!r})'.format(self.kanji)
+
+    def to_dict(self):
+        return dict(
+            kanji=self.kanji,
+            meanings=self.meanings,
+            readings=self.readings
+        )
+
+def entry_to_dict(entry):
+    """
+    Returns the dict format of an entry, whichever format it was parsed in
+    """
+    if isinstance(entry, (WordEntry, KanjiEntry)):
+        return entry.to_dict()
+    return entry
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import Queue
+import threading
+import time
+
+class CancelledError(Exception):
+    pass
+
+class TimeoutError(Exception):
+    pass
+
+class Future(object):
+    """
+    Result of a lookup that runs in the background
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    CANCELLED = 'cancelled'
+    FINISHED = 'finished'
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._state = Future.PENDING
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def cancel(self):
+        """
+        Cancels the call if it hasn't started yet. Returns False if it is already running or done
+        """
+        with self._condition:
+            if self._state in (Future.RUNNING, Future.FINISHED):
+                return False
+            if self._state == Future.PENDING:
+                self._state = Future.CANCELLED
+                self._condition.notify_all()
+
+        self._invoke_callbacks()
+        return True
+
+    def cancelled(self):
+        return self._state == Future.CANCELLED
+
+    def running(self):
+        return self._state == Future.RUNNING
+
+    def done(self):
+        return self._state in (Future.CANCELLED, Future.FINISHED)
+
+    def _wait(self, timeout):
+        with self._condition:
+            if not self.done():
+                self._condition.wait(timeout)
+            if self._state == Future.CANCELLED:
+                raise CancelledError()
+            if self._state != Future.FINISHED:
+                raise TimeoutError()
+
+    def result(self, timeout=None):
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        with self._condition:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_running(self):
+        """
+        Marks the future as running. Returns False if it was cancelled and shouldn't run
+        """
+        with self._condition:
+            if self._state == Future.CANCELLED:
+                return False
+            self._state = Future.RUNNING
+            return True
+
+    def set_result(self, result):
+        with self._condition:
+            self._result = result
+            self._state = Future.FINISHED
+            self._condition.notify_all()
+        self._invoke_callbacks()
+
+    def set_exception(self, exception):
+        with self._condition:
+            self._exception = exception
+            self._state = Future.FINISHED
+            self._condition.notify_all()
+        self._invoke_callbacks()
+
+    def _invoke_callbacks(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+def as_completed(futures, timeout=None):
+    """
+    Yields the given futures as they finish (or are cancelled)
+    """
+    finished = Queue.Queue()
+    futures = list(futures)
+    for future in futures:
+        future.add_done_callback(finished.put)
+
+    end = time.time() + timeout if timeout is not None else None
+    for i in range(len(futures)):
+        remaining = end - time.time() if end is not None else None
+        if remaining is not None and remaining <= 0:
+            raise TimeoutError()
+        try:
+            #always pass a timeout, so the wait can be interrupted
+            yield finished.get(True, remaining if remaining is not None else 3600 * 24 * 365)
+        except Queue.Empty:
+            raise TimeoutError()
+
+class WorkerPool(object):
+    """
+    Fixed size pool of daemon threads running submitted calls. Threads are started on first use
+    """
+    def __init__(self, workers=4):
+        self._workers = workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def _start_workers(self):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot submit after shutdown')
+            while len(self._threads) < self._workers:
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            future, fn, args, kwargs = item
+            if not future.set_running():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                #fail the future instead of leaving it running forever and losing the worker
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules fn(*args, **kwargs) to run on a worker thread, returns a Future for its result
+        """
+        self._start_workers()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def imap_unordered(self, fn, iterable, window=None):
+        """
+        Calls fn on each item of iterable, yielding the futures as they complete.
+
+        Items are only pulled from iterable as results are yielded, at most window calls are
+        pending at once (twice the number of workers by default), so memory use doesn't grow with the input
+        """
+        window = window or self._workers * 2
+        finished = Queue.Queue()
+        items = iter(iterable)
+        pending = 0
+        exhausted = False
+
+        while True:
+            while not exhausted and pending < window:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                self.submit(fn, item).add_done_callback(finished.put)
+                pending += 1
+
+            if not pending:
+                return
+            #always pass a timeout, so the wait can be interrupted
+            future = finished.get(True, 3600 * 24 * 365)
+            pending -= 1
+            yield future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._shutdown = True
+            threads = list(self._threads)
+        for thread in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
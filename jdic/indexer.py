@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+import array
+import hashlib
+import marshal
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+from jdic import WordRequestHandler
+from local import LocalRequest
+
+#file layout: magic, header, table directory, chunk records, then the tables and the chunk blobs.
+#the header has the size, modification time and sha1 digest of the source, to tell whether the index is up to date.
+#a table of n keys is a sorted string table: n + 1 uint32 positions of the keys in the key bytes, n + 1 uint32
+#positions of their postings, the utf-8 key bytes in sorted order, then the postings (uint32 source offsets).
+#a chunk has two blobs, zlib compressed marshals of the tables and of the entries parsed from it, with offsets
+#relative to the chunk, so unchanged chunks are reused on a rebuild
+MAGIC = 'JDICIDX2\n'
+HEADER = struct.Struct('<Qd20s16s16sIQI')
+TABLE = struct.Struct('<16sQI')
+CHUNK = struct.Struct('<20sQQQII')
+POSITION = struct.Struct('<I')
+
+def _uint32_bytes(values):
+    values = array.array('I', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tostring()
+
+def detect_kind(path):
+    """
+    Returns 'edict' or 'kanjidic' depending on what the dictionary file at path looks like
+    """
+    with open(path, 'rb') as f:
+        for i, line in enumerate(f):
+            if i == 20:
+                break
+            if line.strip() and not line.startswith('#'):
+                #every EDICT line has its glosses between slashes, KANJIDIC lines have none
+                return 'edict' if ' /' in line else 'kanjidic'
+    return 'kanjidic'
+
+def _digest(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), ''):
+            digest.update(block)
+    return digest.digest()
+
+def _split_chunks(data, chunk_lines):
+    """
+    Splits data into (start, end) chunks of whole lines. Chunks end after lines whose checksum is a multiple
+    of chunk_lines, so an edit only changes the chunk it is in: the boundaries around it stay where they were
+    """
+    chunks = []
+    size = len(data)
+    start = position = lines = 0
+    while position < size:
+        end = data.find('\n', position)
+        end = size if end == -1 else end + 1
+        lines += 1
+        if lines >= chunk_lines * 4 or (lines >= chunk_lines // 4 and
+                (zlib.crc32(data[position:end]) & 0xffffffff) % chunk_lines == 0):
+            chunks.append((start, end))
+            start = end
+            lines = 0
+        position = end
+    if start < size:
+        chunks.append((start, size))
+    return chunks
+
+def _parse_chunk(task):
+    #runs in a worker process, returns the (tables, entries) blobs of the chunk, keys are utf-8 encoded
+    path, kind, encoding, start, end = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    if kind == 'edict':
+        handler = WordRequestHandler()
+        words = {}
+        keywords = {}
+        entries = []
+        offset = 0
+        for line in data.split('\n'):
+            decoded = line.decode(encoding, 'replace')
+            keys = LocalRequest._edict_keys(decoded)
+            if keys is not None:
+                for key in keys[0]:
+                    words.setdefault(key.encode('utf-8'), []).append(offset)
+                for keyword in keys[1]:
+                    keywords.setdefault(keyword.encode('utf-8'), []).append(offset)
+
+                m = handler.entry_pattern.match(decoded)
+                if m is not None:
+                    entries.append((offset, handler._parse_match(m), '/(P)/' in decoded))
+            offset += len(line) + 1
+        tables = dict(words=words, keywords=keywords)
+    else:
+        kanji = {}
+        offset = 0
+        for line in data.split('\n'):
+            if line and not line.startswith('#'):
+                kanji.setdefault(line.decode(encoding, 'replace')[0].encode('utf-8'), []).append(offset)
+            offset += len(line) + 1
+        tables = dict(kanji=kanji)
+        entries = []
+
+    return zlib.compress(marshal.dumps(tables)), zlib.compress(marshal.dumps(entries))
+
+def _table_bytes(table):
+    keys = sorted(table)
+    key_positions = [0]
+    postings_positions = [0]
+    postings = []
+    for key in keys:
+        key_positions.append(key_positions[-1] + len(key))
+        offsets = table[key]
+        postings_positions.append(postings_positions[-1] + len(offsets))
+        postings.extend(offsets)
+    return ''.join([_uint32_bytes(key_positions), _uint32_bytes(postings_positions), ''.join(keys),
+        _uint32_bytes(postings)])
+
+def _write(path, source, kind, encoding, chunks, tables):
+    #source is (size, mtime, digest), chunks are (digest, start, length, (tables blob, entries blob)),
+    #written to a temporary file first so open indexes stay valid
+    names = sorted(tables)
+    offset = len(MAGIC) + HEADER.size + TABLE.size * len(names) + CHUNK.size * len(chunks)
+    directory = []
+    table_data = []
+    for name in names:
+        data = _table_bytes(tables[name])
+        directory.append(TABLE.pack(name, offset, len(tables[name])))
+        table_data.append(data)
+        offset += len(data)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(source[0], source[1], source[2], kind, encoding, len(names),
+            len(MAGIC) + HEADER.size + TABLE.size * len(names), len(chunks)))
+        f.write(''.join(directory))
+        for digest, start, length, (tables_blob, entries_blob) in chunks:
+            f.write(CHUNK.pack(digest, start, length, offset, len(tables_blob), len(entries_blob)))
+            offset += len(tables_blob) + len(entries_blob)
+        for data in table_data:
+            f.write(data)
+        for digest, start, length, blobs in chunks:
+            f.write(''.join(blobs))
+    os.rename(tmp, path)
+
+class SortedTable(object):
+    """
+    Memory mapped sorted string table of a DictionaryIndex, mapping keys to lists of source offsets
+    """
+    def __init__(self, data, offset, size):
+        self._map = data
+        self._size = size
+        self._key_positions = offset
+        self._postings_positions = offset + POSITION.size * (size + 1)
+        self._keys = self._postings_positions + POSITION.size * (size + 1)
+        self._postings = self._keys + self._position(self._key_positions, size)
+
+    def __len__(self):
+        return self._size
+
+    def _position(self, start, i):
+        return POSITION.unpack_from(self._map, start + POSITION.size * i)[0]
+
+    def _key(self, i):
+        return self._map[self._keys + self._position(self._key_positions, i):
+            self._keys + self._position(self._key_positions, i + 1)]
+
+    def __iter__(self):
+        for i in xrange(self._size):
+            yield self._key(i).decode('utf-8')
+
+    def get(self, key, default=None):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = self._key(mid)
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                start = self._position(self._postings_positions, mid)
+                count = self._position(self._postings_positions, mid + 1) - start
+                return list(struct.unpack_from('<{0}I'.format(count), self._map, self._postings + POSITION.size * start))
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+class DictionaryIndex(object):
+    """
+    On-disk index of an EDICT or KANJIDIC file written by build_index(). Opening one only reads its header,
+    tables are memory mapped and binary searched:
+
+        index = DictionaryIndex('edict.index')
+        index['words'].get(u'工場')  #source offsets of the entries with that headword or reading
+
+    EDICT indexes have 'words' (headwords and readings) and 'keywords' (gloss words) tables, KANJIDIC
+    indexes a 'kanji' table. Pass them to LocalRequest with the edict_index and kanjidic_index options
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._map = ''
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError('{0} is not a jdic index'.format(path))
+
+        (self.source_size, self.source_mtime, self.source_digest, kind, encoding, table_count,
+            self._chunks_offset, self._chunk_count) = HEADER.unpack_from(self._map, len(MAGIC))
+        self.kind = kind.rstrip('\0')
+        self.encoding = encoding.rstrip('\0')
+
+        self._tables = {}
+        for i in range(table_count):
+            name, offset, size = TABLE.unpack_from(self._map, len(MAGIC) + HEADER.size + i * TABLE.size)
+            self._tables[name.rstrip('\0')] = SortedTable(self._map, offset, size)
+
+    def __getitem__(self, name):
+        return self._tables[name]
+
+    def tables(self):
+        return sorted(self._tables)
+    
+    def is_current(self, source):
+        """
+        Returns whether the index is up to date with the file at source: it has the same size and either the same
+        modification time or, when that changed, the same content
+        """
+        stat = os.stat(source)
+        if stat.st_size != self.source_size:
+            return False
+        return stat.st_mtime == self.source_mtime or _digest(source) == self.source_digest
+
+    def _chunks(self):
+        """
+        Yields (digest, start, length, (tables blob, entries blob)) for every chunk of the source
+        """
+        for i in xrange(self._chunk_count):
+            digest, start, length, offset, tables_length, entries_length = CHUNK.unpack_from(self._map,
+                self._chunks_offset + i * CHUNK.size)
+            middle = offset + tables_length
+            yield digest, start, length, (self._map[offset:middle], self._map[middle:middle + entries_length])
+
+    def entries(self):
+        """
+        Yields (source offset, entry dict, priority) for every entry of an EDICT index, parsed as WordRequestHandler does
+        """
+        for digest, start, length, blobs in self._chunks():
+            for offset, entry, priority in marshal.loads(zlib.decompress(blobs[1])):
+                yield start + offset, entry, priority
+
+    def close(self):
+        if not isinstance(self._map, str):
+            self._map.close()
+        self._file.close()
+
+def build_index(source, path, options=None):
+    """
+    Builds an index of the EDICT or KANJIDIC file at source and writes it to path.
+
+    The source is split into chunks of lines that are parsed in parallel by a pool of processes, then merged
+    into sorted string tables. If path already holds an index of the same kind, only the chunks that changed
+    since it was built are parsed again.
+
+    Options:
+        kind: 'edict' or 'kanjidic', detected from the source by default
+        encoding: encoding of the source, EUC-JP by default
+        processes: number of worker processes, the number of cpus by default
+        chunk_lines: average number of lines per chunk
+
+    Returns the number of (parsed, reused) chunks
+    """
+    options = options or {}
+    kind = options.get('kind') or detect_kind(source)
+    encoding = options.get('encoding', 'euc-jp')
+    if kind not in ('edict', 'kanjidic'):
+        raise ValueError("kind must be 'edict' or 'kanjidic'")
+
+    with open(source, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            data = ''
+        try:
+            if len(data) >= 2 ** 32:
+                raise ValueError('{0} is too large to index'.format(source))
+            digest = hashlib.sha1()
+            chunks = []
+            for start, end in _split_chunks(data, options.get('chunk_lines', 4096)):
+                chunk = data[start:end]
+                digest.update(chunk)
+                chunks.append((hashlib.sha1(chunk).digest(), start, end))
+            source_info = (len(data), stat.st_mtime, digest.digest())
+        finally:
+            if not isinstance(data, str):
+                data.close()
+
+    previous = {}
+    if os.path.exists(path):
+        try:
+            index = DictionaryIndex(path)
+        except ValueError:
+            index = None
+        if index is not None:
+            try:
+                if index.kind == kind and index.encoding == encoding:
+                    previous = dict((digest, blobs) for digest, start, length, blobs in index._chunks())
+            finally:
+                index.close()
+
+    tasks = [(source, kind, encoding, start, end) for digest, start, end in chunks if digest not in previous]
+    processes = options.get('processes') or multiprocessing.cpu_count()
+    if processes > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(processes, len(tasks)))
+        try:
+            parsed = pool.map(_parse_chunk, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parsed = [_parse_chunk(task) for task in tasks]
+    parsed = dict(((task[3], task[4]), blobs) for task, blobs in zip(tasks, parsed))
+
+    #merged in source order, so the postings of every key stay sorted
+    tables = {}
+    records = []
+    for digest, start, end in chunks:
+        blobs = previous.get(digest) or parsed[(start, end)]
+        records.append((digest, start, end - start, blobs))
+        for name, table in marshal.loads(zlib.decompress(blobs[0])).items():
+            merged = tables.setdefault(name, {})
+            for key, offsets in table.iteritems():
+                if start:
+                    offsets = [start + offset for offset in offsets]
+                merged.setdefault(key, []).extend(offsets)
+
+    if not tables:
+        tables = dict((name, {}) for name in (('words', 'keywords') if kind == 'edict' else ('kanji',)))
+
+    _write(path, source_info, kind, encoding, records, tables)
+    return len(tasks), len(chunks) - len(tasks)
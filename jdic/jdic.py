@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 import argparse
+import codecs
 import re
+import sys
+import threading
+import time
 import urllib2
 
+from compression import DecompressingResponse, accept_encoding
+from entries import WordEntry, KanjiEntry
+from deadline import Deadline, DeadlineExceeded, remaining
+from executor import CancelledError, Future, TimeoutError, WorkerPool, as_completed
+from pool import ConnectionPool
+from radicals import RadicalIndex
+from scheduler import Priority
+
 class SearchType:
     WORD_EN = 'word_en'
     WORD_JP = 'word_jp'
@@ -13,64 +25,525 @@ class Client(object):
     """
     Provides methods to access the jdic api
     
+    Every get_* method takes an optional timeout in seconds, the client's timeout option by default. It is a
+    deadline for the whole call, waiting for the scheduler, retries and mirror failover included, past which
+    jdic.DeadlineExceeded is raised and the connection in use is dropped
+    
     Details: http://www.csse.monash.edu.au/~jwb/wwwjdicinf.html
     """
     
     def __init__(self, options=None):
-        self._urllib = options['urllib'] if options and options['urllib'] else urllib2
+        options = options or {}
+        self._urllib = options['urllib'] if options.get('urllib') else urllib2
+        
+        #optional hooks for timings and counters, see jdic.metrics
+        self._instrumentation = options.get('instrumentation')
+        
+        #connections are pooled and shared across lookups, unless a urllib replacement is given
+        if 'pool' in options:
+            self._pool = options['pool']
+        elif options.get('urllib'):
+            self._pool = None
+        else:
+            self._pool = ConnectionPool(dict(instrumentation=self._instrumentation))
+        
+        #responses are requested gzip/deflate compressed, unless compression is False
+        self._compression = options.get('compression', True)
+        
+        #optional cache of parsed entries, see jdic.cache
+        self._cache = options.get('cache')
+        self._base_url = options.get('base_url')
+        
+        #'dict' or 'object', see jdic.entries
+        self._entry_format = options.get('entry_format', 'dict')
+        
+        #optional RadicalIndex (or path to a prebuilt one, loaded on first use) for local radical lookups
+        self._radical_index = options.get('radical_index')
+        
+        #alternative Request backend (e.g. jdic.local.LocalRequest), used instead of http requests
+        self._request = options.get('request')
+        
+        #worker threads for batch lookups, started on first use
+        self._workers = options.get('workers', 4)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        
+        #concurrent lookups of the same value share a single request, unless coalesce is False
+        self._coalesce = options.get('coalesce', True)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        
+        #optional MirrorSet (or list of mirror base urls), lookups go to the fastest healthy mirror
+        self._mirrors = options.get('mirrors')
+        self._retries = options.get('retries', 2)
+        if self._mirrors is not None and not hasattr(self._mirrors, 'select'):
+            from mirrors import MirrorSet
+            self._mirrors = MirrorSet(dict(mirrors=self._mirrors))
+        
+        #optional Scheduler shaping the requests sent upstream (rate limit, adaptive concurrency, priority lanes)
+        self._scheduler = options.get('scheduler')
+        
+        #default deadline in seconds for each lookup, covering queueing, retries, connecting, reading and parsing
+        self._timeout = options.get('timeout')
+    
+    def _deadline(self, timeout=None):
+        return Deadline.after(timeout if timeout is not None else self._timeout)
+    
+    def _http_request(self):
+        options = dict(
+            urllib=self._urllib,
+            pool=self._pool,
+            entry_format=self._entry_format,
+            instrumentation=self._instrumentation,
+            compression=self._compression
+        )
+        if self._mirrors is not None:
+            from mirrors import MirroredRequest
+            return MirroredRequest(dict(mirrors=self._mirrors, retries=self._retries, request_options=options))
+        
+        request = HttpRequest(options)
+        if self._base_url:
+            request.set_base_url(self._base_url)
+        return request
+    
+    def _get(self, search_type, search_value, deadline=None, priority=Priority.INTERACTIVE):
+        key = (search_type, search_value)
+        if self._cache is not None:
+            entries = self._cache.get(key)
+            if entries is not None:
+                return entries
+        
+        if deadline is None:
+            deadline = self._deadline()
+        if not self._coalesce:
+            return self._fetch(key, deadline, priority)
+        
+        while True:
+            with self._inflight_lock:
+                call = self._inflight.get(key)
+                leader = call is None
+                if leader:
+                    call = self._inflight[key] = Future()
+            if leader:
+                break
+            
+            #wait for the request already in flight, errors are shared as well
+            if self._instrumentation is not None:
+                self._instrumentation.count('coalesced')
+            try:
+                return call.result(remaining(deadline))
+            except TimeoutError:
+                if deadline is not None and deadline.expired():
+                    raise deadline.exceeded()
+                if not call.done():
+                    raise
+                #the request ran out of its own caller's time, this lookup still has some left and tries again
+        
+        call.set_running()
+        try:
+            entries = self._fetch(key, deadline, priority)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(entries)
+            return entries
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
     
-    def get_word_en(self, word):
+    def _request_entries(self, key, deadline, priority):
+        search_type, search_value = key
+        request = self._request or self._http_request()
+        options = dict(search_value=search_value, search_type=search_type)
+        if deadline is not None:
+            options['deadline'] = deadline
+        if self._scheduler is not None:
+            return self._scheduler.run(lambda: request.get(options), priority, deadline)
+        return request.get(options)
+    
+    def _fetch(self, key, deadline, priority):
+        entries = self._request_entries(key, deadline, priority)
+        if self._cache is not None:
+            self._cache.set(key, entries)
+        return entries
+    
+    def lookup(self, search_type, search_value, timeout=None, priority=Priority.INTERACTIVE):
+        """
+        Looks up a value of the given search type, routed the same way as the matching get_* method.
+        With a scheduler, the lookup waits in the lane of the given priority
+        """
+        return self._lookup(search_type, search_value, self._deadline(timeout), priority)
+    
+    def _lookup(self, search_type, search_value, deadline, priority):
+        if search_type == SearchType.KANJI_BY_RADICAL and self._radical_index is not None:
+            return self._get_kanji_by_radicals([search_value], deadline, priority)
+        return self._get(search_type, search_value, deadline, priority)
+    
+    def get_word_en(self, word, timeout=None):
         """
         Gets the English/Japanese definition for a given word entered in English
         """
-        request = HttpRequest(dict(urllib=self._urllib))
-        options = dict(search_value=word, search_type=SearchType.WORD_EN)
-        entries = request.get(options)
-        
-        return entries
+        return self._get(SearchType.WORD_EN, word, self._deadline(timeout))
     
-    def get_word_jp(self, word):
+    def get_word_jp(self, word, timeout=None):
         """
         Gets the English/Japanese definition for a given word entered in Japanese
         """
-        request = HttpRequest(dict(urllib=self._urllib))
-        options = dict(search_value=word, search_type=SearchType.WORD_JP)
-        entries = request.get(options)
-        
-        return entries
+        return self._get(SearchType.WORD_JP, word, self._deadline(timeout))
     
-    def get_kanji(self, kanji):
+    def get_kanji(self, kanji, timeout=None):
         """
         Gets the definition and readings for a given kanji character
         """
-        request = HttpRequest(dict(urllib=self._urllib))
-        options = dict(search_value=kanji, search_type=SearchType.KANJI_SINGLE)
-        entries = request.get(options)
-        
-        return entries
+        return self._get(SearchType.KANJI_SINGLE, kanji, self._deadline(timeout))
     
-    def get_kanji_by_radical(self, radical):
+    def get_kanji_by_radical(self, radical, timeout=None):
         """
         Gets the definitions and readings for all kanji containing a given kanji radical
         """
-        request = HttpRequest(dict(urllib=self._urllib))
-        options = dict(search_value=radical, search_type=SearchType.KANJI_BY_RADICAL)
-        entries = request.get(options)
+        return self.lookup(SearchType.KANJI_BY_RADICAL, radical, timeout)
+    
+    def _get_radical_index(self):
+        if isinstance(self._radical_index, basestring):
+            self._radical_index = RadicalIndex.load(self._radical_index)
+        return self._radical_index
+    
+    def _raise_errors(self, results):
+        for result in results:
+            if result['error'] is not None:
+                raise result['error']
+    
+    def get_kanji_by_radicals(self, radicals, timeout=None):
+        """
+        Gets the definitions and readings for all kanji containing every one of the given radicals
+        
+        With a radical index the matching kanji are found locally. A local request backend then answers them
+        in a single packed lookup, over http only the radical with the fewest kanji is looked up and its result
+        is filtered. Without an index each radical is looked up and the results are intersected
+        """
+        return self._get_kanji_by_radicals(radicals, self._deadline(timeout), Priority.INTERACTIVE)
+    
+    def _get_kanji_by_radicals(self, radicals, deadline, priority):
+        if isinstance(radicals, str):
+            radicals = radicals.decode('utf-8')
+        radicals = [radical.decode('utf-8') if isinstance(radical, str) else radical for radical in radicals]
+        
+        index = self._get_radical_index()
+        if index is not None:
+            kanji = index.kanji(radicals)
+            if not kanji:
+                return []
+            if self._request is not None:
+                results = self._get_kanji_many(kanji, len(kanji), None, deadline, priority)
+                self._raise_errors(results)
+                return [entry for result in results for entry in result['entries']]
+            
+            #over http every kanji would be a request of its own, the kanji of the rarest radical come in one
+            rarest = min(radicals, key=lambda radical: len(index.kanji(radical)))
+            kanji = set(kanji)
+            entries = self._get(SearchType.KANJI_BY_RADICAL, rarest, deadline, priority)
+            return [entry for entry in entries if entry['kanji'] in kanji]
         
+        results = self._get_many(SearchType.KANJI_BY_RADICAL, radicals, None, priority, deadline)
+        self._raise_errors(results)
+        
+        entries = results[0]['entries'] if results else []
+        for result in results[1:]:
+            kanji = set(entry['kanji'] for entry in result['entries'])
+            entries = [entry for entry in entries if entry['kanji'] in kanji]
         return entries
+    
+    def _iter(self, search_type, search_value, timeout=None):
+        key = (search_type, search_value)
+        if self._cache is not None:
+            entries = self._cache.get(key)
+            if entries is not None:
+                for entry in entries:
+                    yield entry
+                return
+        
+        deadline = self._deadline(timeout)
+        request = self._request or self._http_request()
+        options = dict(search_value=search_value, search_type=search_type)
+        if deadline is not None:
+            options['deadline'] = deadline
+        entries = []
+        if self._scheduler is not None:
+            self._scheduler.acquire(Priority.INTERACTIVE, deadline)
+        start = time.time()
+        error = False
+        try:
+            for entry in request.iter_get(options):
+                entries.append(entry)
+                yield entry
+        except (DeadlineExceeded, CancelledError):
+            start = None
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            if self._scheduler is not None:
+                self._scheduler.release(time.time() - start if start is not None else None, error)
+        
+        #only complete results are cached, a caller may stop iterating early
+        if self._cache is not None:
+            self._cache.set(key, entries)
+    
+    def iter_word_en(self, word, timeout=None):
+        """
+        Streaming version of get_word_en, yields entries as they are read
+        """
+        return self._iter(SearchType.WORD_EN, word, timeout)
+    
+    def iter_word_jp(self, word, timeout=None):
+        """
+        Streaming version of get_word_jp, yields entries as they are read
+        """
+        return self._iter(SearchType.WORD_JP, word, timeout)
+    
+    def iter_kanji(self, kanji, timeout=None):
+        """
+        Streaming version of get_kanji, yields entries as they are read
+        """
+        return self._iter(SearchType.KANJI_SINGLE, kanji, timeout)
+    
+    def iter_kanji_by_radical(self, radical, timeout=None):
+        """
+        Streaming version of get_kanji_by_radical, yields entries as they are read
+        """
+        return self._iter(SearchType.KANJI_BY_RADICAL, radical, timeout)
+    
+    def _get_executor(self, workers):
+        if workers is not None:
+            return WorkerPool(workers)
+        
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = WorkerPool(self._workers)
+            return self._executor
+    
+    def _get_result(self, search_type, search_value, priority, deadline=None):
+        #a failed lookup is reported in its own result instead of failing the batch
+        try:
+            entries = self._lookup(search_type, search_value, deadline, priority)
+        except Exception as e:
+            return dict(search_value=search_value, entries=None, error=e)
+        return dict(search_value=search_value, entries=entries, error=None)
+    
+    def _timed_out(self, search_value, deadline):
+        return dict(search_value=search_value, entries=None, error=deadline.exceeded())
+    
+    def _wait(self, future, deadline):
+        """
+        Returns the result of a batch future, None if it isn't done by the deadline. A lookup still queued
+        is cancelled, a running one gives up at the same deadline and drops its connection
+        """
+        try:
+            return future.result(remaining(deadline))
+        except TimeoutError:
+            future.cancel()
+            if future.done() and not future.cancelled():
+                return future.result()
+            return None
+    
+    def _submit_many(self, executor, search_type, values, priority, deadline):
+        futures = {}
+        for value in values:
+            if value not in futures:
+                futures[value] = executor.submit(self._get_result, search_type, value, priority, deadline)
+        return futures
+    
+    def _get_many(self, search_type, values, workers, priority, deadline):
+        values = list(values)
+        executor = self._get_executor(workers)
+        try:
+            futures = self._submit_many(executor, search_type, values, priority, deadline)
+            results = {}
+            for value in values:
+                if value not in results:
+                    results[value] = self._wait(futures[value], deadline) or self._timed_out(value, deadline)
+            return [results[value] for value in values]
+        finally:
+            if executor is not self._executor:
+                executor.shutdown(wait=False)
+    
+    def get_many(self, search_type, values, workers=None, priority=Priority.BULK, timeout=None):
+        """
+        Looks up a batch of values of the given search type in parallel. Duplicate values are only looked up once.
+        With a scheduler, batch lookups wait behind interactive ones unless given another priority.
+        
+        A timeout is a deadline for the whole batch: lookups not done by then get a DeadlineExceeded error.
+        Without one, each lookup has the client's timeout.
+        
+        Returns a result dict (search_value, entries, error) for each value, in input order
+        """
+        return self._get_many(search_type, values, workers, priority, Deadline.after(timeout))
+    
+    def iter_many(self, search_type, values, workers=None, priority=Priority.BULK, timeout=None):
+        """
+        Same as get_many, but yields one result dict per distinct value as soon as its lookup completes
+        """
+        deadline = Deadline.after(timeout)
+        executor = self._get_executor(workers)
+        try:
+            futures = self._submit_many(executor, search_type, values, priority, deadline)
+            done = set()
+            try:
+                for future in as_completed(futures.values(), remaining(deadline)):
+                    done.add(future)
+                    yield future.result()
+            except TimeoutError:
+                for value, future in futures.items():
+                    if future not in done:
+                        yield self._wait(future, deadline) or self._timed_out(value, deadline)
+        finally:
+            if executor is not self._executor:
+                executor.shutdown(wait=False)
+    
+    def _get_pack(self, pack, deadline=None, priority=Priority.BULK):
+        """
+        Looks up a pack of kanji in one request. Kanji missing from the response are left out of the results,
+        for the caller to look up on their own
+        """
+        if len(pack) == 1:
+            return {pack[0]: self._get_result(SearchType.KANJI_SINGLE, pack[0], priority, deadline)}
+        
+        try:
+            entries = self._request_entries((SearchType.KANJI_SINGLE, u''.join(pack)), deadline or self._deadline(),
+                priority)
+        except Exception as e:
+            return dict((kanji, dict(search_value=kanji, entries=None, error=e)) for kanji in pack)
+        
+        found = {}
+        for entry in entries:
+            found.setdefault(entry['kanji'], []).append(entry)
+        
+        results = {}
+        for kanji in pack:
+            if kanji in found:
+                if self._cache is not None:
+                    self._cache.set((SearchType.KANJI_SINGLE, kanji), found[kanji])
+                results[kanji] = dict(search_value=kanji, entries=found[kanji], error=None)
+        return results
+    
+    def get_kanji_many(self, kanji, pack_size=20, workers=None, timeout=None):
+        """
+        Gets the definitions and readings of several kanji with as few requests as possible: cached kanji
+        aren't requested again and the others are packed pack_size at a time into single kanji queries.
+        Each kanji is cached on its own. A timeout is a deadline for the whole batch, as for get_many.
+        
+        Returns a result dict (search_value, entries, error) for each kanji, in input order
+        """
+        return self._get_kanji_many(kanji, pack_size, workers, Deadline.after(timeout), Priority.BULK)
+    
+    def _get_kanji_many(self, kanji, pack_size, workers, deadline, priority):
+        kanji = [k.decode('utf-8') if isinstance(k, str) else k for k in kanji]
+        results = {}
+        missing = []
+        seen = set()
+        for k in kanji:
+            if k in seen:
+                continue
+            seen.add(k)
+            entries = self._cache.get((SearchType.KANJI_SINGLE, k)) if self._cache is not None else None
+            if entries is not None:
+                results[k] = dict(search_value=k, entries=entries, error=None)
+            else:
+                missing.append(k)
+        
+        packs = [missing[i:i + pack_size] for i in range(0, len(missing), pack_size)]
+        executor = self._get_executor(workers)
+        try:
+            fallbacks = {}
+            for pack, future in [(pack, executor.submit(self._get_pack, pack, deadline, priority)) for pack in packs]:
+                found = self._wait(future, deadline)
+                if found is None:
+                    results.update((k, self._timed_out(k, deadline)) for k in pack)
+                    continue
+                results.update(found)
+                #kanji missing from a packed response are looked up on their own, in case the query wasn't
+                #packed. They are submitted from here rather than from the pack's worker so they run in parallel
+                fallbacks.update(self._submit_many(executor, SearchType.KANJI_SINGLE,
+                    [k for k in pack if k not in found], priority, deadline))
+            for k, future in fallbacks.items():
+                results[k] = self._wait(future, deadline) or self._timed_out(k, deadline)
+        finally:
+            if executor is not self._executor:
+                executor.shutdown(wait=False)
+        return [results[k] for k in kanji]
+    
+    def close(self):
+        """
+        Closes any pooled connections and worker threads held by the client
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._pool is not None:
+            self._pool.close()
 
 class RequestHandler(object):
     """
     Base class for handling the response for a jdic http request
+    
+    Options:
+        entry_format: 'dict' (default) or 'object' to get compact WordEntry/KanjiEntry objects
     """
+    def __init__(self, options=None):
+        self._entry_format = options.get('entry_format', 'dict') if options else 'dict'
+    
+    #one entry per non-blank line, without surrounding whitespace
+    line_pattern = re.compile(r"\S(?:[^\n]*\S)?")
+    
     def parse_response(self, response):
         start = response.find('<pre>') + 5
         end = response.find('</pre>')
+        if end < 0:
+            end += len(response)
         
-        #entry per line
-        raw_entries = [line.strip() for line in response[start:end].split('\n') if line.strip()]
-        entries = [self._parse_entry(entry) for entry in raw_entries]
-        return entries
+        #single pass over the <pre> block, patterns are compiled once per class
+        parse = self._parse_match
+        return [parse(m) for m in self.line_pattern.finditer(response, start, end)]
+    
+    def iter_response(self, chunks):
+        """
+        Parses a response arriving as a sequence of decoded chunks, yielding each entry as soon as its line is complete
+        """
+        buffer = u''
+        in_pre = False
+        parse = self._parse_match
+        
+        for chunk in chunks:
+            buffer += chunk
+            if not in_pre:
+                start = buffer.find('<pre>')
+                if start < 0:
+                    #keep enough of the tail to find a marker split across chunks
+                    buffer = buffer[-4:]
+                    continue
+                buffer = buffer[start + 5:]
+                in_pre = True
+            
+            end = buffer.find('</pre>')
+            if end >= 0:
+                for m in self.line_pattern.finditer(buffer, 0, end):
+                    yield parse(m)
+                return
+            
+            #only parse complete lines, the last one may still be arriving
+            complete = buffer.rfind('\n') + 1
+            for m in self.line_pattern.finditer(buffer, 0, complete):
+                yield parse(m)
+            buffer = buffer[complete:]
+        
+        if in_pre:
+            for m in self.line_pattern.finditer(buffer):
+                yield parse(m)
+    
+    def _parse_match(self, match):
+        return self._parse_entry(match.group())
     
     def _parse_entry(self, entry):
         pass
@@ -79,72 +552,107 @@ class WordRequestHandler(RequestHandler):
     """ 
     Class for handling the response for word lookup requests
     """
-    def _parse_entry(self, entry):
-        entry = entry.strip()
-        entry_parts_pattern = """
-        ([^\s]*)        #group 1: all chars until the first space
-        \s              #a space
-        \[([^\]]*)]     #group 2: all chars between [ and ]
-        \s              #a space
-        /\(([^\)]*)\)   #group 3: all chars between /( and )
-        \s              #a space
-        ([^/]*)         #group 4: all chars until end / character
-        """
-        m = re.search(entry_parts_pattern, entry, re.VERBOSE)
-        
+    
+    entry_parts_pattern = """
+    ([^\s]*)            #group 1: all chars until the first space
+    \s                  #a space
+    (?:\[([^\]]*)]\s)?  #group 2: all chars between [ and ], followed by a space. kana only words have no reading
+    /\(([^\)]*)\)       #group 3: all chars between /( and )
+    \s                  #a space
+    ([^/\n]*)           #group 4: all chars until end / character
+    """
+    entry_pattern = re.compile(entry_parts_pattern, re.VERBOSE)
+    
+    #matches a whole line of the <pre> block, lines that aren't entries are skipped
+    line_pattern = re.compile("^[^\S\n]*" + entry_parts_pattern + "[^\n]*", re.VERBOSE | re.MULTILINE)
+    
+    def _parse_match(self, m):
         word = m.group(1)
         reading = m.group(2)
+        if reading is None:
+            reading = word
         
         #wordtype can contain multiple values separated by comma
         wordtype = m.group(3).split(',')
         definition = m.group(4)
         
+        if self._entry_format == 'object':
+            return WordEntry(word, reading, wordtype, definition)
+        
         return dict(
             word=word,
             reading=reading,
             wordtype=wordtype,
             definition=definition
         )
+    
+    def _parse_entry(self, entry):
+        return self._parse_match(self.entry_pattern.search(entry))
 
 class KanjiRequestHandler(RequestHandler):
     """
     Class for handling the response for kanji lookup requests (single kanji, kanji by radical)
     """
+    
+    #kanji character itself is at the start of the line. CJK unified ideographs, extension A (JIS X 0212/0213
+    #kanji) and compatibility ideographs
+    kanji_pattern = re.compile(u"([\u3400-\u4DBF\u4E00-\u9FFF\uF900-\uFAFF]+)", re.UNICODE)
+    
+    #kanji meanings are contained inside brackets {}
+    meaning_pattern = re.compile(u"{([^}]*)}", re.UNICODE)
+    
+    #readings start at the first field after the ascii dictionary codes and end at the first meaning
+    readings_pattern = re.compile(u" (?=[^\x00-\x7f{])", re.UNICODE)
+    
+    #chinese readings are written in katakana, match using katakana unicode range
+    on_yomi_pattern = re.compile(u"([\u30A0-\u30FF]+) ", re.UNICODE)
+    
+    #japanese readings are written in hiragana, match using hiragana unicode range. Matched against
+    #the reversed readings so one match picks up the whole run of fields before the T1 marker
+    kun_yomi_pattern = re.compile(u"(?:[\u3040-\u309F\-\.]+(?: |$))+", re.UNICODE)
+    
     def _parse_kanji(self, entry):
-        #kanji character itself is at the start of the line.
-        kanji_range = u"([\u4E00-\u9FBF]+)"
-        kanji_pattern = re.compile(kanji_range, re.UNICODE)
-        
-        match = kanji_pattern.match(entry).group(1)
-        return match
-    
-    def _parse_meanings(self, entry):
-        #kanji meanings are contained inside brackets {}
-        meaning = u"{([^}]*)}"
-        meaning_pattern = re.compile(meaning, re.UNICODE)
-        matches = meaning_pattern.findall(entry)
-        return matches
-    
-    def _parse_on_yomi(self, entry):
-        #chinese readings are written in katakana, match using katakana unicode range
-        on_yomi = u"([\u30A0-\u30FF]+) "
-        on_yomi_pattern = re.compile(on_yomi, re.UNICODE)
-        matches = on_yomi_pattern.findall(entry)
-        return matches
-    
-    def _parse_kun_yomi(self, entry):
-        #japanese readings are written in hiragana, match using hiragana unicode range
-        kun_yomi = u"((?:[\u3040-\u309F\-\.]+ )+)(?=T1)"
-        kun_yomi_pattern = re.compile(kun_yomi, re.UNICODE)
-        kun_yomi_section = kun_yomi_pattern.findall(entry)
-        matches = kun_yomi_section[0].strip().split(' ') if len(kun_yomi_section) > 0 else None
-        return matches
+        return self.kanji_pattern.match(entry).group(1)
+    
+    def _readings_span(self, entry, brace=None):
+        if brace is None:
+            brace = entry.find('{')
+        end = brace if brace >= 0 else len(entry)
+        match = self.readings_pattern.search(entry, 1, end)
+        return (match.end() if match else end), end
+    
+    def _parse_meanings(self, entry, brace=None):
+        if brace is None:
+            brace = entry.find('{')
+        return self.meaning_pattern.findall(entry, max(brace, 0))
+    
+    def _parse_on_yomi(self, entry, span=None):
+        start, end = span or self._readings_span(entry)
+        return self.on_yomi_pattern.findall(entry, start, end)
+    
+    def _parse_kun_yomi(self, entry, span=None):
+        #kun readings are the run of hiragana readings right before the T1 (name readings) marker
+        start, end = span or self._readings_span(entry)
+        marker = entry.find(' T1', start, end)
+        if marker < 0:
+            return None
+        
+        match = self.kun_yomi_pattern.match(entry[start:marker][::-1])
+        if not match or not match.group():
+            return None
+        return match.group()[::-1].strip(' ').split(' ')
     
     def _parse_entry(self, entry):
+        if self._entry_format == 'object':
+            #fields are parsed on first access
+            return KanjiEntry(entry, self)
+        
+        brace = entry.find('{')
+        span = self._readings_span(entry, brace)
         kanji = self._parse_kanji(entry)
-        meanings = self._parse_meanings(entry)
-        on_yomi = self._parse_on_yomi(entry)
-        kun_yomi = self._parse_kun_yomi(entry)
+        meanings = self._parse_meanings(entry, brace)
+        on_yomi = self._parse_on_yomi(entry, span)
+        kun_yomi = self._parse_kun_yomi(entry, span)
         
         return dict(
             kanji=kanji, 
@@ -165,6 +673,12 @@ class Request(object):
     
     def get(self, options):
         pass
+    
+    def iter_get(self, options):
+        """
+        Yields the entries of a request one by one
+        """
+        return iter(self.get(options))
 
 class HttpRequest(Request):
     """
@@ -173,8 +687,18 @@ class HttpRequest(Request):
     
     def __init__(self, options=None):
         super(HttpRequest, self).__init__()
-        self._urllib = options['urllib'] if options and options['urllib'] else urllib2
+        self._urllib = options['urllib'] if options and options.get('urllib') else urllib2
+        self._pool = options.get('pool') if options else None
+        self._timeout = options.get('timeout') if options else None
+        self._entry_format = options.get('entry_format', 'dict') if options else 'dict'
+        self._instrumentation = options.get('instrumentation') if options else None
+        self._compression = options.get('compression', True) if options else True
         self._base_url = options['base_url'] if options and 'base_url' in options else 'http://www.csse.monash.edu.au/~jwb/cgi-bin/wwwjdic.cgi?'
+        
+        #responses being read, so cancel() can abort them from another thread
+        self._responses = set()
+        self._responses_lock = threading.Lock()
+        self._cancelled = False
     
     #query codes used by wwwjdic for particular dictionary queries
     #Details: http://www.csse.monash.edu.au/~jwb/wwwjdicinf.html#backdoor_tag
@@ -199,6 +723,12 @@ class HttpRequest(Request):
     def set_urllib(self, urllib):
         self._urllib = urllib
     
+    def set_pool(self, pool):
+        self._pool = pool
+    
+    def set_compression(self, compression):
+        self._compression = compression
+    
     def build_url(self, options):
         """
         Returns a url to query jdic, using one of the available jdic query codes
@@ -208,24 +738,210 @@ class HttpRequest(Request):
         search_type = options['search_type']
         search_value = options['search_value']
         query_code = self.query_codes[search_type]
+        if isinstance(search_value, str):
+            search_value = search_value.decode('utf-8')
         
-        return '{0}{1}{2}'.format(self._base_url, query_code, search_value)
+        return u'{0}{1}{2}'.format(self._base_url, query_code, search_value)
+    
+    def cancel(self):
+        """
+        Cancels the request from another thread: responses being read are aborted and their connections dropped,
+        the calls reading them raise CancelledError
+        """
+        self._cancelled = True
+        with self._responses_lock:
+            responses = list(self._responses)
+        for response in responses:
+            response.abort()
+    
+    def _failed(self, deadline):
+        #turns the error of a request that ran out of time or was cancelled into a clear one
+        if self._cancelled:
+            raise CancelledError()
+        if deadline is not None and deadline.expired():
+            raise deadline.exceeded()
+    
+    def _open(self, url, deadline=None):
+        """
+        Opens the given url, returns the response and a function that releases it
+        """
+        instrumentation = self._instrumentation
+        if instrumentation is not None:
+            instrumentation.count('requests')
+            start = time.time()
+        
+        try:
+            if self._cancelled:
+                raise CancelledError()
+            timeout = remaining(deadline, self._timeout)
+            if self._pool is not None:
+                #keep-alive connection is handed back to the pool once the body is read
+                headers = {'Accept-Encoding': accept_encoding} if self._compression else None
+                pooled = response = self._pool.open(url, headers=headers, timeout=timeout)
+                with self._responses_lock:
+                    self._responses.add(pooled)
+                
+                def release():
+                    with self._responses_lock:
+                        self._responses.discard(pooled)
+                    pooled.close()
+                if self._cancelled:
+                    release()
+                    raise CancelledError()
+                status, reason = response.status, response.reason
+                encoding = response.getheader('Content-Encoding') if self._compression else None
+            else:
+                #urllib2 can't send unicode urls
+                if isinstance(url, unicode):
+                    url = url.encode('utf-8')
+                
+                opener = self._urllib.OpenerDirector()
+                http_handler = self._urllib.HTTPHandler(debuglevel=self._debug)
+                opener.add_handler(http_handler)
+                if self._compression and hasattr(opener, 'addheaders'):
+                    opener.addheaders.append(('Accept-Encoding', accept_encoding))
+                
+                if timeout is not None:
+                    response = opener.open(url, timeout=timeout)
+                else:
+                    response = opener.open(url)
+                release = opener.close
+                #a urllib replacement's responses may be plain file-like objects, read them as uncompressed 200s
+                status = (response.getcode() if hasattr(response, 'getcode') else None) or 200
+                reason = getattr(response, 'msg', '')
+                encoding = None
+                if self._compression and hasattr(response, 'info'):
+                    encoding = response.info().getheader('Content-Encoding')
+            
+            #error pages (e.g. a 503 from an overloaded mirror) aren't results, fail before parsing them
+            if not 200 <= status < 300:
+                release()
+                raise urllib2.HTTPError(url, status, reason, None, None)
+        except:
+            if instrumentation is not None:
+                instrumentation.count('errors')
+            self._failed(deadline)
+            raise
+        
+        if instrumentation is not None:
+            instrumentation.phase('first_byte', time.time() - start)
+        
+        #compressed bodies are inflated as they are read, the parsers only see the decoded text
+        if encoding:
+            encoding = encoding.strip().lower()
+            if encoding in ('gzip', 'x-gzip', 'deflate'):
+                response = DecompressingResponse(response, 'deflate' if encoding == 'deflate' else 'gzip')
+        return response, release
+    
+    def _read(self, response, deadline, chunk_size=8192):
+        if deadline is None:
+            body = response.read()
+            if self._cancelled:
+                raise CancelledError()
+            return body
+        
+        #each read may only wait for the time left, a server trickling bytes can't stall past the deadline
+        chunks = []
+        try:
+            while True:
+                if hasattr(response, 'settimeout'):
+                    response.settimeout(deadline.remaining())
+                data = response.read(chunk_size)
+                if not data:
+                    break
+                chunks.append(data)
+        except Exception:
+            self._failed(deadline)
+            raise
+        #an aborted connection reads as the end of the response
+        if self._cancelled:
+            raise CancelledError()
+        return ''.join(chunks)
     
     def get(self, options):
+        """
+        Requests and parses the entries for the given search_type and search_value. The optional
+        deadline (jdic.deadline.Deadline) covers connecting, reading and parsing
+        """
         search_type = options['search_type']
-        request_handler = self.request_handlers[search_type]()
+        deadline = options.get('deadline')
+        request_handler = self.request_handlers[search_type](dict(entry_format=self._entry_format))
         url = self.build_url(options)
         
-        opener = self._urllib.OpenerDirector()
-        http_handler = self._urllib.HTTPHandler(debuglevel=self._debug)
-        opener.add_handler(http_handler)
+        instrumentation = self._instrumentation
+        response, release = self._open(url, deadline)
+        try:
+            if instrumentation is not None:
+                start = time.time()
+            body = self._read(response, deadline)
+            if instrumentation is not None:
+                read = time.time()
+                instrumentation.phase('read', read - start)
+        except:
+            if instrumentation is not None:
+                instrumentation.count('errors')
+            raise
+        finally:
+            release()
         
         #ensure response is utf-8 encoded
-        response = opener.open(url).read().decode('utf-8')
-        opener.close()
+        text = body.decode('utf-8')
+        if instrumentation is not None:
+            if isinstance(response, DecompressingResponse):
+                instrumentation.count('compressed_bytes', response.compressed_bytes)
+            decoded = time.time()
+            instrumentation.phase('decode', decoded - read)
         
-        entries = request_handler.parse_response(response)
+        entries = request_handler.parse_response(text)
+        if instrumentation is not None:
+            instrumentation.phase('parse', time.time() - decoded)
+            instrumentation.count('bytes', len(body))
+            instrumentation.count('entries', len(entries))
+        if deadline is not None:
+            deadline.check()
         return entries
+    
+    def iter_get(self, options, chunk_size=8192):
+        """
+        Streams the response, yielding entries while the rest of the response is still being read.
+        
+        The connection is released when the generator is exhausted or closed
+        """
+        search_type = options['search_type']
+        deadline = options.get('deadline')
+        request_handler = self.request_handlers[search_type](dict(entry_format=self._entry_format))
+        url = self.build_url(options)
+        
+        instrumentation = self._instrumentation
+        response, release = self._open(url, deadline)
+        try:
+            for entry in request_handler.iter_response(self._iter_chunks(response, chunk_size, deadline)):
+                if instrumentation is not None:
+                    instrumentation.count('entries')
+                yield entry
+        finally:
+            release()
+    
+    def _iter_chunks(self, response, chunk_size, deadline=None):
+        #multibyte characters may be split across chunks
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        instrumentation = self._instrumentation
+        while True:
+            try:
+                if deadline is not None and hasattr(response, 'settimeout'):
+                    response.settimeout(deadline.remaining())
+                data = response.read(chunk_size)
+            except Exception:
+                self._failed(deadline)
+                raise
+            if not data:
+                if self._cancelled:
+                    raise CancelledError()
+                break
+            if instrumentation is not None:
+                instrumentation.count('bytes', len(data))
+            yield decoder.decode(data)
+        yield decoder.decode('', True)
 
 def main():
     """
@@ -233,17 +949,130 @@ def main():
     """
     parser = argparse.ArgumentParser()
     
-    parser.add_argument("search_term", help="search jdic for given word or kanji")
+    parser.add_argument("search_term", nargs="?", help="search jdic for given word or kanji")
     
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("-k", "--kanji", help="search for single kanji definition", action="store_true")
     group.add_argument("-r", "--radical", help="search for all kanji containing radical", action="store_true")
     group.add_argument("-j", "--jp", help="search for word using japanese", action="store_true")
     group.add_argument("-e", "--en", help="search for word using english", action="store_true")
+    group.add_argument("--serve", help="run a local http/json lookup server", action="store_true")
+    group.add_argument("--refresh", help="look up the expired entries of the --snapshot file again", action="store_true")
+    group.add_argument("--build-index", metavar="FILE", help="index a local EDICT or KANJIDIC FILE, see --index")
+    
+    parser.add_argument("--timeout", help="seconds a lookup may take before it fails", type=float)
+    
+    batch_group = parser.add_argument_group("batch options")
+    batch_group.add_argument("--batch", metavar="FILE", nargs="?", const="-",
+        help="look up every term in FILE (default: stdin), one per line, writing JSON lines to stdout")
+    batch_group.add_argument("--workers", help="number of concurrent batch lookups", type=int, default=8)
+    
+    server_group = parser.add_argument_group("server options")
+    server_group.add_argument("--host", help="address for the lookup server to listen on", default="127.0.0.1")
+    server_group.add_argument("--port", help="port for the lookup server to listen on", type=int, default=8000)
+    server_group.add_argument("--cache-size", help="max number of lookups kept in the server cache", type=int, default=10000)
+    
+    snapshot_group = parser.add_argument_group("snapshot options")
+    snapshot_group.add_argument("--snapshot", metavar="FILE",
+        help="cache snapshot loaded at startup by --serve and --batch, written by --warm and --refresh")
+    snapshot_group.add_argument("--warm", metavar="FILE", nargs="?", const="-",
+        help="look up every term in FILE (default: stdin), one per line, and write them to the --snapshot file")
+    snapshot_group.add_argument("--ttl", type=float,
+        help="seconds entries written by --warm and --refresh stay valid (default: they don't expire)")
+    snapshot_group.add_argument("--negative-ttl", type=float,
+        help="seconds empty results written by --warm and --refresh stay valid (default: they don't expire)")
+    
+    index_group = parser.add_argument_group("index options")
+    index_group.add_argument("--index", metavar="FILE",
+        help="index written by --build-index (default: FILE.index), an existing one is only updated for the parts of FILE that changed")
+    index_group.add_argument("--encoding", help="encoding of the dictionary file", default="euc-jp")
+    index_group.add_argument("--processes", help="number of indexing processes (default: one per cpu)", type=int)
     
     args = parser.parse_args()
     
-    jdic_client = Client()
+    if args.build_index:
+        from indexer import build_index
+        path = args.index or args.build_index + '.index'
+        parsed, reused = build_index(args.build_index, path, dict(encoding=args.encoding, processes=args.processes))
+        print 'wrote {0}, {1} chunks parsed, {2} reused'.format(path, parsed, reused)
+        return
+    
+    if (args.warm is not None or args.refresh) and not args.snapshot:
+        parser.error("--warm and --refresh need a --snapshot file")
+    
+    if args.refresh:
+        from snapshot import refresh_snapshot
+        jdic_client = Client(dict(workers=args.workers, timeout=args.timeout))
+        try:
+            refreshed, errors = refresh_snapshot(jdic_client, args.snapshot,
+                dict(workers=args.workers, ttl=args.ttl, negative_ttl=args.negative_ttl))
+        finally:
+            jdic_client.close()
+        print 'refreshed {0} entries, {1} errors'.format(refreshed, errors)
+        sys.exit(1 if errors else 0)
+    
+    from cache import MemoryCache, TieredCache
+    cache = MemoryCache(dict(maxsize=args.cache_size))
+    if args.snapshot and args.warm is None:
+        from snapshot import SnapshotCache
+        cache = TieredCache(cache, SnapshotCache(dict(path=args.snapshot)))
+    
+    if args.serve:
+        from server import LookupServer
+        server = LookupServer(dict(host=args.host, port=args.port, cache=cache, timeout=args.timeout, verbose=True))
+        print 'serving jdic lookups on {0}'.format(server.url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+    
+    if args.kanji:
+        search_type = SearchType.KANJI_SINGLE
+    elif args.radical:
+        search_type = SearchType.KANJI_BY_RADICAL
+    elif args.jp:
+        search_type = SearchType.WORD_JP
+    elif args.en:
+        search_type = SearchType.WORD_EN
+    
+    if args.warm is not None:
+        from snapshot import warm_up, write_snapshot
+        #entries written to the snapshot expire after --ttl, they don't by default
+        cache = MemoryCache(dict(maxsize=sys.maxint, ttl=args.ttl, negative_ttl=args.negative_ttl))
+        jdic_client = Client(dict(cache=cache, workers=args.workers, timeout=args.timeout))
+        lines = sys.stdin if args.warm == '-' else open(args.warm)
+        try:
+            lookups, errors = warm_up(jdic_client, search_type, lines, args.workers)
+            write_snapshot(args.snapshot, cache.items())
+        finally:
+            jdic_client.close()
+            if lines is not sys.stdin:
+                lines.close()
+        print 'wrote {0} lookups to {1}, {2} errors'.format(lookups, args.snapshot, errors)
+        sys.exit(1 if errors else 0)
+    
+    if args.batch is not None:
+        from batch import run_batch
+        
+        #bounded cache, repeated terms in the input are only looked up once while they stay cached
+        jdic_client = Client(dict(cache=cache, workers=args.workers, timeout=args.timeout))
+        lines = sys.stdin if args.batch == '-' else open(args.batch)
+        try:
+            lookups, errors = run_batch(jdic_client, search_type, lines, sys.stdout, args.workers)
+        finally:
+            jdic_client.close()
+            if lines is not sys.stdin:
+                lines.close()
+        
+        sys.exit(1 if errors else 0)
+    
+    if args.search_term is None:
+        parser.error("search_term is required")
+    
+    jdic_client = Client(dict(cache=cache, timeout=args.timeout))
     
     if args.kanji:
         result = jdic_client.get_kanji(args.search_term)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from entries import KanjiEntry
+from jdic import KanjiRequestHandler
+
+class KanjiTable(object):
+    """
+    Columnar store of KANJIDIC attributes, one numpy array per attribute, for filtering and sorting
+    all kanji at once:
+
+        table.select(grade=(None, 3), strokes=(5, 8), order_by='frequency')
+
+    Missing values (e.g. kanji without a grade) are stored as -1, they never match a condition
+    and sort last. Needs numpy
+
+    Columns:
+        codepoint: unicode code point of the kanji
+        grade, strokes, frequency, jlpt, radical (classical), nelson: KANJIDIC G, S, F, J, B and N codes
+        skip_type, skip_1, skip_2: the three parts of the SKIP (P) code
+    """
+
+    columns = (
+        ('codepoint', 'u4'),
+        ('grade', 'i1'),
+        ('strokes', 'i1'),
+        ('frequency', 'i2'),
+        ('jlpt', 'i1'),
+        ('radical', 'i2'),
+        ('nelson', 'i2'),
+        ('skip_type', 'i1'),
+        ('skip_1', 'i1'),
+        ('skip_2', 'i1')
+    )
+
+    def __init__(self, arrays):
+        if numpy is None:
+            raise ImportError('KanjiTable needs numpy')
+        self._arrays = arrays
+        self._positions = None
+
+    def __len__(self):
+        return len(self._arrays['codepoint'])
+
+    @classmethod
+    def _row(cls, entry):
+        def code(value):
+            return int(value) if value is not None and value.isdigit() else -1
+
+        skip = (entry.skip or '').split('-')
+        if len(skip) != 3:
+            skip = (None, None, None)
+        return (
+            ord(entry.kanji),
+            code(entry._code('G')),
+            code(entry._code('S')),
+            code(entry._code('F')),
+            code(entry._code('J')),
+            code(entry._code('B')),
+            code(entry._code('N')),
+            code(skip[0]),
+            code(skip[1]),
+            code(skip[2])
+        )
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        Builds a table from KanjiEntry objects, as parsed with entry_format='object'.
+        Dict entries don't keep the KANJIDIC codes and can't be used
+        """
+        if numpy is None:
+            raise ImportError('KanjiTable needs numpy')
+        rows = []
+        for entry in entries:
+            if not isinstance(entry, KanjiEntry):
+                raise ValueError("KanjiTable needs KanjiEntry objects, parse entries with entry_format='object'")
+            rows.append(cls._row(entry))
+
+        arrays = {}
+        for i, (name, dtype) in enumerate(cls.columns):
+            arrays[name] = numpy.array([row[i] for row in rows], dtype=dtype)
+        return cls(arrays)
+
+    @classmethod
+    def from_kanjidic(cls, path, encoding='euc-jp'):
+        """
+        Builds a table from every entry of a KANJIDIC file. Lines whose kanji is outside the BMP
+        (e.g. extension B kanji) are skipped
+        """
+        from local import DictionaryFile
+        handler = KanjiRequestHandler(dict(entry_format='object'))
+        dictionary = DictionaryFile(path, encoding)
+        try:
+            return cls.from_entries(handler._parse_entry(line) for offset, line in dictionary
+                if line and not line.startswith('#') and handler.kanji_pattern.match(line))
+        finally:
+            dictionary.close()
+
+    def save(self, path):
+        """
+        Saves the table as one .npy file per column in the directory at path
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name, dtype in self.columns:
+            numpy.save(os.path.join(path, name + '.npy'), self._arrays[name])
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a table saved with save(). Columns are memory mapped read only unless mmap is False
+        """
+        if numpy is None:
+            raise ImportError('KanjiTable needs numpy')
+        mode = 'r' if mmap else None
+        return cls(dict((name, numpy.load(os.path.join(path, name + '.npy'), mmap_mode=mode))
+            for name, dtype in cls.columns))
+
+    def column(self, name):
+        return self._arrays[name]
+
+    def mask(self, **conditions):
+        """
+        Returns a boolean array of the rows matching every condition. A condition is either a value
+        or an inclusive (min, max) range, where None leaves that end open
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        for name, condition in conditions.items():
+            column = self._arrays[name]
+            if isinstance(condition, tuple):
+                low, high = condition
+                mask &= column >= (low if low is not None else 0)
+                if high is not None:
+                    mask &= column <= high
+            else:
+                mask &= column == condition
+        return mask
+
+    def indices(self, order_by=None, limit=None, **conditions):
+        """
+        Returns the row indices matching the conditions, ordered by a column ('-column' for descending)
+        """
+        indices = numpy.flatnonzero(self.mask(**conditions))
+        if order_by is not None:
+            descending = order_by.startswith('-')
+            column = self._arrays[order_by.lstrip('-')][indices].astype('i4')
+            if descending:
+                keys = -column
+            else:
+                keys = numpy.where(column < 0, numpy.iinfo('i4').max, column)
+            #stable, so ties keep the file order
+            indices = indices[numpy.argsort(keys, kind='mergesort')]
+        if limit is not None:
+            indices = indices[:limit]
+        return indices
+
+    def select(self, order_by=None, limit=None, **conditions):
+        """
+        Returns the kanji matching the conditions, e.g. select(grade=(None, 3), strokes=(5, 8), order_by='frequency')
+        """
+        codepoints = self._arrays['codepoint'][self.indices(order_by, limit, **conditions)]
+        return [unichr(codepoint) for codepoint in codepoints.tolist()]
+
+    def get(self, kanji):
+        """
+        Returns the attributes of a kanji as a dict, None if it isn't in the table
+        """
+        if self._positions is None:
+            self._positions = dict((codepoint, i) for i, codepoint in enumerate(self._arrays['codepoint'].tolist()))
+        i = self._positions.get(ord(kanji))
+        if i is None:
+            return None
+
+        row = dict(kanji=kanji)
+        for name, dtype in self.columns[1:]:
+            value = int(self._arrays[name][i])
+            row[name] = value if value >= 0 else None
+        return row
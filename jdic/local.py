@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+import mmap
+import re
+import threading
+
+from jdic import Request, SearchType, WordRequestHandler, KanjiRequestHandler
+from radicals import RadicalIndex
+
+class DictionaryFile(object):
+    """
+    Memory mapped dictionary file, one entry per line. Lines are decoded on demand only
+    """
+    def __init__(self, path, encoding):
+        self._encoding = encoding
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            #empty files can't be mapped
+            self._map = ''
+
+    def __iter__(self):
+        """
+        Yields (offset, line) for every line in the file
+        """
+        data = self._map
+        size = len(data)
+        start = 0
+        while start < size:
+            end = data.find('\n', start)
+            if end == -1:
+                end = size
+            yield start, data[start:end].decode(self._encoding, 'replace')
+            start = end + 1
+
+    def line(self, offset):
+        end = self._map.find('\n', offset)
+        if end == -1:
+            end = len(self._map)
+        return self._map[offset:end].decode(self._encoding, 'replace')
+
+    def close(self):
+        if not isinstance(self._map, str):
+            self._map.close()
+        self._file.close()
+
+class LocalRequest(Request):
+    """
+    Answers jdic queries from local copies of the EDICT, KANJIDIC and RADKFILE files wwwjdic is built on,
+    without going over the network. Entries are parsed by the same request handlers as http responses.
+
+    Indexes are built on the first query that needs them.
+
+    Options:
+        edict: path to an EDICT/EDICT2 file, needed for word lookups
+        kanjidic: path to a KANJIDIC file, needed for kanji lookups
+        radkfile: path to a RADKFILE, needed for kanji by radical lookups
+        radical_index: prebuilt RadicalIndex (or path to one), used instead of radkfile
+        edict_index, kanjidic_index: paths to indexes of the files built with jdic.build_index, used
+            instead of indexing the files on the first query
+        encoding: encoding of the files, EUC-JP by default as distributed by the EDRDG
+        entry_format: 'dict' (default) or 'object', see jdic.entries
+    """
+    def __init__(self, options=None):
+        super(LocalRequest, self).__init__()
+        options = options or {}
+        self._paths = dict(
+            edict=options.get('edict'),
+            kanjidic=options.get('kanjidic'),
+            radkfile=options.get('radkfile')
+        )
+        self._encoding = options.get('encoding', 'euc-jp')
+        self._handler_options = dict(entry_format=options.get('entry_format', 'dict'))
+        self._radical_index = options.get('radical_index')
+        self._index_paths = dict(
+            edict=options.get('edict_index'),
+            kanjidic=options.get('kanjidic_index')
+        )
+        self._disk_indexes = []
+        self._files = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    #splits english glosses into keywords
+    keyword_pattern = re.compile(r"[\w']+", re.UNICODE)
+
+    #EDICT2 headwords and readings can carry markers such as (P) or (ik)
+    marker_pattern = re.compile(r"\([^)]*\)")
+
+    def _file(self, name):
+        if name not in self._files:
+            if not self._paths[name]:
+                raise ValueError('no {0} file given to LocalRequest'.format(name))
+            self._files[name] = DictionaryFile(self._paths[name], self._encoding)
+        return self._files[name]
+
+    def _index(self, name):
+        with self._lock:
+            if name not in self._indexes:
+                self._indexes[name] = getattr(self, '_build_{0}_index'.format(name))()
+            return self._indexes[name]
+
+    @classmethod
+    def _split_keys(cls, field):
+        return [cls.marker_pattern.sub('', key).strip() for key in field.split(';') if key.strip()]
+
+    @classmethod
+    def _edict_keys(cls, line):
+        """
+        Returns the (headwords and readings, gloss keywords) an EDICT line is found by, None for lines that aren't entries
+        """
+        head, sep, glosses = line.partition('/')
+        if not sep:
+            return None
+
+        #headword(s) followed by optional [reading(s)]
+        head = head.strip()
+        reading = ''
+        if head.endswith(']') and '[' in head:
+            head, reading = head[:-1].split('[', 1)
+        return cls._split_keys(head) + cls._split_keys(reading), set(cls.keyword_pattern.findall(glosses.lower()))
+
+    def _load_index(self, name):
+        #prebuilt on-disk index, see jdic.indexer
+        from indexer import DictionaryIndex
+        index = DictionaryIndex(self._index_paths[name])
+        if index.kind != name or not index.is_current(self._paths[name]):
+            index.close()
+            raise ValueError('{0} is not an up to date index of {1}, rebuild it with build_index()'.format(
+                self._index_paths[name], self._paths[name]))
+        self._disk_indexes.append(index)
+        return index
+
+    def _build_edict_index(self):
+        if self._index_paths['edict']:
+            index = self._load_index('edict')
+            return dict(words=index['words'], keywords=index['keywords'])
+
+        words = {}
+        keywords = {}
+        for offset, line in self._file('edict'):
+            keys = self._edict_keys(line)
+            if keys is None:
+                continue
+
+            for key in keys[0]:
+                words.setdefault(key, []).append(offset)
+            for keyword in keys[1]:
+                keywords.setdefault(keyword, []).append(offset)
+
+        return dict(words=words, keywords=keywords)
+
+    def _build_kanjidic_index(self):
+        if self._index_paths['kanjidic']:
+            return self._load_index('kanjidic')['kanji']
+
+        kanji = {}
+        for offset, line in self._file('kanjidic'):
+            if line and not line.startswith('#'):
+                kanji.setdefault(line[0], []).append(offset)
+        return kanji
+
+    def _build_radkfile_index(self):
+        if isinstance(self._radical_index, basestring):
+            return RadicalIndex.load(self._radical_index)
+        if self._radical_index is not None:
+            return self._radical_index
+        if not self._paths['radkfile']:
+            raise ValueError('no radkfile file given to LocalRequest')
+        return RadicalIndex.from_radkfile(self._paths['radkfile'], self._encoding)
+
+    def _find_words(self, search_type, search_value):
+        index = self._index('edict')
+        if search_type == SearchType.WORD_JP:
+            return index['words'].get(search_value, [])
+
+        #every keyword of the english search value must appear in the entry
+        keywords = self.keyword_pattern.findall(search_value.lower())
+        if not keywords:
+            return []
+        offsets = set(index['keywords'].get(keywords[0], []))
+        for keyword in keywords[1:]:
+            offsets.intersection_update(index['keywords'].get(keyword, []))
+        return sorted(offsets)
+
+    def _find_kanji(self, search_type, search_value):
+        index = self._index('kanjidic')
+        if search_type == SearchType.KANJI_SINGLE:
+            #several kanji can be looked up at once
+            kanji = search_value
+        else:
+            #several radicals in the search value match the kanji containing all of them
+            kanji = self._index('radkfile').kanji(search_value)
+
+        return sorted(set(offset for k in kanji for offset in index.get(k, [])))
+
+    def get(self, options):
+        search_type = options['search_type']
+        search_value = options['search_value']
+        if isinstance(search_value, str):
+            search_value = search_value.decode('utf-8')
+
+        if search_type in (SearchType.WORD_EN, SearchType.WORD_JP):
+            name, handler = 'edict', WordRequestHandler(self._handler_options)
+            offsets = self._find_words(search_type, search_value)
+        else:
+            name, handler = 'kanjidic', KanjiRequestHandler(self._handler_options)
+            offsets = self._find_kanji(search_type, search_value)
+
+        dictionary = self._file(name)
+        if name == 'edict':
+            #lines without a part of speech are indexed but aren't entries, wwwjdic responses skip them as well
+            matches = (handler.entry_pattern.search(dictionary.line(offset)) for offset in offsets)
+            return [handler._parse_match(m) for m in matches if m is not None]
+        return [handler._parse_entry(dictionary.line(offset)) for offset in offsets]
+
+    def close(self):
+        for dictionary in self._files.values():
+            dictionary.close()
+        self._files = {}
+        for index in self._disk_indexes:
+            index.close()
+        self._disk_indexes = []
+        self._indexes = {}
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import bisect
+import threading
+
+class Instrumentation(object):
+    """
+    Hooks into the lookup hot path.
+
+    Phase hooks are called as fn(phase, seconds) for each timed phase of a request:
+        dns, connect: new pooled connections only
+        first_byte: from sending the request until the response headers arrive
+        read, decode, parse: reading, utf-8 decoding and parsing the response body
+        queue: time spent waiting for a Scheduler to let the request through
+
+    Counter hooks are called as fn(name, amount) for: requests, errors, connections, bytes, entries,
+    compressed_bytes (bytes received for compressed responses, before decompression)
+    and coalesced (lookups that waited on an identical lookup already in flight)
+
+    Requests and pools only time phases when they are given an Instrumentation,
+    without one the hot path is a single None check per phase
+    """
+    def __init__(self):
+        self._phase_hooks = []
+        self._counter_hooks = []
+
+    def add_phase_hook(self, fn):
+        self._phase_hooks.append(fn)
+
+    def add_counter_hook(self, fn):
+        self._counter_hooks.append(fn)
+
+    def phase(self, name, seconds):
+        for fn in self._phase_hooks:
+            fn(name, seconds)
+
+    def count(self, name, amount=1):
+        for fn in self._counter_hooks:
+            fn(name, amount)
+
+class HistogramCollector(object):
+    """
+    Collects phase timings into cumulative histograms and sums counters, ready to be scraped
+    """
+
+    default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=None):
+        self._buckets = tuple(sorted(buckets or self.default_buckets))
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._counters = {}
+
+    def install(self, instrumentation):
+        instrumentation.add_phase_hook(self.observe)
+        instrumentation.add_counter_hook(self.count)
+        return self
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            histogram = self._phases.get(phase)
+            if histogram is None:
+                #one slot per bucket, plus one for values above the largest bucket
+                histogram = self._phases[phase] = dict(count=0, sum=0.0, counts=[0] * (len(self._buckets) + 1))
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['counts'][bisect.bisect_left(self._buckets, seconds)] += 1
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def snapshot(self):
+        """
+        Returns dict(phases={phase: dict(count, sum, buckets=[(upper bound, cumulative count)])}, counters={})
+        """
+        with self._lock:
+            phases = {}
+            for phase, histogram in self._phases.items():
+                cumulative = 0
+                buckets = []
+                for bound, count in zip(self._buckets + (float('inf'),), histogram['counts']):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                phases[phase] = dict(count=histogram['count'], sum=histogram['sum'], buckets=buckets)
+            return dict(phases=phases, counters=dict(self._counters))
+
+    def render(self):
+        """
+        Renders the snapshot in the prometheus text format
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for phase, histogram in sorted(snapshot['phases'].items()):
+            for bound, count in histogram['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('jdic_phase_seconds_bucket{{phase="{0}",le="{1}"}} {2}'.format(phase, le, count))
+            lines.append('jdic_phase_seconds_sum{{phase="{0}"}} {1!r}'.format(phase, histogram['sum']))
+            lines.append('jdic_phase_seconds_count{{phase="{0}"}} {1}'.format(phase, histogram['count']))
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('jdic_{0}_total {1}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._phases = {}
+            self._counters = {}
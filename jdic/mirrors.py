@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import Queue
+import collections
+import threading
+import time
+
+from deadline import DeadlineExceeded, remaining
+from executor import CancelledError
+from jdic import Request, HttpRequest
+
+class MirrorSet(object):
+    """
+    Tracks the latency and health of a list of wwwjdic mirror base urls.
+
+    Latency is a moving average per mirror. A failed mirror is ejected for a backoff period
+    that doubles with each consecutive failure, a success puts it back in rotation.
+
+    Options:
+        mirrors: list of base urls, e.g. 'http://www.csse.monash.edu.au/~jwb/cgi-bin/wwwjdic.cgi?'
+        alpha: weight of the latest sample in the latency average
+        backoff: seconds a mirror is ejected for after its first failure
+        max_backoff: upper bound of the ejection period
+        hedge_percentile: latency percentile, as a fraction (e.g. 0.95), after which a hedged request is sent
+            to a second mirror, None to disable
+        hedge_min_samples: number of latency samples needed before requests are hedged
+    """
+    def __init__(self, options=None):
+        options = options or {}
+        self._mirrors = list(options.get('mirrors', []))
+        if not self._mirrors:
+            raise ValueError('MirrorSet needs at least one mirror')
+
+        self._alpha = options.get('alpha', 0.3)
+        self._backoff = options.get('backoff', 5.0)
+        self._max_backoff = options.get('max_backoff', 300.0)
+        self._hedge_percentile = options.get('hedge_percentile')
+        if self._hedge_percentile is not None and not 0 < self._hedge_percentile < 1:
+            raise ValueError('hedge_percentile is a fraction between 0 and 1, e.g. 0.95')
+        self._hedge_min_samples = options.get('hedge_min_samples', 20)
+
+        self._lock = threading.Lock()
+        self._latency = dict((mirror, None) for mirror in self._mirrors)
+        self._failures = dict((mirror, 0) for mirror in self._mirrors)
+        self._ejected_until = dict((mirror, 0) for mirror in self._mirrors)
+        self._samples = collections.deque(maxlen=200)
+
+    def mirrors(self):
+        return list(self._mirrors)
+
+    def select(self, exclude=()):
+        """
+        Returns the fastest healthy mirror not in exclude. Mirrors without a latency sample yet come first.
+
+        If every candidate is ejected, the one that comes back soonest is returned. None if there are no candidates
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [mirror for mirror in self._mirrors if mirror not in exclude]
+            if not candidates:
+                return None
+
+            healthy = [mirror for mirror in candidates if self._ejected_until[mirror] <= now]
+            if not healthy:
+                return min(candidates, key=lambda mirror: self._ejected_until[mirror])
+            return min(healthy, key=lambda mirror: self._latency[mirror] or 0)
+
+    def record_success(self, mirror, seconds):
+        with self._lock:
+            latency = self._latency[mirror]
+            self._latency[mirror] = seconds if latency is None else self._alpha * seconds + (1 - self._alpha) * latency
+            self._failures[mirror] = 0
+            self._ejected_until[mirror] = 0
+            self._samples.append(seconds)
+
+    def record_failure(self, mirror):
+        with self._lock:
+            self._failures[mirror] += 1
+            backoff = min(self._backoff * 2 ** (self._failures[mirror] - 1), self._max_backoff)
+            self._ejected_until[mirror] = time.time() + backoff
+
+    def is_ejected(self, mirror):
+        return self._ejected_until[mirror] > time.time()
+
+    def latency(self, mirror):
+        return self._latency[mirror]
+
+    def hedge_delay(self):
+        """
+        Seconds to wait for a response before sending a hedged request, None if requests shouldn't be hedged
+        """
+        if self._hedge_percentile is None:
+            return None
+        with self._lock:
+            if len(self._samples) < self._hedge_min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(int(len(samples) * self._hedge_percentile), len(samples) - 1)]
+
+class MirroredRequest(Request):
+    """
+    Http request routed to the fastest healthy mirror of a MirrorSet.
+
+    A failed attempt is retried on the next best mirror. Slow attempts are hedged with a duplicate
+    request to a second mirror when the MirrorSet has a hedge percentile, the first response wins
+    and the other request is cancelled. Retries and hedges share the deadline of the request options
+
+    Options:
+        mirrors: MirrorSet to route requests with
+        retries: number of other mirrors tried after a failure
+        request_options: options for the HttpRequest sent to each mirror (urllib, pool, timeout...)
+    """
+    def __init__(self, options=None):
+        super(MirroredRequest, self).__init__()
+        options = options or {}
+        self._mirrors = options['mirrors']
+        self._retries = options.get('retries', 2)
+        self._request_options = options.get('request_options') or {}
+
+    def _request(self, mirror):
+        request = HttpRequest(self._request_options)
+        request.set_base_url(mirror)
+        return request
+
+    def _attempt(self, mirror, options, request=None):
+        request = request or self._request(mirror)
+
+        start = time.time()
+        try:
+            entries = request.get(options)
+        except (CancelledError, DeadlineExceeded):
+            #a hedge that lost the race or a caller out of time says nothing about the mirror
+            raise
+        except Exception:
+            self._mirrors.record_failure(mirror)
+            raise
+        self._mirrors.record_success(mirror, time.time() - start)
+        return entries
+
+    def _next_result(self, results, deadline):
+        if deadline is None:
+            return results.get()
+        try:
+            return results.get(True, deadline.remaining())
+        except Queue.Empty:
+            raise deadline.exceeded()
+
+    def _hedged_attempt(self, mirror, options, tried, delay):
+        deadline = options.get('deadline')
+        results = Queue.Queue()
+        requests = []
+
+        def run(mirror, request):
+            try:
+                results.put((self._attempt(mirror, options, request), None))
+            except Exception as e:
+                results.put((None, e))
+
+        def start(mirror):
+            request = self._request(mirror)
+            requests.append(request)
+            thread = threading.Thread(target=run, args=(mirror, request))
+            thread.daemon = True
+            thread.start()
+
+        start(mirror)
+        outstanding = 1
+        try:
+            try:
+                entries, error = results.get(True, remaining(deadline, delay))
+                outstanding -= 1
+            except Queue.Empty:
+                if deadline is not None:
+                    deadline.check()
+                #primary is slower than usual, race it against the next best mirror
+                hedge = self._mirrors.select(exclude=tried)
+                if hedge is not None:
+                    tried.add(hedge)
+                    start(hedge)
+                    outstanding += 1
+                entries, error = self._next_result(results, deadline)
+                outstanding -= 1
+
+            #the first successful response wins
+            while error is not None and outstanding:
+                entries, error = self._next_result(results, deadline)
+                outstanding -= 1
+        finally:
+            #requests still running lost the race or ran out of time, their connections are dropped
+            for request in requests:
+                request.cancel()
+
+        if error is not None:
+            raise error
+        return entries
+
+    def get(self, options):
+        tried = set()
+        error = None
+        for attempt in range(self._retries + 1):
+            mirror = self._mirrors.select(exclude=tried)
+            if mirror is None:
+                break
+            tried.add(mirror)
+
+            delay = self._mirrors.hedge_delay()
+            try:
+                if delay is None:
+                    return self._attempt(mirror, options)
+                return self._hedged_attempt(mirror, options, tried, delay)
+            except DeadlineExceeded:
+                #no time left for another mirror
+                raise
+            except Exception as e:
+                error = e
+        raise error
+
+    def iter_get(self, options):
+        """
+        Streams the response of the fastest mirror. Streams aren't retried or hedged, entries may already have been used
+        """
+        mirror = self._mirrors.select()
+        request = self._request(mirror)
+
+        start = time.time()
+        try:
+            for entry in request.iter_get(options):
+                yield entry
+        except (CancelledError, DeadlineExceeded):
+            raise
+        except Exception:
+            self._mirrors.record_failure(mirror)
+            raise
+        self._mirrors.record_success(mirror, time.time() - start)
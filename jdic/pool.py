@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+class PooledResponse(object):
+    """
+    File-like wrapper around an httplib response.
+
+    The underlying connection goes back to the pool on close() once the body has been read in full,
+    otherwise the connection is dropped since it can't be reused safely
+    """
+    def __init__(self, pool, key, connection, response):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._aborted = False
+        self.status = response.status
+        self.reason = response.reason
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, amt=None):
+        if self._connection is None:
+            return ''
+
+        if amt is None:
+            return self._response.read()
+        return self._response.read(amt)
+
+    def settimeout(self, timeout):
+        """
+        Sets the socket timeout for the reads that follow
+        """
+        connection = self._connection
+        if connection is not None and connection.sock is not None:
+            connection.sock.settimeout(timeout)
+
+    def abort(self):
+        """
+        Shuts the connection down, can be called from any thread. A read blocked on it returns at once
+        and the connection is dropped when the response is closed
+        """
+        self._aborted = True
+        connection = self._connection
+        if connection is not None and connection.sock is not None:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def close(self):
+        if self._connection is None:
+            return
+
+        connection, self._connection = self._connection, None
+        if self._response.isclosed() and not self._response.will_close and not self._aborted:
+            self._pool.release(self._key, connection)
+        else:
+            self._response.close()
+            connection.close()
+
+class ConnectionPool(object):
+    """
+    Thread safe pool of keep-alive http connections, keyed by host.
+
+    Options:
+        maxsize: max number of idle connections kept per host
+        idle_timeout: seconds an idle connection is kept before it is evicted
+        timeout: socket timeout for new connections
+        instrumentation: optional jdic.metrics.Instrumentation, times dns lookups and connects
+    """
+
+    connection_classes = {
+        'http': httplib.HTTPConnection,
+        'https': httplib.HTTPSConnection
+    }
+
+    def __init__(self, options=None):
+        options = options or {}
+        self._maxsize = options.get('maxsize', 4)
+        self._idle_timeout = options.get('idle_timeout', 30.0)
+        self._timeout = options.get('timeout', socket._GLOBAL_DEFAULT_TIMEOUT)
+        self._debug = options.get('debuglevel', 0)
+        self._instrumentation = options.get('instrumentation')
+        self._lock = threading.Lock()
+
+        #(scheme, host, port) -> list of (connection, time the connection was released)
+        self._idle = {}
+
+    def _split_url(self, url):
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = '{0}?{1}'.format(path, parts.query)
+
+        #search values are sent raw by build_url, percent encode anything outside of ascii
+        path = urllib.quote(path, safe="/?=&:;,+%~")
+        key = (parts.scheme, parts.hostname, parts.port)
+        return key, path, parts.netloc
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        connection = self.connection_classes[scheme](host, port, timeout=self._timeout)
+        connection.set_debuglevel(self._debug)
+        return connection
+
+    def _connect(self, key, connection):
+        """
+        Connects a new connection up front, timing the dns lookup and connect separately
+        """
+        instrumentation = self._instrumentation
+        instrumentation.count('connections')
+        scheme, host, port = key
+        if scheme != 'http':
+            start = time.time()
+            connection.connect()
+            instrumentation.phase('connect', time.time() - start)
+            return
+
+        start = time.time()
+        addresses = socket.getaddrinfo(host, port or httplib.HTTP_PORT, 0, socket.SOCK_STREAM)
+        resolved = time.time()
+        instrumentation.phase('dns', resolved - start)
+
+        #every address is tried in turn as socket.create_connection does, the first one may not be reachable
+        error = socket.error('getaddrinfo returned no addresses for {0}'.format(host))
+        for family, socktype, proto, canonname, address in addresses:
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if connection.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(connection.timeout)
+                if connection.source_address:
+                    sock.bind(connection.source_address)
+                sock.connect(address)
+            except socket.error as e:
+                error = e
+                if sock is not None:
+                    sock.close()
+                continue
+            connection.sock = sock
+            instrumentation.phase('connect', time.time() - resolved)
+            return
+        raise error
+
+    def _set_timeout(self, connection, timeout):
+        timeout = timeout if timeout is not None else self._timeout
+        connection.timeout = timeout
+        if connection.sock is not None:
+            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                timeout = socket.getdefaulttimeout()
+            connection.sock.settimeout(timeout)
+
+    def _acquire(self, key):
+        """
+        Returns an idle connection for the given host, or None if there isn't one
+        """
+        now = time.time()
+        stale = []
+        connection = None
+
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate, released = idle.pop()
+                if now - released > self._idle_timeout:
+                    stale.append(candidate)
+                else:
+                    connection = candidate
+                    break
+
+        for candidate in stale:
+            candidate.close()
+        return connection
+
+    def release(self, key, connection):
+        """
+        Returns a connection to the pool so it can be reused for later requests to the same host
+        """
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self._maxsize:
+                idle.append((connection, time.time()))
+                connection = None
+
+        if connection is not None:
+            connection.close()
+
+    def evict_idle(self):
+        """
+        Closes every connection that has been idle for longer than idle_timeout
+        """
+        now = time.time()
+        stale = []
+
+        with self._lock:
+            for key, idle in self._idle.items():
+                fresh = [item for item in idle if now - item[1] <= self._idle_timeout]
+                stale.extend(item[0] for item in idle if now - item[1] > self._idle_timeout)
+                self._idle[key] = fresh
+
+        for connection in stale:
+            connection.close()
+        return len(stale)
+
+    def idle_count(self, key=None):
+        with self._lock:
+            if key is not None:
+                return len(self._idle.get(key, []))
+            return sum(len(idle) for idle in self._idle.values())
+
+    def open(self, url, headers=None, timeout=None):
+        """
+        Sends a GET request for the given url, reusing an idle keep-alive connection when possible.
+        An optional timeout overrides the pool's socket timeout for this request.
+
+        Returns a PooledResponse, which must be closed to hand the connection back to the pool
+        """
+        key, path, netloc = self._split_url(url)
+        headers = headers or {}
+
+        connection = self._acquire(key)
+        reused = connection is not None
+        if not reused:
+            connection = self._new_connection(key)
+        self._set_timeout(connection, timeout)
+
+        try:
+            if not reused and self._instrumentation is not None:
+                self._connect(key, connection)
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+        except socket.timeout:
+            connection.close()
+            raise
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+            #the server may have dropped an idle keep-alive connection, retry once on a fresh one
+            connection = self._new_connection(key)
+            self._set_timeout(connection, timeout)
+            try:
+                if self._instrumentation is not None:
+                    self._connect(key, connection)
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+            except:
+                connection.close()
+                raise
+
+        return PooledResponse(self, key, connection, response)
+
+    def close(self):
+        """
+        Closes all idle connections
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection, released in connections:
+                connection.close()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import io
+
+class RadicalIndex(object):
+    """
+    Compact radical -> kanji index. The kanji containing each radical are kept as one
+    string sorted by code point, so a radical costs a single string object.
+
+    Built from a RADKFILE, or loaded from a prebuilt index file written by save()
+    """
+
+    header = u'# jdic radical index 1'
+
+    def __init__(self, radicals):
+        self._radicals = dict((radical, u''.join(sorted(set(kanji)))) for radical, kanji in radicals.items())
+
+    @classmethod
+    def from_radkfile(cls, path, encoding='euc-jp'):
+        radicals = {}
+        kanji = None
+        with io.open(path, encoding=encoding, errors='replace') as f:
+            for line in f:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                if line.startswith('$'):
+                    #$ <radical> <stroke count> [jis code]
+                    kanji = radicals.setdefault(line.split()[1], [])
+                elif kanji is not None:
+                    kanji.append(line.strip())
+        return cls(dict((radical, u''.join(kanji)) for radical, kanji in radicals.items()))
+
+    @classmethod
+    def load(cls, path):
+        radicals = {}
+        with io.open(path, encoding='utf-8') as f:
+            if f.readline().rstrip('\n') != cls.header:
+                raise ValueError('{0} is not a radical index file'.format(path))
+            for line in f:
+                radical, kanji = line.rstrip('\n').split(u'\t')
+                radicals[radical] = kanji
+        return cls(radicals)
+
+    def save(self, path):
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(self.header + u'\n')
+            for radical in sorted(self._radicals):
+                f.write(u'{0}\t{1}\n'.format(radical, self._radicals[radical]))
+
+    def radicals(self):
+        return sorted(self._radicals)
+
+    def __contains__(self, radical):
+        return radical in self._radicals
+
+    def kanji(self, radicals):
+        """
+        Returns the kanji containing every one of the given radicals, in code point order.
+
+        radicals can be a single radical, a string of radicals or a list
+        """
+        if isinstance(radicals, str):
+            radicals = radicals.decode('utf-8')
+
+        sets = sorted((self._radicals.get(radical, u'') for radical in set(radicals)), key=len)
+        if not sets:
+            return []
+
+        #start from the rarest radical, it bounds the size of the result
+        kanji = set(sets[0])
+        for other in sets[1:]:
+            if not kanji:
+                break
+            kanji.intersection_update(other)
+        return sorted(kanji)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+from deadline import DeadlineExceeded, remaining
+from executor import CancelledError
+
+class Priority:
+    INTERACTIVE = 0
+    BULK = 1
+
+class TokenBucket(object):
+    """
+    Allows rate requests per second on average, with bursts of up to burst requests
+    """
+    def __init__(self, rate, burst=None):
+        self._rate = float(rate)
+        self._burst = float(burst or max(rate, 1))
+        self._tokens = self._burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """
+        Takes a token if one is available, returns False otherwise
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def delay(self):
+        """
+        Seconds until the next token is available
+        """
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self._tokens) / self._rate)
+
+class Scheduler(object):
+    """
+    Shapes the requests sent upstream: a token bucket caps the request rate and an adaptive limit caps the
+    number of requests in flight. Waiting requests are let through by priority, then in arrival order,
+    so interactive lookups go ahead of queued bulk lookups.
+
+    The concurrency limit grows by one per round of successful requests and is cut by the backoff factor
+    when a request fails or the smoothed latency rises above the latency target, at most once per round trip.
+
+    Options:
+        rate: max requests per second, None for no rate limit
+        burst: number of requests that can be sent at once after an idle period, rate by default
+        concurrency: initial concurrency limit
+        min_concurrency, max_concurrency: bounds of the concurrency limit
+        latency_target: latency in seconds above which the limit is cut, by default
+            latency_tolerance times the fastest recent request
+        backoff: factor the limit is multiplied by when cut
+        instrumentation: Instrumentation the time spent waiting is reported to, as the 'queue' phase
+    """
+    def __init__(self, options=None):
+        options = options or {}
+        rate = options.get('rate')
+        self._bucket = TokenBucket(rate, options.get('burst')) if rate else None
+
+        self._min = options.get('min_concurrency', 1)
+        self._max = options.get('max_concurrency', 16)
+        self._limit = float(options.get('concurrency', min(4, self._max)))
+        self._latency_target = options.get('latency_target')
+        self._latency_tolerance = options.get('latency_tolerance', 2.0)
+        self._backoff = options.get('backoff', 0.7)
+        self._instrumentation = options.get('instrumentation')
+
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._latency = None
+        self._samples = collections.deque(maxlen=100)
+        self._last_decrease = 0
+
+    def limit(self):
+        return int(self._limit)
+
+    def running(self):
+        return self._running
+
+    def queued(self):
+        return len(self._waiting)
+
+    def _target(self):
+        if self._latency_target is not None:
+            return self._latency_target
+        if len(self._samples) < 5:
+            return None
+        return min(self._samples) * self._latency_tolerance
+
+    def acquire(self, priority=Priority.INTERACTIVE, deadline=None):
+        """
+        Blocks until the request may be sent. Every acquire must be followed by a release.
+        Raises DeadlineExceeded, without taking a slot, if the deadline passes first
+        """
+        start = time.time()
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    delay = None
+                    if self._waiting[0] == ticket and self._running < int(self._limit):
+                        if self._bucket is None or self._bucket.try_acquire():
+                            break
+                        delay = self._bucket.delay()
+                    self._condition.wait(remaining(deadline, delay))
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+                raise
+
+            heapq.heappop(self._waiting)
+            self._running += 1
+            #the next request in line may be allowed through as well
+            self._condition.notify_all()
+
+        if self._instrumentation is not None:
+            self._instrumentation.phase('queue', time.time() - start)
+
+    def release(self, seconds, error=False):
+        """
+        Frees the slot of a finished request, adapting the concurrency limit to its latency and outcome.
+        seconds is None for a request given up by its caller, which frees the slot without adapting the limit
+        """
+        with self._condition:
+            self._running -= 1
+            if seconds is None:
+                self._condition.notify_all()
+                return
+            if not error:
+                self._samples.append(seconds)
+                self._latency = seconds if self._latency is None else 0.3 * seconds + 0.7 * self._latency
+
+            target = self._target()
+            if error or (target is not None and self._latency > target):
+                now = time.time()
+                if now - self._last_decrease >= (self._latency or seconds):
+                    self._limit = max(self._min, self._limit * self._backoff)
+                    self._last_decrease = now
+            else:
+                self._limit = min(self._max, self._limit + 1.0 / self._limit)
+            self._condition.notify_all()
+
+    def run(self, fn, priority=Priority.INTERACTIVE, deadline=None):
+        """
+        Calls fn once the scheduler lets it through, returns its result. A caller running out of time or
+        cancelling says nothing about upstream, it doesn't count as a failed or slow request
+        """
+        self.acquire(priority, deadline)
+        start = time.time()
+        error = True
+        try:
+            result = fn()
+            error = False
+            return result
+        except (DeadlineExceeded, CancelledError):
+            start = None
+            raise
+        finally:
+            self.release(time.time() - start if start is not None else None, error)
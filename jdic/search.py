@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+import bisect
+import heapq
+import re
+
+from jdic import WordRequestHandler
+from local import DictionaryFile, LocalRequest
+
+#hepburn romanization of hiragana, katakana is folded to hiragana first
+_romaji = {
+    u'あ': 'a', u'い': 'i', u'う': 'u', u'え': 'e', u'お': 'o',
+    u'か': 'ka', u'き': 'ki', u'く': 'ku', u'け': 'ke', u'こ': 'ko',
+    u'が': 'ga', u'ぎ': 'gi', u'ぐ': 'gu', u'げ': 'ge', u'ご': 'go',
+    u'さ': 'sa', u'し': 'shi', u'す': 'su', u'せ': 'se', u'そ': 'so',
+    u'ざ': 'za', u'じ': 'ji', u'ず': 'zu', u'ぜ': 'ze', u'ぞ': 'zo',
+    u'た': 'ta', u'ち': 'chi', u'つ': 'tsu', u'て': 'te', u'と': 'to',
+    u'だ': 'da', u'ぢ': 'ji', u'づ': 'zu', u'で': 'de', u'ど': 'do',
+    u'な': 'na', u'に': 'ni', u'ぬ': 'nu', u'ね': 'ne', u'の': 'no',
+    u'は': 'ha', u'ひ': 'hi', u'ふ': 'fu', u'へ': 'he', u'ほ': 'ho',
+    u'ば': 'ba', u'び': 'bi', u'ぶ': 'bu', u'べ': 'be', u'ぼ': 'bo',
+    u'ぱ': 'pa', u'ぴ': 'pi', u'ぷ': 'pu', u'ぺ': 'pe', u'ぽ': 'po',
+    u'ま': 'ma', u'み': 'mi', u'む': 'mu', u'め': 'me', u'も': 'mo',
+    u'や': 'ya', u'ゆ': 'yu', u'よ': 'yo',
+    u'ら': 'ra', u'り': 'ri', u'る': 'ru', u'れ': 're', u'ろ': 'ro',
+    u'わ': 'wa', u'ゐ': 'i', u'ゑ': 'e', u'を': 'o', u'ん': 'n', u'ゔ': 'vu',
+    u'ぁ': 'a', u'ぃ': 'i', u'ぅ': 'u', u'ぇ': 'e', u'ぉ': 'o',
+    u'ゃ': 'ya', u'ゅ': 'yu', u'ょ': 'yo', u'ゎ': 'wa'
+}
+
+#small ya/yu/yo after an i-row kana form a single syllable: kya, sha, cho...
+_small_y = {u'ゃ': 'a', u'ゅ': 'u', u'ょ': 'o'}
+
+_katakana_pattern = re.compile(u"[\u30A1-\u30F6]")
+
+def to_hiragana(text):
+    """
+    Folds katakana to hiragana, other characters are left as is
+    """
+    return _katakana_pattern.sub(lambda m: unichr(ord(m.group()) - 0x60), text)
+
+def romanize(kana):
+    """
+    Returns the hepburn romanization of a kana string, or None if it contains anything but kana
+    """
+    kana = to_hiragana(kana)
+    syllables = []
+    double = False
+    for i, char in enumerate(kana):
+        if char == u'っ':
+            #small tsu doubles the next consonant
+            double = True
+            continue
+        if char == u'ー':
+            #long vowel mark repeats the previous vowel
+            if not syllables:
+                return None
+            syllables.append(syllables[-1][-1])
+            continue
+
+        if char in _small_y and syllables and syllables[-1].endswith('i') and kana[i - 1] not in _small_y:
+            previous = syllables.pop()
+            stem = previous[:-1] if previous[:-1].endswith(('sh', 'ch', 'j')) else previous[:-1] + 'y'
+            syllable = stem + _small_y[char]
+        else:
+            syllable = _romaji.get(char)
+            if syllable is None:
+                return None
+
+        if double:
+            syllable = ('t' if syllable.startswith('ch') else syllable[0]) + syllable
+            double = False
+        syllables.append(syllable)
+    return ''.join(syllables)
+
+def _within_one_edit(a, b):
+    #same as an edit distance of at most 1, without the dynamic programming
+    size_a, size_b = len(a), len(b)
+    if abs(size_a - size_b) > 1:
+        return False
+    i = 0
+    end = min(size_a, size_b)
+    while i < end and a[i] == b[i]:
+        i += 1
+    if size_a == size_b:
+        return a[i + 1:] == b[i + 1:]
+    if size_a < size_b:
+        return a[i:] == b[i + 1:]
+    return a[i + 1:] == b[i:]
+
+def normalize(text):
+    """
+    Normalizes a headword, reading or query for lookups: katakana is folded to hiragana and latin letters to lower case
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    return to_hiragana(text.strip()).lower()
+
+class SearchIndex(object):
+    """
+    Local prefix and fuzzy search over word entries, by headword, kana reading and romanized reading.
+
+    Keys are kept in one sorted array: prefix matches are a binary search away. Fuzzy matches within one edit
+    either start with the first half of the query or end with its second half, so they are found in two ranges
+    of the sorted keys and of the sorted reversed keys. Larger distances walk the sorted keys like a trie,
+    computing one edit distance row per character and skipping every key under a prefix that is already
+    too far from the query, which visits a good part of the index.
+
+    Results are ranked by edit distance, exact before prefix matches, priority (P) entries first,
+    then by key length and insertion order. The top results of short, very common prefixes are
+    precomputed, so the first keystrokes of an autocomplete are as fast as the later ones
+    """
+
+    #prefixes up to this length with more matches than top_threshold have their top results precomputed
+    top_depth = 2
+    top_threshold = 256
+    top_size = 50
+
+    def __init__(self, entries=None):
+        self._entries = []
+        self._priority = []
+        self._pending = []
+        self._keys = None
+        if entries:
+            for entry in entries:
+                self.add(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def from_edict(cls, path, encoding='euc-jp'):
+        """
+        Builds an index over every entry of an EDICT/EDICT2 file, parsed by WordRequestHandler
+        """
+        handler = WordRequestHandler()
+        index = cls()
+        dictionary = DictionaryFile(path, encoding)
+        try:
+            for offset, line in dictionary:
+                m = handler.entry_pattern.match(line)
+                if m is not None:
+                    index.add(handler._parse_match(m), priority='/(P)/' in line)
+        finally:
+            dictionary.close()
+        return index
+
+    @classmethod
+    def from_index(cls, path):
+        """
+        Builds an index over the entries of an EDICT index written by jdic.build_index, which were parsed
+        when the index was built
+        """
+        from indexer import DictionaryIndex
+        index = cls()
+        dictionary = DictionaryIndex(path)
+        try:
+            for offset, entry, priority in dictionary.entries():
+                index.add(entry, priority)
+        finally:
+            dictionary.close()
+        return index
+
+    def add(self, entry, priority=False):
+        """
+        Adds a word entry (dict or WordEntry) to the index, priority entries are ranked first
+        """
+        entry_id = len(self._entries)
+        self._entries.append(entry)
+        self._priority.append(priority)
+
+        keys = set()
+        for field in (entry['word'], entry['reading']):
+            for key in field.split(';'):
+                key = normalize(LocalRequest.marker_pattern.sub('', key))
+                if key:
+                    keys.add(key)
+                    romaji = romanize(key)
+                    if romaji:
+                        keys.add(romaji)
+        for key in keys:
+            self._pending.append((key, entry_id))
+        self._keys = None
+
+    def _build(self):
+        if self._keys is not None:
+            return
+
+        pairs = sorted(self._pending)
+        self._keys = [key for key, entry_id in pairs]
+        self._ids = [entry_id for key, entry_id in pairs]
+
+        #reversed keys, for suffix ranges
+        reversed_pairs = sorted((key[::-1], position) for position, key in enumerate(self._keys))
+        self._reversed_keys = [key for key, position in reversed_pairs]
+        self._reversed_positions = [position for key, position in reversed_pairs]
+
+        #static rank of each position packed into an int: priority first, then key length, then insertion order
+        self._ranks = [(0 if self._priority[entry_id] else 1) << 60 | min(len(key), 0xfff) << 48 | entry_id
+            for key, entry_id in pairs]
+
+        self._top = {}
+        for depth in range(1, self.top_depth + 1):
+            for prefix in set(key[:depth] for key in self._keys if len(key) >= depth):
+                lo, hi = self._range(prefix)
+                if hi - lo > self.top_threshold:
+                    self._top[prefix] = self._ranked(lo, hi, self.top_size)
+
+    def _range(self, prefix, keys=None):
+        keys = self._keys if keys is None else keys
+        lo = bisect.bisect_left(keys, prefix)
+        return lo, bisect.bisect_left(keys, prefix + u'\uffff', lo)
+
+    def _ranked(self, lo, hi, limit):
+        #at most limit distinct entry ids of the range, best rank first
+        mask = (1 << 48) - 1
+        ids = []
+        seen = set()
+        for rank in heapq.nsmallest(limit * 4, self._ranks[lo:hi]):
+            entry_id = rank & mask
+            if entry_id not in seen:
+                seen.add(entry_id)
+                ids.append(entry_id)
+                if len(ids) == limit:
+                    break
+        return ids
+
+    def prefix(self, query, limit=10):
+        """
+        Returns up to limit entries with a headword or reading (kana or romaji) starting with query, best first
+        """
+        self._build()
+        query = normalize(query)
+        if not query:
+            return []
+
+        #exact matches come first, they sort right at the start of the prefix range
+        lo, hi = self._range(query)
+        exact = bisect.bisect_right(self._keys, query, lo, hi)
+        ids = self._ranked(lo, exact, limit)
+
+        if len(ids) < limit:
+            top = self._top.get(query)
+            if top is None or limit > self.top_size:
+                top = self._ranked(exact, hi, limit + len(ids))
+            for entry_id in top:
+                if entry_id not in ids:
+                    ids.append(entry_id)
+                    if len(ids) == limit:
+                        break
+        return [self._entries[entry_id] for entry_id in ids]
+
+    def fuzzy(self, query, max_distance=1, limit=10):
+        """
+        Returns up to limit entries with a headword or reading within max_distance edits of query,
+        closest first. Queries shorter than max_distance + 2 characters match nothing, almost any short key would do
+        """
+        self._build()
+        query = normalize(query)
+        if len(query) < max_distance + 2:
+            return []
+        if max_distance == 1:
+            matches = self._one_edit_matches(query)
+        else:
+            matches = self._walk_matches(query, max_distance)
+
+        ids = []
+        seen = set()
+        for distance, rank, entry_id in sorted(matches):
+            if entry_id not in seen:
+                seen.add(entry_id)
+                ids.append(entry_id)
+                if len(ids) == limit:
+                    break
+        return [self._entries[entry_id] for entry_id in ids]
+
+    def _one_edit_matches(self, query):
+        keys = self._keys
+        size = len(query)
+        half = size // 2
+        head = query[:half]
+        matches = []
+
+        #an edit in the second half leaves the first half as a prefix
+        lo, hi = self._range(head)
+        for i in xrange(lo, hi):
+            key = keys[i]
+            if abs(len(key) - size) <= 1 and _within_one_edit(key, query):
+                matches.append((0 if key == query else 1, self._ranks[i], self._ids[i]))
+
+        #an edit in the first half leaves the second half as a suffix
+        lo, hi = self._range(query[half:][::-1], self._reversed_keys)
+        for j in xrange(lo, hi):
+            i = self._reversed_positions[j]
+            key = keys[i]
+            if abs(len(key) - size) <= 1 and not key.startswith(head) and _within_one_edit(key, query):
+                matches.append((1, self._ranks[i], self._ids[i]))
+        return matches
+
+    def _walk_matches(self, query, max_distance):
+        keys = self._keys
+        size = len(keys)
+        rows = [range(len(query) + 1)]
+        previous = u''
+        matches = []
+        i = 0
+
+        while i < size:
+            key = keys[i]
+
+            #rows for the prefix shared with the previous key are still valid
+            common = 0
+            end = min(len(key), len(previous), len(rows) - 1)
+            while common < end and key[common] == previous[common]:
+                common += 1
+            del rows[common + 1:]
+
+            pruned = False
+            for depth in range(common, len(key)):
+                char = key[depth]
+                row = rows[-1]
+                new_row = [row[0] + 1]
+                for j, query_char in enumerate(query):
+                    cost = row[j] if query_char == char else row[j] + 1
+                    insert = new_row[j] + 1
+                    delete = row[j + 1] + 1
+                    new_row.append(min(cost, insert, delete))
+                rows.append(new_row)
+
+                if min(new_row) > max_distance:
+                    #no key under this prefix can get any closer, skip them all
+                    previous = key[:depth + 1]
+                    i = bisect.bisect_left(keys, previous + u'\uffff', i + 1)
+                    pruned = True
+                    break
+
+            if pruned:
+                continue
+
+            distance = rows[-1][-1]
+            if distance <= max_distance:
+                matches.append((distance, self._ranks[i], self._ids[i]))
+            previous = key
+            i += 1
+        return matches
+
+    def search(self, query, limit=10, max_distance=1):
+        """
+        Prefix matches, topped up with fuzzy matches when there are fewer than limit
+        """
+        entries = self.prefix(query, limit)
+        if len(entries) < limit and max_distance:
+            for entry in self.fuzzy(query, max_distance, limit):
+                if not any(entry is other for other in entries):
+                    entries.append(entry)
+                    if len(entries) == limit:
+                        break
+        return entries
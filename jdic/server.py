@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+import BaseHTTPServer
+import SocketServer
+import json
+import threading
+import time
+import urllib
+import urlparse
+
+from cache import MemoryCache
+from deadline import DeadlineExceeded
+from entries import entry_to_dict
+from jdic import Client, SearchType
+from metrics import Instrumentation, HistogramCollector
+from pool import ConnectionPool
+
+search_types = (SearchType.WORD_EN, SearchType.WORD_JP, SearchType.KANJI_SINGLE, SearchType.KANJI_BY_RADICAL)
+
+class LookupRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handles the lookup server endpoints:
+        GET /lookup?type=<search type>&q=<search value>  -> {"entries": [...]}
+        GET /stats                                       -> server, cache and lookup counters
+        GET /metrics                                     -> phase histograms in the prometheus text format
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body, content_type='application/json'):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        if url.path == '/lookup':
+            self._lookup(urlparse.parse_qs(url.query))
+        elif url.path == '/stats':
+            self._send(200, self.server.stats())
+        elif url.path == '/metrics':
+            self._send(200, self.server.collector.render(), 'text/plain; version=0.0.4')
+        else:
+            self._send(404, dict(error='not found'))
+
+    def _lookup(self, query):
+        search_type = query.get('type', [None])[0]
+        try:
+            search_value = query.get('q', [''])[0].decode('utf-8')
+        except UnicodeDecodeError:
+            self.server.count('errors')
+            self._send(400, dict(error='q must be utf-8 encoded'))
+            return
+        if search_type not in search_types or not search_value:
+            self.server.count('errors')
+            self._send(400, dict(error='expected type (one of {0}) and q'.format(', '.join(search_types))))
+            return
+
+        try:
+            entries = self.server.client.lookup(search_type, search_value)
+        except Exception as e:
+            self.server.count('errors')
+            status = 504 if isinstance(e, DeadlineExceeded) else 502
+            self._send(status, dict(error='{0}: {1}'.format(type(e).__name__, e)))
+            return
+
+        self.server.count('lookups')
+        self._send(200, dict(entries=[entry_to_dict(entry) for entry in entries]))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class LookupServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Long-lived local http/json lookup service. All requests share one Client, with its cache and connection pool.
+
+    Options:
+        host, port: address to listen on, 127.0.0.1:8000 by default
+        client: Client to serve lookups with, one with a memory cache is created if not given
+        cache_size: max entries of the created client's memory cache
+        timeout: deadline in seconds for each lookup of the created client, answered with a 504 past it
+        verbose: log every request to stderr
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, options=None):
+        options = options or {}
+        self.collector = HistogramCollector()
+        self._cache = options.get('cache')
+        self.client = options.get('client')
+        if self.client is None:
+            instrumentation = Instrumentation()
+            self.collector.install(instrumentation)
+            self._cache = self._cache or MemoryCache(dict(maxsize=options.get('cache_size', 10000)))
+            self.client = Client(dict(cache=self._cache, instrumentation=instrumentation, timeout=options.get('timeout')))
+
+        self.verbose = options.get('verbose', False)
+        self._started = time.time()
+        self._counters = dict(lookups=0, errors=0)
+        self._counters_lock = threading.Lock()
+
+        address = (options.get('host', '127.0.0.1'), options.get('port', 8000))
+        BaseHTTPServer.HTTPServer.__init__(self, address, LookupRequestHandler)
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address[:2])
+
+    def count(self, name):
+        with self._counters_lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats['uptime'] = time.time() - self._started
+        stats['upstream'] = self.collector.snapshot()['counters']
+        if self._cache is not None:
+            stats['cache'] = self._cache.stats()
+        return stats
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.client.close()
+
+class RemoteClient(object):
+    """
+    Thin client for a LookupServer, with the same lookup methods as Client
+
+    Options:
+        url: base url of the lookup server, http://127.0.0.1:8000 by default
+        pool: ConnectionPool used to reach the server
+        timeout: socket timeout in seconds
+    """
+    def __init__(self, options=None):
+        options = options or {}
+        self._url = options.get('url', 'http://127.0.0.1:8000').rstrip('/')
+        self._pool = options.get('pool') or ConnectionPool()
+        self._timeout = options.get('timeout')
+
+    def _request(self, path):
+        response = self._pool.open(self._url + path, timeout=self._timeout)
+        try:
+            body = response.read()
+        finally:
+            response.close()
+
+        if response.status != 200:
+            #error bodies are json from a LookupServer, anything else in between may answer with plain text
+            try:
+                error = json.loads(body).get('error')
+            except (ValueError, AttributeError):
+                error = body.strip() or response.reason
+            raise IOError('jdic server error {0}: {1}'.format(response.status, error))
+        return json.loads(body)
+
+    def _get(self, search_type, search_value):
+        if isinstance(search_value, unicode):
+            search_value = search_value.encode('utf-8')
+        query = urllib.urlencode(dict(type=search_type, q=search_value))
+        return self._request('/lookup?' + query)['entries']
+
+    def get_word_en(self, word):
+        """
+        Gets the English/Japanese definition for a given word entered in English
+        """
+        return self._get(SearchType.WORD_EN, word)
+
+    def get_word_jp(self, word):
+        """
+        Gets the English/Japanese definition for a given word entered in Japanese
+        """
+        return self._get(SearchType.WORD_JP, word)
+
+    def get_kanji(self, kanji):
+        """
+        Gets the definition and readings for a given kanji character
+        """
+        return self._get(SearchType.KANJI_SINGLE, kanji)
+
+    def get_kanji_by_radical(self, radical):
+        """
+        Gets the definitions and readings for all kanji containing a given kanji radical
+        """
+        return self._get(SearchType.KANJI_BY_RADICAL, radical)
+
+    def stats(self):
+        return self._request('/stats')
+
+    def close(self):
+        self._pool.close()
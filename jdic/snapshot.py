@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+import cPickle as pickle
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+from batch import read_terms
+from cache import Cache, key_digest
+from executor import WorkerPool
+from jdic import SearchType
+from scheduler import Priority
+
+#file layout: magic, record count, fixed size records sorted by key digest, then the entry blobs
+#a record is (sha1 digest of the key, blob offset, blob length, expiry time or 0 for none),
+#a blob is a zlib compressed pickle of (key, entries)
+MAGIC = 'JDICSNAP1\n'
+HEADER = struct.Struct('<I')
+RECORD = struct.Struct('<20sQId')
+
+def _blob(key, entries):
+    return zlib.compress(pickle.dumps((key, entries), pickle.HIGHEST_PROTOCOL))
+
+def _write(path, records):
+    #records are (digest, expires, blob), written to a temporary file first so open snapshots stay valid
+    records = sorted(records)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(len(records)))
+        offset = len(MAGIC) + HEADER.size + RECORD.size * len(records)
+        for digest, expires, blob in records:
+            f.write(RECORD.pack(digest, offset, len(blob), expires or 0))
+            offset += len(blob)
+        for digest, expires, blob in records:
+            f.write(blob)
+    os.rename(tmp, path)
+
+def write_snapshot(path, items):
+    """
+    Writes (key, expires, entries) items, e.g. from MemoryCache.items(), to a snapshot file at path
+    """
+    _write(path, [(key_digest(key), expires, _blob(key, entries)) for key, expires, entries in items])
+
+class SnapshotCache(Cache):
+    """
+    Read only cache backed by a memory mapped snapshot file. Opening a snapshot only reads its header,
+    an entry is unpickled when it is first looked up and pages are shared between processes mapping
+    the same file.
+
+    Entries past their expiry are misses. Put it behind a MemoryCache in a TieredCache, which takes the
+    entries looked up since startup:
+
+        cache = TieredCache(MemoryCache(), SnapshotCache(dict(path='jdic.snapshot')))
+
+    Options:
+        path: snapshot file written by write_snapshot() or refresh_snapshot()
+    """
+    def __init__(self, options=None):
+        super(SnapshotCache, self).__init__(options)
+        self._file = open(options['path'], 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError('{0} is not a jdic snapshot'.format(options['path']))
+        self._size = HEADER.unpack_from(self._map, len(MAGIC))[0]
+        self._start = len(MAGIC) + HEADER.size
+
+    def __len__(self):
+        return self._size
+
+    def _record(self, i):
+        return RECORD.unpack_from(self._map, self._start + i * RECORD.size)
+
+    def _records(self):
+        for i in xrange(self._size):
+            yield self._record(i)
+
+    def _find(self, digest):
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = self._start + mid * RECORD.size
+            found = self._map[position:position + 20]
+            if found < digest:
+                lo = mid + 1
+            elif found > digest:
+                hi = mid
+            else:
+                return self._record(mid)
+        return None
+
+    def _load(self, offset, length):
+        return pickle.loads(zlib.decompress(self._map[offset:offset + length]))
+
+    def get_item(self, key):
+        """
+        Returns the (expires, entries) tuple stored for the given key, or None
+        """
+        record = self._find(key_digest(key))
+        item = None
+        if record is not None:
+            digest, offset, length, expires = record
+            expires = expires or None
+            if self._expired(expires):
+                self._count('expirations')
+            else:
+                item = (expires, self._load(offset, length)[1])
+
+        self._count('hits' if item is not None else 'misses')
+        return item
+
+    def get(self, key):
+        item = self.get_item(key)
+        return item[1] if item is not None else None
+
+    def set(self, key, entries, expires=None):
+        #snapshots are read only, new entries go to the cache in front of it
+        pass
+
+    def items(self):
+        """
+        Yields (key, expires, entries) for every entry that hasn't expired
+        """
+        for digest, offset, length, expires in self._records():
+            expires = expires or None
+            if not self._expired(expires):
+                key, entries = self._load(offset, length)
+                yield key, expires, entries
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+def warm_up(client, search_type, terms, workers=None, pack_size=20):
+    """
+    Prefetches terms into the client's cache in parallel, e.g. a word frequency list or every kanji.
+    terms is an iterable of lines, for kanji every character of a line is looked up.
+
+    Returns the number of (lookups, errors)
+    """
+    if client._cache is None:
+        raise ValueError('warm_up needs a client with a cache')
+
+    terms = list(read_terms(terms))
+    if search_type == SearchType.KANJI_SINGLE:
+        results = client.get_kanji_many([kanji for term in terms for kanji in term], pack_size, workers)
+    else:
+        results = client.get_many(search_type, terms, workers)
+    return len(results), sum(1 for result in results if result['error'] is not None)
+
+def refresh_snapshot(client, path, options=None):
+    """
+    Looks up again only the entries of a snapshot that have expired (or expire within margin seconds)
+    and rewrites it in place. Entries that can't be looked up keep their old value. Lookups go through
+    client.lookup() at bulk priority, so they shouldn't be answered from a cache holding the stale entries.
+
+    Options:
+        margin: seconds ahead of expiry an entry is refreshed
+        ttl, negative_ttl: seconds refreshed entries (and empty ones) are kept for, None by default so they
+            don't expire and a snapshot mapped long after the refresh still answers every lookup
+        workers: number of concurrent lookups
+
+    Returns the number of (refreshed, errors)
+    """
+    options = options or {}
+    margin = options.get('margin', 0)
+    policy = Cache(dict(ttl=options.get('ttl'), negative_ttl=options.get('negative_ttl')))
+
+    snapshot = SnapshotCache(dict(path=path))
+    try:
+        records = []
+        stale = []
+        deadline = time.time() + margin
+        for digest, offset, length, expires in snapshot._records():
+            records.append((digest, expires, snapshot._map[offset:offset + length]))
+            if expires and expires <= deadline:
+                stale.append((len(records) - 1, snapshot._load(offset, length)[0]))
+    finally:
+        snapshot.close()
+
+    def fetch(key):
+        return client.lookup(key[0], key[1], priority=Priority.BULK)
+
+    executor = WorkerPool(options.get('workers', 8))
+    errors = 0
+    try:
+        futures = [(i, key, executor.submit(fetch, key)) for i, key in stale]
+        for i, key, future in futures:
+            try:
+                entries = future.result()
+            except Exception:
+                errors += 1
+                continue
+            records[i] = (records[i][0], policy._expiry(entries), _blob(key, entries))
+    finally:
+        executor.shutdown(wait=False)
+
+    _write(path, records)
+    return len(stale) - errors, errors
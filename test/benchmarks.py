@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Parse, search and indexing benchmarks for jdic, run with: python benchmarks.py [repeat] [edict file]
+
+Responses are built from the dictionary fixtures, sized like a large kanji by radical result.
+The search index and the on-disk index are built over a full EDICT file (EUC-JP) when given,
+otherwise over synthetic entries of the same size
+"""
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.append('../')
+import jdic
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return [line.decode('utf-8').rstrip('\n') for line in f if not line.startswith(('#', '\xe3\x80\x80'))]
+
+def build_response(lines, count):
+    body = '\n'.join(lines[i % len(lines)] for i in range(count))
+    return u'<HTML><BODY>\n<pre>\n{0}\n</pre>\n</BODY></HTML>'.format(body)
+
+class LegacyRequestHandler(object):
+    """
+    Request handlers as they were before patterns were precompiled, kept as a baseline
+    """
+    def parse_response(self, response):
+        start = response.find('<pre>') + 5
+        end = response.find('</pre>')
+        raw_entries = [line.strip() for line in response[start:end].split('\n') if line.strip()]
+        return [self._parse_entry(entry) for entry in raw_entries]
+
+class LegacyWordRequestHandler(LegacyRequestHandler):
+    def _parse_entry(self, entry):
+        entry = entry.strip()
+        m = re.search("""
+        ([^\s]*)
+        \s
+        \[([^\]]*)]
+        \s
+        /\(([^\)]*)\)
+        \s
+        ([^/]*)
+        """, entry, re.VERBOSE)
+        return dict(word=m.group(1), reading=m.group(2), wordtype=m.group(3).split(','), definition=m.group(4))
+
+class LegacyKanjiRequestHandler(LegacyRequestHandler):
+    def _parse_entry(self, entry):
+        kanji = re.compile(u"([\u4E00-\u9FBF]+)", re.UNICODE).match(entry).group(1)
+        meanings = re.compile(u"{([^}]*)}", re.UNICODE).findall(entry)
+        on_yomi = re.compile(u"([\u30A0-\u30FF]+) ", re.UNICODE).findall(entry)
+        kun_yomi = re.compile(u"((?:[\u3040-\u309F\-\.]+ )+)(?=T1)", re.UNICODE).findall(entry)
+        kun_yomi = kun_yomi[0].strip().split(' ') if kun_yomi else None
+        return dict(kanji=kanji, meanings=meanings, readings=dict(on=on_yomi, kun=kun_yomi, names=[]))
+
+def bench(name, handler, legacy_handler, response, repeat):
+    #both parsers have to agree before their timings mean anything
+    assert handler.parse_response(response) == legacy_handler.parse_response(response)
+
+    current = min(timeit.repeat(lambda: handler.parse_response(response), number=10, repeat=repeat)) / 10
+    legacy = min(timeit.repeat(lambda: legacy_handler.parse_response(response), number=10, repeat=repeat)) / 10
+    print '{0:<24} legacy {1:8.3f} ms   current {2:8.3f} ms   speedup {3:5.2f}x'.format(
+        name, legacy * 1000, current * 1000, legacy / current)
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    #edict sample entries all carry a reading, the legacy word parser can't handle kana only words
+    kanji_lines = load_fixture('kanjidic_sample.txt')
+    word_lines = load_fixture('edict_sample.txt')
+
+    bench('kanji by radical (500)', jdic.KanjiRequestHandler(), LegacyKanjiRequestHandler(),
+        build_response(kanji_lines, 500), repeat)
+    bench('single kanji', jdic.KanjiRequestHandler(), LegacyKanjiRequestHandler(),
+        build_response(kanji_lines[-1:], 1), repeat)
+    bench('word (200)', jdic.WordRequestHandler(), LegacyWordRequestHandler(),
+        build_response(word_lines, 200), repeat)
+
+    bench_search(repeat, sys.argv[2] if len(sys.argv) > 2 else None)
+    bench_index(sys.argv[2] if len(sys.argv) > 2 else None)
+
+#number of entries in a full EDICT2 file
+EDICT_SIZE = 180000
+
+def synthetic_edict(count):
+    """
+    Random entries shaped like EDICT: kanji headwords with kana readings, some kana only words, 10% priority
+    """
+    kana = [unichr(c) for c in range(0x3042, 0x3093) if unichr(c) not in u'ぃぅぇぉっゃゅょゎ']
+    rng = random.Random(1)
+    entries = []
+    for i in range(count):
+        reading = u''.join(rng.choice(kana) for j in range(rng.randint(2, 6)))
+        word = reading if rng.random() < 0.2 else u''.join(unichr(rng.randint(0x4E00, 0x9FA5)) for j in range(2))
+        entries.append((dict(word=word, reading=reading, wordtype=['n'], definition='gloss'), rng.random() < 0.1))
+    return entries
+
+def bench_search(repeat, edict=None):
+    start = timeit.default_timer()
+    if edict:
+        index = jdic.SearchIndex.from_edict(edict)
+    else:
+        index = jdic.SearchIndex()
+        for entry, priority in synthetic_edict(EDICT_SIZE):
+            index.add(entry, priority)
+    index.prefix(u'a')
+    print 'search index ({0} entries) built in {1:.2f} s'.format(len(index), timeit.default_timer() - start)
+
+    queries = [
+        ('prefix, 1 char', index.prefix, u'か'),
+        ('prefix, 1 char romaji', index.prefix, u'k'),
+        ('prefix, 3 chars', index.prefix, u'こうじ'),
+        ('prefix, romaji', index.prefix, u'kouj'),
+        ('fuzzy, 4 kana', index.fuzzy, u'こうじょ'),
+        ('fuzzy, romaji', index.fuzzy, u'koujou'),
+    ]
+    for name, fn, query in queries:
+        seconds = min(timeit.repeat(lambda: fn(query), number=100, repeat=repeat)) / 100
+        print '{0:<24} {1:8.3f} ms'.format(name, seconds * 1000)
+
+def bench_index(edict=None):
+    directory = tempfile.mkdtemp()
+    try:
+        source = os.path.join(directory, 'edict')
+        if edict:
+            shutil.copy(edict, source)
+            encoding = 'euc-jp'
+        else:
+            encoding = 'utf-8'
+            with open(source, 'wb') as f:
+                for entry, priority in synthetic_edict(EDICT_SIZE):
+                    line = u'{0} [{1}] /(n) {2}/{3}\n'.format(entry['word'], entry['reading'], entry['definition'],
+                        '(P)/' if priority else '')
+                    f.write(line.encode('utf-8'))
+
+        path = os.path.join(directory, 'edict.index')
+        timings = []
+        for processes in sorted(set([1, multiprocessing.cpu_count()])):
+            if os.path.exists(path):
+                os.remove(path)
+            start = timeit.default_timer()
+            jdic.build_index(source, path, dict(encoding=encoding, processes=processes))
+            timings.append(('index build, {0} processes'.format(processes), timeit.default_timer() - start))
+
+        #an edit in the middle of the file only changes the chunk it is in
+        with open(source, 'r+b') as f:
+            f.seek(os.path.getsize(source) // 2)
+            f.write('x')
+        start = timeit.default_timer()
+        parsed, reused = jdic.build_index(source, path, dict(encoding=encoding))
+        timings.append(('rebuild, {0} of {1} chunks'.format(parsed, parsed + reused), timeit.default_timer() - start))
+
+        start = timeit.default_timer()
+        jdic.SearchIndex.from_index(path)
+        timings.append(('search index from index', timeit.default_timer() - start))
+
+        for name, seconds in timings:
+            print '{0:<30} {1:8.2f} s'.format(name, seconds)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
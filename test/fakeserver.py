@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Fake wwwjdic server for tests and load tests, run with: python fakeserver.py [port]
+
+Answers the 4ZUE, 4ZUJ, 1ZMJ and 1ZFX backdoor query codes from the dictionary fixtures, with pages
+shaped like the real ones. Latency, jitter and errors can be injected
+"""
+import BaseHTTPServer
+import SocketServer
+import io
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import urllib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import jdic
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+PAGE = u"""<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN">
+<HTML>
+<HEAD><META http-equiv="Content-Type" content="text/html; charset=UTF-8"><TITLE>WWWJDIC: {0}</TITLE>
+</HEAD><BODY>
+<br>
+<pre>
+{1}
+</pre>
+<p>
+</BODY>
+</HTML>"""
+
+def read_lines(name):
+    with io.open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return [line.rstrip(u'\n') for line in f if line.strip() and not line.startswith((u'#', u'　'))]
+
+class FakeWwwjdic(object):
+    """
+    Threaded keep-alive http server answering wwwjdic backdoor queries at url + '/cgi-bin/wwwjdic.cgi?'
+
+    Options:
+        latency: seconds every response is delayed by
+        jitter: max random seconds added to the latency
+        error_rate: fraction of requests answered with a 503 page
+        drop_rate: fraction of requests whose connection is closed without a response
+        fill: pad responses with other fixture entries up to realistic page sizes, see page_sizes
+        seed: seed of the random generator used for jitter and errors
+        port: port to listen on, a free one by default
+    """
+
+    #entries per page when filling, about what wwwjdic returns for common searches
+    page_sizes = {'4ZUE': 40, '4ZUJ': 20, '1ZMJ': 1, '1ZFX': 250}
+
+    titles = {'4ZUE': 'Word Display', '4ZUJ': 'Word Display', '1ZMJ': 'Kanji Display', '1ZFX': 'Multirad Kanji Display'}
+
+    def __init__(self, options=None):
+        options = options or {}
+        self.latency = options.get('latency', 0)
+        self.jitter = options.get('jitter', 0)
+        self.error_rate = options.get('error_rate', 0)
+        self.drop_rate = options.get('drop_rate', 0)
+        self.fill = options.get('fill', False)
+        self._random = random.Random(options.get('seed', 0))
+        self._random_lock = threading.Lock()
+        self.requests = 0
+
+        self._words = read_lines('edict_sample.txt')
+        self._kanji = read_lines('kanjidic_sample.txt')
+        self._radicals = jdic.RadicalIndex.from_radkfile(os.path.join(FIXTURES, 'radkfile_sample.txt'), 'utf-8')
+
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+                #headers and body are separate writes, don't let them wait on delayed acks
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+            def handle_error(self, request, client_address):
+                #clients dropping keep-alive connections are expected under load
+                if not isinstance(sys.exc_info()[1], socket.error):
+                    BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+        self._server = Server(('127.0.0.1', options.get('port', 0)), Handler)
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+        self.base_url = self.url + '/cgi-bin/wwwjdic.cgi?'
+
+    def _random_value(self):
+        with self._random_lock:
+            return self._random.random()
+
+    def _match_words(self, code, value):
+        if code == '4ZUJ':
+            keys = lambda line: re.split(u'[;\\[\\] ]+', line.split(u' /', 1)[0])
+            return [line for line in self._words if value in keys(line)]
+        value = value.lower()
+        return [line for line in self._words if value in re.findall(r"[\w']+", line.split(u'/', 1)[1].lower())]
+
+    def _match_kanji(self, code, value):
+        kanji = value if code == '1ZMJ' else self._radicals.kanji(value)
+        return [line for line in self._kanji if line[0] in kanji]
+
+    def page(self, code, value):
+        """
+        Returns the html page for a query, None for an unknown query code
+        """
+        if code in ('4ZUE', '4ZUJ'):
+            lines = self._match_words(code, value)
+            pool = self._words
+        elif code in ('1ZMJ', '1ZFX'):
+            lines = self._match_kanji(code, value)
+            pool = self._kanji
+        else:
+            return None
+
+        if self.fill and lines:
+            size = max(self.page_sizes[code], len(lines))
+            lines = lines + [pool[i % len(pool)] for i in range(size - len(lines))]
+        return PAGE.format(self.titles[code], u'\n'.join(lines))
+
+    def _handle(self, handler):
+        self.requests += 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.jitter * self._random_value())
+
+        if self.drop_rate and self._random_value() < self.drop_rate:
+            handler.close_connection = 1
+            return
+
+        path, sep, query = handler.path.partition('?')
+        query = urllib.unquote(query).decode('utf-8')
+        page = self.page(query[:4], query[4:]) if path == '/cgi-bin/wwwjdic.cgi' else None
+
+        status = 200
+        if page is None:
+            status, page = 404, PAGE.format('Error', u'Unknown query')
+        elif self.error_rate and self._random_value() < self.error_rate:
+            status, page = 503, PAGE.format('Error', u'Service temporarily unavailable')
+
+        body = page.encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'text/html; charset=UTF-8')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def main():
+    server = FakeWwwjdic(dict(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8001, fill=True))
+    print 'fake wwwjdic answering on {0}'.format(server.base_url)
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
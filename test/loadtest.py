@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Load tests for jdic against the fake wwwjdic server, run with: python loadtest.py [options]
+
+Reports requests/sec, p50/p99 latency and the parse cost per request for each query code,
+without touching the real wwwjdic
+"""
+import argparse
+import os
+import sys
+import threading
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import jdic
+
+from fakeserver import FakeWwwjdic
+
+#queries answered by the dictionary fixtures
+QUERIES = [
+    ('word en', jdic.SearchType.WORD_EN, [u'factory', u'eat', u'rise', u'deduction']),
+    ('word jp', jdic.SearchType.WORD_JP, [u'工場', u'食べる', u'向上', u'控除']),
+    ('single kanji', jdic.SearchType.KANJI_SINGLE, [u'一', u'丁', u'下', u'付']),
+    ('kanji by radical', jdic.SearchType.KANJI_BY_RADICAL, [u'一', u'｜', u'化']),
+]
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run_load(client, search_type, values, requests, concurrency):
+    """
+    Sends requests lookups of values, in turn, from concurrency threads and returns
+    dict(requests, errors, seconds, rps, p50, p99, parse_ms). Latencies are in ms.
+
+    parse_ms needs a client created with an Instrumentation the HistogramCollector at client.collector
+    is installed on, it is None otherwise
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = iter(xrange(requests))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(remaining, None)
+            if i is None:
+                return
+            start = timeit.default_timer()
+            try:
+                client.lookup(search_type, values[i % len(values)])
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            elapsed = timeit.default_timer() - start
+            with lock:
+                latencies.append(elapsed * 1000)
+
+    collector = getattr(client, 'collector', None)
+    if collector is not None:
+        collector.reset()
+
+    start = timeit.default_timer()
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = timeit.default_timer() - start
+
+    parse_ms = None
+    if collector is not None:
+        parse = collector.snapshot()['phases'].get('parse')
+        if parse and parse['count']:
+            parse_ms = parse['sum'] / parse['count'] * 1000
+
+    return dict(
+        requests=requests,
+        errors=errors[0],
+        seconds=seconds,
+        rps=requests / seconds if seconds else None,
+        p50=percentile(latencies, 0.5),
+        p99=percentile(latencies, 0.99),
+        parse_ms=parse_ms
+    )
+
+def load_client(server, options=None):
+    """
+    Client for load tests: no cache and no coalescing, so every lookup is a request to the server
+    """
+    instrumentation = jdic.Instrumentation()
+    options = dict(options or {}, base_url=server.base_url, coalesce=False, instrumentation=instrumentation)
+    client = jdic.Client(options)
+    client.collector = jdic.HistogramCollector().install(instrumentation)
+    return client
+
+def main():
+    parser = argparse.ArgumentParser(description='Load tests jdic against a fake wwwjdic server')
+    parser.add_argument('-n', '--requests', type=int, default=500, help='requests per query code')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--latency', type=float, default=0.0, help='server latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='max random seconds added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with a 503')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='fraction of connections dropped')
+    parser.add_argument('--no-fill', action='store_true', help="don't pad responses to realistic sizes")
+    parser.add_argument('--no-compression', action='store_true', help="don't request compressed responses")
+    args = parser.parse_args()
+
+    server = FakeWwwjdic(dict(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        fill=not args.no_fill
+    )).start()
+    client = load_client(server, dict(compression=not args.no_compression, workers=args.concurrency))
+    try:
+        print '{0:<18} {1:>9} {2:>7} {3:>9} {4:>9} {5:>9}'.format('query', 'req/s', 'errors', 'p50 ms', 'p99 ms', 'parse ms')
+        for name, search_type, values in QUERIES:
+            result = run_load(client, search_type, values, args.requests, args.concurrency)
+            print '{0:<18} {1:9.1f} {2:7d} {3:9.2f} {4:9.2f} {5:9.3f}'.format(name, result['rps'], result['errors'],
+                result['p50'] or 0, result['p99'] or 0, result['parse_ms'] or 0)
+    finally:
+        client.close()
+        server.stop()
+
+if __name__ == "__main__":
+    main()
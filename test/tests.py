@@ -1,10 +1,26 @@
 # -*- coding: utf-8 -*-
 import unittest
 import jdic
+import threading
+import BaseHTTPServer
+import SocketServer
 
+import StringIO
+import gzip
+import json
+import os
+import shutil
+import socket
 import sys
+import tempfile
+import time
+import urllib2
+import zlib
 sys.path.append('../')
 
+import loadtest
+from fakeserver import FakeWwwjdic
+
 class ApiTests(unittest.TestCase):
     def setUp(self):
         self._urllib = MockUrllib()
@@ -227,6 +243,14 @@ class WordRequestTests(unittest.TestCase):
         entry = entries[2]
         self.assertEqual(entry['word'], u'向上')
         self.assertEqual(entry['definition'], u'improvement')
+    
+    def test_parse_kana_only_entry(self):
+        entries = self._handler.parse_response(u"<pre>\nバナナ /(n) banana/\n  工場 [こうじょう] /(n) factory/  \n</pre>")
+        
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]['word'], u'バナナ')
+        self.assertEqual(entries[0]['reading'], u'バナナ')
+        self.assertEqual(entries[1]['reading'], u'こうじょう')
 
 
 class HttpRequestTests(unittest.TestCase):
@@ -280,6 +304,1873 @@ class HttpRequestTests(unittest.TestCase):
         query_prefix = u'1ZFX'
         query_string = self._request.build_url(dict(search_value=word, search_type=jdic.SearchType.KANJI_BY_RADICAL))
         self.assertEqual(query_string, self._request._base_url + query_prefix + word)
+    
+    def test_minimal_urllib(self):
+        #a urllib replacement whose opener has no addheaders and whose responses are plain file-like objects
+        response = u"<pre>\n向上 [こうじょう] /(n) improvement/\n</pre>".encode('utf-8')
+        class Opener(object):
+            def add_handler(self, handler):
+                pass
+            def open(self, url, timeout=None):
+                return StringIO.StringIO(response)
+            def close(self):
+                pass
+        class Urllib(object):
+            def OpenerDirector(self):
+                return Opener()
+            def HTTPHandler(self, debuglevel=0):
+                return None
+        
+        client = jdic.Client(dict(urllib=Urllib()))
+        self.assertEqual(client.get_word_jp('koujou')[0]['word'], u'向上')
+        client.close()
+
+class ConnectionPoolTests(unittest.TestCase):
+    def setUp(self):
+        self._server = StandInServer()
+        self._server.start()
+        self._pool = jdic.ConnectionPool()
+    
+    def tearDown(self):
+        self._pool.close()
+        self._server.stop()
+    
+    def _get_word_entry(self):
+        return u"""<HTML><BODY>
+<pre>
+向上 [こうじょう] /(n) improvement/
+</pre>
+</BODY></HTML>""".encode('utf-8')
+    
+    def test_connection_reused(self):
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        url = self._server.url + '/cgi?4ZUJkoujou'
+        
+        for i in range(3):
+            response = self._pool.open(url)
+            self.assertEqual(response.read(), self._get_word_entry())
+            response.close()
+        
+        self.assertEqual(self._server.connections, 1)
+        self.assertEqual(self._pool.idle_count(), 1)
+    
+    def test_unread_response_not_reused(self):
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        url = self._server.url + '/cgi?4ZUJkoujou'
+        
+        self._pool.open(url).close()
+        self.assertEqual(self._pool.idle_count(), 0)
+    
+    def test_pool_size(self):
+        pool = jdic.ConnectionPool(dict(maxsize=1))
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        url = self._server.url + '/cgi?4ZUJkoujou'
+        
+        responses = [pool.open(url) for i in range(2)]
+        for response in responses:
+            response.read()
+            response.close()
+        
+        self.assertEqual(self._server.connections, 2)
+        self.assertEqual(pool.idle_count(), 1)
+        pool.close()
+    
+    def test_evict_idle(self):
+        pool = jdic.ConnectionPool(dict(idle_timeout=0))
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        response = pool.open(self._server.url + '/cgi?4ZUJkoujou')
+        response.read()
+        response.close()
+        
+        self.assertEqual(pool.idle_count(), 1)
+        self.assertEqual(pool.evict_idle(), 1)
+        self.assertEqual(pool.idle_count(), 0)
+    
+    def test_threads_share_pool(self):
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        url = self._server.url + '/cgi?4ZUJkoujou'
+        results = []
+        
+        def fetch():
+            for i in range(5):
+                response = self._pool.open(url)
+                results.append(response.read())
+                response.close()
+        
+        threads = [threading.Thread(target=fetch) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(len(results), 20)
+        self.assertTrue(self._server.connections <= 4)
+    
+    def test_client_uses_pool(self):
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        request = jdic.HttpRequest(dict(pool=self._pool, base_url=self._server.url + '/cgi?'))
+        
+        entries = request.get(dict(search_type=jdic.SearchType.WORD_JP, search_value='koujou'))
+        self.assertEqual(entries[0]['word'], u'向上')
+    
+    def test_client_pool_injectable(self):
+        pool = MockPool(self._get_word_entry)
+        client = jdic.Client(dict(pool=pool))
+        
+        entries = client.get_word_jp('koujou')
+        self.assertEqual(entries[0]['definition'], 'improvement')
+        self.assertEqual(pool.urls, ['http://www.csse.monash.edu.au/~jwb/cgi-bin/wwwjdic.cgi?4ZUJkoujou'])
+
+class CacheTests(unittest.TestCase):
+    def setUp(self):
+        self._key = (jdic.SearchType.WORD_JP, 'koujou')
+        self._entries = [dict(word=u'向上', reading=u'こうじょう', wordtype=['n'], definition=u'improvement')]
+        self._path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self._path)
+    
+    def test_memory_hit_miss(self):
+        cache = jdic.MemoryCache()
+        self.assertEqual(cache.get(self._key), None)
+        cache.set(self._key, self._entries)
+        self.assertEqual(cache.get(self._key), self._entries)
+        
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+    
+    def test_memory_lru_eviction(self):
+        cache = jdic.MemoryCache(dict(maxsize=2))
+        cache.set(('a', 1), [1])
+        cache.set(('a', 2), [2])
+        cache.get(('a', 1))
+        cache.set(('a', 3), [3])
+        
+        self.assertEqual(cache.get(('a', 2)), None)
+        self.assertEqual(cache.get(('a', 1)), [1])
+        self.assertEqual(cache.stats()['evictions'], 1)
+    
+    def test_memory_ttl(self):
+        cache = jdic.MemoryCache(dict(ttl=0))
+        cache.set(self._key, self._entries)
+        self.assertEqual(cache.get(self._key), None)
+        self.assertEqual(cache.stats()['expirations'], 1)
+    
+    def test_negative_ttl(self):
+        cache = jdic.MemoryCache(dict(ttl=60, negative_ttl=0))
+        cache.set(self._key, [])
+        self.assertEqual(cache.get(self._key), None)
+        
+        cache = jdic.MemoryCache(dict(ttl=0, negative_ttl=60))
+        cache.set(self._key, [])
+        self.assertEqual(cache.get(self._key), [])
+    
+    def test_disk_survives_restart(self):
+        jdic.DiskCache(dict(path=self._path)).set(self._key, self._entries)
+        
+        cache = jdic.DiskCache(dict(path=self._path))
+        self.assertEqual(cache.get(self._key), self._entries)
+    
+    def test_tiered_promotes_disk_hits(self):
+        jdic.DiskCache(dict(path=self._path)).set(self._key, self._entries)
+        cache = jdic.TieredCache(jdic.MemoryCache(), jdic.DiskCache(dict(path=self._path)))
+        
+        self.assertEqual(cache.get(self._key), self._entries)
+        self.assertEqual(cache.memory.get(self._key), self._entries)
+        self.assertEqual(cache.stats()['disk']['hits'], 1)
+    
+    def test_client_uses_cache(self):
+        pool = MockPool(lambda: u"<pre>\n向上 [こうじょう] /(n) improvement/\n</pre>".encode('utf-8'))
+        client = jdic.Client(dict(pool=pool, cache=jdic.MemoryCache()))
+        
+        client.get_word_jp('koujou')
+        entries = client.get_word_jp('koujou')
+        self.assertEqual(entries[0]['word'], u'向上')
+        self.assertEqual(len(pool.urls), 1)
+
+class AsyncClientTests(unittest.TestCase):
+    def setUp(self):
+        self._server = StandInServer()
+        self._server.start()
+        self._client = jdic.AsyncClient(dict(base_url=self._server.url + '/cgi?', concurrency=2))
+    
+    def tearDown(self):
+        self._client.close()
+        self._server.stop()
+    
+    def _get_word_entry(self):
+        return u"""<pre>
+向上 [こうじょう] /(n) improvement/
+</pre>""".encode('utf-8')
+    
+    def _get_kanji_entry(self):
+        return u"""<pre>
+付 4955 U4ed8 B9 G4 S5 F322 J2 P1-2-3 Yfu4 Wbu フ つ.ける つ.く T1 つけ {adhere} {attach} 
+</pre>""".encode('utf-8')
+    
+    def test_matches_sync_client(self):
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        client = jdic.Client(dict(base_url=self._server.url + '/cgi?'))
+        
+        future = self._client.get_word_jp('koujou')
+        self.assertEqual(future.result(5), client.get_word_jp('koujou'))
+        client.close()
+    
+    def test_radical_index_matches_sync_client(self):
+        self._server.add_handler('/cgi?1ZFX%E4%B8%80',
+            lambda: u'<pre>\n一 306C U4e00 {one}\n下 323C U4e0b {below}\n中 4366 U4e2d {in}\n</pre>'.encode('utf-8'))
+        index = jdic.RadicalIndex.from_radkfile(os.path.join(FIXTURES, 'radkfile_sample.txt'), 'utf-8')
+        options = dict(base_url=self._server.url + '/cgi?', radical_index=index)
+        client = jdic.Client(options)
+        async_client = jdic.AsyncClient(options)
+        
+        entries = async_client.get_kanji_by_radical(u'一').result(5)
+        self.assertEqual([entry['kanji'] for entry in entries], [u'一', u'下'])
+        self.assertEqual(entries, client.get_kanji_by_radical(u'一'))
+        async_client.close()
+        client.close()
+    
+    def test_kanji(self):
+        self._server.add_handler('/cgi?1ZMJ%E4%BB%98', self._get_kanji_entry)
+        
+        entries = self._client.get_kanji('付').result(5)
+        self.assertEqual(entries[0]['kanji'], u'付')
+        self.assertEqual(entries[0]['meanings'], ['adhere', 'attach'])
+    
+    def test_concurrency_limit(self):
+        lock = threading.Lock()
+        active = dict(current=0, peak=0)
+        
+        def slow_entry():
+            with lock:
+                active['current'] += 1
+                active['peak'] = max(active['peak'], active['current'])
+            time.sleep(0.05)
+            with lock:
+                active['current'] -= 1
+            return self._get_word_entry()
+        
+        #distinct values, identical lookups would share a single request
+        for i in range(6):
+            self._server.add_handler('/cgi?4ZUJkoujou{0}'.format(i), slow_entry)
+        futures = [self._client.get_word_jp('koujou{0}'.format(i)) for i in range(6)]
+        results = [future.result(5) for future in jdic.as_completed(futures, 5)]
+        
+        self.assertEqual(len(results), 6)
+        self.assertEqual(active['peak'], 2)
+    
+    def test_timeout(self):
+        def stalled_entry():
+            time.sleep(0.5)
+            return self._get_word_entry()
+        
+        self._server.add_handler('/cgi?4ZUJkoujou', stalled_entry)
+        future = self._client.get_word_jp('koujou', timeout=0.05)
+        self.assertRaises(jdic.DeadlineExceeded, future.result, 5)
+    
+    def test_cancel_pending(self):
+        event = threading.Event()
+        
+        def blocked_entry():
+            event.wait(5)
+            return self._get_word_entry()
+        
+        self._server.add_handler('/cgi?4ZUJkoujou', blocked_entry)
+        running = [self._client.get_word_jp('koujou') for i in range(2)]
+        pending = self._client.get_word_jp('koujou')
+        
+        self.assertTrue(pending.cancel())
+        self.assertRaises(jdic.CancelledError, pending.result)
+        event.set()
+        for future in running:
+            self.assertEqual(len(future.result(5)), 1)
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        self._pool = MockPool(self._get_entry)
+        self._client = jdic.Client(dict(pool=self._pool, workers=3))
+    
+    def tearDown(self):
+        self._client.close()
+    
+    def _get_entry(self):
+        return u"""<pre>
+向上 [こうじょう] /(n) improvement/
+</pre>""".encode('utf-8')
+    
+    def test_get_many_in_order(self):
+        values = ['c', 'a', 'b', 'a']
+        results = self._client.get_many(jdic.SearchType.WORD_EN, values)
+        
+        self.assertEqual([result['search_value'] for result in results], values)
+        self.assertEqual(results[0]['entries'][0]['word'], u'向上')
+        self.assertEqual(results[0]['error'], None)
+    
+    def test_get_many_deduplicates(self):
+        self._client.get_many(jdic.SearchType.WORD_EN, ['a', 'b', 'a', 'a'])
+        self.assertEqual(sorted(self._pool.urls), sorted(set(self._pool.urls)))
+        self.assertEqual(len(self._pool.urls), 2)
+    
+    def test_get_many_reports_failures(self):
+        def open(url, headers=None, timeout=None):
+            if url.endswith('bad'):
+                raise IOError('connection refused')
+            return MockFileLike(self._get_entry())
+        self._pool.open = open
+        
+        results = self._client.get_many(jdic.SearchType.WORD_EN, ['good', 'bad'])
+        self.assertEqual(len(results[0]['entries']), 1)
+        self.assertEqual(results[1]['entries'], None)
+        self.assertTrue(isinstance(results[1]['error'], IOError))
+    
+    def test_get_many_radical_index(self):
+        index = jdic.RadicalIndex.from_radkfile(os.path.join(FIXTURES, 'radkfile_sample.txt'), 'utf-8')
+        request = jdic.LocalRequest(dict(kanjidic=os.path.join(FIXTURES, 'kanjidic_sample.txt'), encoding='utf-8'))
+        client = jdic.Client(dict(pool=self._pool, request=request, radical_index=index))
+        
+        results = client.get_many(jdic.SearchType.KANJI_BY_RADICAL, [u'一', u'化'])
+        self.assertEqual([result['error'] for result in results], [None, None])
+        self.assertEqual([[entry['kanji'] for entry in result['entries']] for result in results],
+            [[u'一', u'丁', u'下'], [u'付']])
+        self.assertEqual(self._pool.urls, [])
+        client.close()
+        request.close()
+    
+    def test_worker_base_exception(self):
+        def exit():
+            raise SystemExit()
+        pool = jdic.executor.WorkerPool(1)
+        try:
+            self.assertRaises(SystemExit, pool.submit(exit).result, 1)
+            #the worker survives it
+            self.assertEqual(pool.submit(lambda: 1).result(1), 1)
+        finally:
+            pool.shutdown()
+    
+    def test_iter_many(self):
+        results = list(self._client.iter_many(jdic.SearchType.WORD_EN, ['a', 'b', 'a'], workers=2))
+        self.assertEqual(sorted(result['search_value'] for result in results), ['a', 'b'])
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+class LocalRequestTests(unittest.TestCase):
+    def setUp(self):
+        self._request = jdic.LocalRequest(dict(
+            edict=os.path.join(FIXTURES, 'edict_sample.txt'),
+            kanjidic=os.path.join(FIXTURES, 'kanjidic_sample.txt'),
+            radkfile=os.path.join(FIXTURES, 'radkfile_sample.txt'),
+            encoding='utf-8'
+        ))
+        self._client = jdic.Client(dict(request=self._request))
+    
+    def tearDown(self):
+        self._request.close()
+    
+    def test_word_jp_headword(self):
+        entries = self._client.get_word_jp('向上')
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['reading'], u'こうじょう')
+        self.assertEqual(entries[0]['wordtype'], ['n', 'vs'])
+    
+    def test_word_jp_reading(self):
+        entries = self._client.get_word_jp(u'こうじょう')
+        self.assertEqual([entry['word'] for entry in entries], [u'工場', u'向上'])
+    
+    def test_lines_without_wordtype_skipped(self):
+        path = tempfile.mkdtemp()
+        try:
+            edict = os.path.join(path, 'edict.txt')
+            with open(edict, 'wb') as f:
+                f.write(u'ＡＢＣ [エービーシー] /ABC/American Broadcasting Company/\n'.encode('utf-8'))
+                f.write(u'ＡＢＣ順 [エービーシーじゅん] /(n) alphabetical order/ABC order/\n'.encode('utf-8'))
+            request = jdic.LocalRequest(dict(edict=edict, encoding='utf-8'))
+            entries = request.get(dict(search_type=jdic.SearchType.WORD_EN, search_value='abc'))
+            self.assertEqual([entry['word'] for entry in entries], [u'ＡＢＣ順'])
+            request.close()
+        finally:
+            shutil.rmtree(path)
+    
+    def test_word_jp_alternate_headword(self):
+        entries = self._client.get_word_jp(u'降る')
+        self.assertEqual(entries[0]['word'], u'下る;降る')
+    
+    def test_word_en(self):
+        entries = self._client.get_word_en('to eat')
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['word'], u'食べる')
+        self.assertEqual(self._client.get_word_en('spaceship'), [])
+    
+    def test_kanji_matches_http_parsing(self):
+        entries = self._client.get_kanji('付')
+        with open(os.path.join(FIXTURES, 'kanjidic_sample.txt')) as f:
+            line = f.readlines()[-1].decode('utf-8')
+        http_entries = jdic.KanjiRequestHandler().parse_response(u'<pre>\n{0}\n</pre>'.format(line))
+        self.assertEqual(entries, http_entries)
+    
+    def test_kanji_by_radical(self):
+        entries = self._client.get_kanji_by_radical('一')
+        self.assertEqual([entry['kanji'] for entry in entries], [u'一', u'丁', u'下'])
+        self.assertEqual(self._client.get_kanji_by_radical('化')[0]['kanji'], u'付')
+    
+    def test_missing_dictionary(self):
+        request = jdic.LocalRequest(dict(kanjidic=os.path.join(FIXTURES, 'kanjidic_sample.txt')))
+        self.assertRaises(ValueError, request.get, dict(search_type=jdic.SearchType.WORD_EN, search_value='eat'))
+
+class StreamingTests(unittest.TestCase):
+    def setUp(self):
+        self._pool = MockPool(self._get_kanji_entries)
+        self._client = jdic.Client(dict(pool=self._pool))
+    
+    def _get_kanji_entries(self):
+        with open(os.path.join(FIXTURES, 'kanjidic_sample.txt')) as f:
+            lines = [line for line in f if not line.startswith('#')]
+        return '<HTML><BODY>\n<pre>\n{0}</pre>\n</BODY></HTML>'.format(''.join(lines))
+    
+    def test_iter_matches_parse_response(self):
+        request = jdic.HttpRequest(dict(pool=self._pool))
+        options = dict(search_type=jdic.SearchType.KANJI_BY_RADICAL, search_value='一')
+        
+        #small chunks split lines and multibyte characters
+        for chunk_size in (1, 7, 64, 8192):
+            self.assertEqual(list(request.iter_get(options, chunk_size)), request.get(options))
+    
+    def test_iter_word(self):
+        self._pool = MockPool(lambda: u"<pre>\n控除 [こうじょ] /(n) exemption/\n工場 [こうじょう] /(n) factory/\n</pre>".encode('utf-8'))
+        client = jdic.Client(dict(pool=self._pool))
+        
+        entries = list(client.iter_word_jp('koujou'))
+        self.assertEqual([entry['word'] for entry in entries], [u'控除', u'工場'])
+    
+    def test_iter_empty(self):
+        self._pool = MockPool(lambda: '<HTML><BODY>\n<pre>\n</pre>\n</BODY></HTML>')
+        client = jdic.Client(dict(pool=self._pool))
+        self.assertEqual(list(client.iter_kanji('a')), [])
+    
+    def test_stop_early_releases_response(self):
+        entries = self._client.iter_kanji_by_radical('一')
+        self.assertEqual(next(entries)['kanji'], u'一')
+        self.assertFalse(self._pool.response.closed)
+        
+        entries.close()
+        self.assertTrue(self._pool.response.closed)
+    
+    def test_iter_caches_complete_results(self):
+        client = jdic.Client(dict(pool=self._pool, cache=jdic.MemoryCache()))
+        
+        entries = client.iter_kanji_by_radical('一')
+        next(entries)
+        entries.close()
+        self.assertEqual(len(list(client.iter_kanji_by_radical('一'))), 4)
+        self.assertEqual(len(list(client.iter_kanji_by_radical('一'))), 4)
+        self.assertEqual(len(self._pool.urls), 2)
+
+class EntryTests(unittest.TestCase):
+    def setUp(self):
+        options = dict(entry_format='object')
+        with open(os.path.join(FIXTURES, 'kanjidic_sample.txt')) as f:
+            lines = [line for line in f if not line.startswith('#')]
+        response = u'<pre>\n{0}</pre>'.format(''.join(lines).decode('utf-8'))
+        
+        self._kanji = jdic.KanjiRequestHandler(options).parse_response(response)
+        self._dicts = jdic.KanjiRequestHandler().parse_response(response)
+        self._words = jdic.WordRequestHandler(options).parse_response(
+            u"<pre>\n控除 [こうじょ] /(n,vs) exemption/\n工場 [こうじょう] /(n) factory/\n</pre>")
+    
+    def test_kanji_matches_dict_format(self):
+        self.assertEqual([entry.to_dict() for entry in self._kanji], self._dicts)
+        self.assertEqual(self._kanji[0]['meanings'], self._dicts[0]['meanings'])
+    
+    def test_kanji_parsed_lazily(self):
+        entry = self._kanji[3]
+        self.assertEqual(entry._fields, None)
+        self.assertEqual(entry.kanji, u'付')
+        self.assertNotEqual(entry._fields, None)
+    
+    def test_kanji_codes(self):
+        entry = self._kanji[3]
+        self.assertEqual(entry.jis, '4955')
+        self.assertEqual(entry.unicode, '4ed8')
+        self.assertEqual(entry.stroke_count, 5)
+        self.assertEqual(entry.grade, 4)
+        self.assertEqual(entry.frequency, 322)
+        self.assertEqual(entry.jlpt, 2)
+        self.assertEqual(entry.skip, '1-2-3')
+        self.assertEqual(entry.pinyin, ['fu4'])
+        self.assertEqual(entry.codes['MP'], ['1.0601'])
+        self.assertEqual(entry.nanori, [u'つけ'])
+    
+    def test_kanji_missing_code(self):
+        self.assertEqual(self._kanji[1].grade, 3)
+        self.assertEqual(self._kanji[1].pinyin, ['ding1', 'zheng1'])
+        self.assertEqual(jdic.KanjiEntry(u'乃 4735 U4e43 S2 ナイ', None).frequency, None)
+    
+    def test_word_entry(self):
+        entry = self._words[0]
+        self.assertEqual(entry.word, u'控除')
+        self.assertEqual(entry['reading'], u'こうじょ')
+        self.assertEqual(entry.to_dict()['wordtype'], ['n', 'vs'])
+        self.assertRaises(AttributeError, setattr, entry, 'extra', 1)
+    
+    def test_word_entry_hash(self):
+        entry = jdic.WordEntry(u'控除', u'こうじょ', ['n', 'vs'], self._words[0].definition)
+        self.assertEqual(hash(entry), hash(self._words[0]))
+        self.assertEqual(len(set([entry, self._words[0], self._words[1]])), 2)
+    
+    def test_wordtype_interned(self):
+        self.assertTrue(self._words[0].wordtype[0] is self._words[1].wordtype[0])
+    
+    def test_client_entry_format(self):
+        pool = MockPool(lambda: u"<pre>\n工場 [こうじょう] /(n) factory/\n</pre>".encode('utf-8'))
+        client = jdic.Client(dict(pool=pool, entry_format='object'))
+        self.assertTrue(isinstance(client.get_word_jp('koujou')[0], jdic.WordEntry))
+    
+    def test_entries_pickle(self):
+        import cPickle as pickle
+        entry = pickle.loads(pickle.dumps(self._kanji[3], pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(entry.stroke_count, 5)
+        self.assertEqual(pickle.loads(pickle.dumps(self._words[0], pickle.HIGHEST_PROTOCOL)), self._words[0])
+
+class InstrumentationTests(unittest.TestCase):
+    def setUp(self):
+        self._server = StandInServer()
+        self._server.start()
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        
+        self._instrumentation = jdic.Instrumentation()
+        self._collector = jdic.HistogramCollector().install(self._instrumentation)
+        self._client = jdic.Client(dict(base_url=self._server.url + '/cgi?', instrumentation=self._instrumentation))
+    
+    def tearDown(self):
+        self._client.close()
+        self._server.stop()
+    
+    def _get_word_entry(self):
+        return u"""<pre>
+控除 [こうじょ] /(n) exemption/
+工場 [こうじょう] /(n) factory/
+</pre>""".encode('utf-8')
+    
+    def test_phases(self):
+        self._client.get_word_jp('koujou')
+        self._client.get_word_jp('koujou')
+        phases = self._collector.snapshot()['phases']
+        
+        for phase in ('first_byte', 'read', 'decode', 'parse'):
+            self.assertEqual(phases[phase]['count'], 2)
+        
+        #second lookup reuses the pooled connection
+        self.assertEqual(phases['dns']['count'], 1)
+        self.assertEqual(phases['connect']['count'], 1)
+    
+    def test_counters(self):
+        self._client.get_word_jp('koujou')
+        list(self._client.iter_word_jp('koujou'))
+        counters = self._collector.snapshot()['counters']
+        
+        self.assertEqual(counters['requests'], 2)
+        self.assertEqual(counters['connections'], 1)
+        self.assertEqual(counters['entries'], 4)
+        self.assertEqual(counters['bytes'], len(self._get_word_entry()) * 2)
+    
+    def test_errors_counted(self):
+        client = jdic.Client(dict(base_url='http://127.0.0.1:1/cgi?', instrumentation=self._instrumentation))
+        self.assertRaises(socket.error, client.get_word_jp, 'koujou')
+        self.assertEqual(self._collector.snapshot()['counters']['errors'], 1)
+    
+    def test_connect_tries_every_address(self):
+        #nothing listens on a port that was just released
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        dead = sock.getsockname()
+        sock.close()
+        
+        live = ('127.0.0.1', int(self._server.url.rsplit(':', 1)[1]))
+        getaddrinfo = socket.getaddrinfo
+        
+        def resolve(host, port, *args):
+            #the server's address resolves to an unreachable one first
+            if port != live[1]:
+                return getaddrinfo(host, port, *args)
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', address) for address in (dead, live)]
+        socket.getaddrinfo = resolve
+        try:
+            self.assertEqual(len(self._client.get_word_jp('koujou')), 2)
+        finally:
+            socket.getaddrinfo = getaddrinfo
+        self.assertEqual(self._collector.snapshot()['phases']['connect']['count'], 1)
+    
+    def test_phase_hook(self):
+        phases = []
+        self._instrumentation.add_phase_hook(lambda phase, seconds: phases.append(phase))
+        self._client.get_word_jp('koujou')
+        self.assertEqual(phases, ['dns', 'connect', 'first_byte', 'read', 'decode', 'parse'])
+    
+    def test_histogram_buckets(self):
+        collector = jdic.HistogramCollector(buckets=[0.1, 1])
+        for seconds in (0.05, 0.5, 5):
+            collector.observe('parse', seconds)
+        
+        histogram = collector.snapshot()['phases']['parse']
+        self.assertEqual(histogram['buckets'], [(0.1, 1), (1, 2), (float('inf'), 3)])
+        self.assertTrue('jdic_phase_seconds_bucket{phase="parse",le="+Inf"} 3' in collector.render())
+
+class RadicalIndexTests(unittest.TestCase):
+    def setUp(self):
+        self._index = jdic.RadicalIndex.from_radkfile(os.path.join(FIXTURES, 'radkfile_sample.txt'), 'utf-8')
+        self._path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self._path)
+    
+    def test_single_radical(self):
+        self.assertEqual(self._index.kanji(u'一'), [u'一', u'丁', u'下'])
+        self.assertEqual(self._index.kanji(u'口'), [])
+    
+    def test_intersection(self):
+        self.assertEqual(self._index.kanji(u'一｜'), [u'下'])
+        self.assertEqual(self._index.kanji([u'一', u'化']), [])
+        self.assertEqual(self._index.kanji('一｜'), [u'下'])
+    
+    def test_save_load(self):
+        path = os.path.join(self._path, 'radicals.idx')
+        self._index.save(path)
+        index = jdic.RadicalIndex.load(path)
+        
+        self.assertEqual(index.radicals(), self._index.radicals())
+        self.assertEqual(index.kanji(u'化'), [u'付'])
+    
+    def test_client_with_index(self):
+        request = jdic.LocalRequest(dict(kanjidic=os.path.join(FIXTURES, 'kanjidic_sample.txt'), encoding='utf-8'))
+        path = os.path.join(self._path, 'radicals.idx')
+        self._index.save(path)
+        client = jdic.Client(dict(request=request, radical_index=path))
+        
+        self.assertEqual([entry['kanji'] for entry in client.get_kanji_by_radical('一')], [u'一', u'丁', u'下'])
+        entries = client.get_kanji_by_radicals(u'一｜')
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['meanings'][0], 'below')
+        client.close()
+    
+    def test_local_request_intersection(self):
+        request = jdic.LocalRequest(dict(
+            kanjidic=os.path.join(FIXTURES, 'kanjidic_sample.txt'),
+            radical_index=self._index,
+            encoding='utf-8'
+        ))
+        entries = request.get(dict(search_type=jdic.SearchType.KANJI_BY_RADICAL, search_value=u'｜一'))
+        self.assertEqual([entry['kanji'] for entry in entries], [u'下'])
+    
+    def test_client_without_index_intersects_lookups(self):
+        responses = {
+            u'1ZFX一': u'<pre>\n一 306C U4e00 {one}\n下 323C U4e0b {below}\n</pre>',
+            u'1ZFX｜': u'<pre>\n下 323C U4e0b {below}\n中 4366 U4e2d {in}\n</pre>'
+        }
+        pool = MockPool(None)
+        pool.open = lambda url, headers=None, timeout=None: MockFileLike(responses[url[-5:]].encode('utf-8'))
+        client = jdic.Client(dict(pool=pool))
+        
+        entries = client.get_kanji_by_radicals(u'一｜')
+        self.assertEqual([entry['kanji'] for entry in entries], [u'下'])
+        client.close()
+    
+    def test_client_with_index_over_http(self):
+        pool = MockPool(lambda: u'<pre>\n下 323C U4e0b {below}\n</pre>'.encode('utf-8'))
+        client = jdic.Client(dict(pool=pool, radical_index=self._index))
+        
+        #only the rarest radical is looked up, in a single request
+        entries = client.get_kanji_by_radicals(u'一｜')
+        self.assertEqual([entry['kanji'] for entry in entries], [u'下'])
+        self.assertEqual(pool.urls, [u'http://www.csse.monash.edu.au/~jwb/cgi-bin/wwwjdic.cgi?1ZFX｜'])
+        
+        self.assertEqual(client.get_kanji_by_radicals(u'一化'), [])
+        self.assertEqual(len(pool.urls), 1)
+        client.close()
+
+class CoalescingTests(unittest.TestCase):
+    def setUp(self):
+        self._server = StandInServer()
+        self._server.start()
+        self._requests = []
+        self._release = threading.Event()
+    
+    def tearDown(self):
+        self._server.stop()
+    
+    def _get_word_entry(self):
+        self._requests.append(1)
+        self._release.wait(5)
+        return u"<pre>\n向上 [こうじょう] /(n) improvement/\n</pre>".encode('utf-8')
+    
+    def _lookup_concurrently(self, client, count):
+        results = []
+        
+        def lookup():
+            try:
+                results.append(client.get_word_jp('koujou'))
+            except Exception as e:
+                results.append(e)
+        
+        threads = [threading.Thread(target=lookup) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        
+        #give every thread time to join the lookup in flight
+        time.sleep(0.2)
+        self._release.set()
+        for thread in threads:
+            thread.join()
+        return results
+    
+    def test_identical_lookups_share_request(self):
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        instrumentation = jdic.Instrumentation()
+        collector = jdic.HistogramCollector().install(instrumentation)
+        client = jdic.Client(dict(base_url=self._server.url + '/cgi?', instrumentation=instrumentation))
+        
+        results = self._lookup_concurrently(client, 8)
+        self.assertEqual(len(self._requests), 1)
+        self.assertEqual([result[0]['word'] for result in results], [u'向上'] * 8)
+        self.assertEqual(collector.snapshot()['counters']['coalesced'], 7)
+        
+        #the next lookup is a new request
+        client.get_word_jp('koujou')
+        self.assertEqual(len(self._requests), 2)
+        client.close()
+    
+    def test_errors_shared(self):
+        pool = MockPool(None)
+        
+        def open(url, headers=None, timeout=None):
+            self._release.wait(5)
+            raise IOError('connection reset')
+        pool.open = open
+        client = jdic.Client(dict(pool=pool))
+        
+        results = self._lookup_concurrently(client, 4)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(isinstance(result, IOError) for result in results))
+    
+    def test_leader_deadline_not_shared(self):
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        client = jdic.Client(dict(base_url=self._server.url + '/cgi?'))
+        errors = []
+        
+        def lead():
+            try:
+                client.get_word_jp('koujou', 0.1)
+            except Exception as e:
+                errors.append(e)
+        
+        leader = threading.Thread(target=lead)
+        leader.start()
+        while not self._requests:
+            time.sleep(0.01)
+        
+        #the follower joins the leader's request, then sends its own once the leader times out
+        release = threading.Timer(0.3, self._release.set)
+        release.start()
+        entries = client.get_word_jp('koujou')
+        leader.join()
+        
+        self.assertTrue(isinstance(errors[0], jdic.DeadlineExceeded))
+        self.assertEqual(entries[0]['word'], u'向上')
+        self.assertEqual(len(self._requests), 2)
+        client.close()
+    
+    def test_coalescing_disabled(self):
+        self._server.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        client = jdic.Client(dict(base_url=self._server.url + '/cgi?', coalesce=False))
+        
+        self._lookup_concurrently(client, 3)
+        self.assertEqual(len(self._requests), 3)
+        client.close()
+
+class LookupServerTests(unittest.TestCase):
+    def setUp(self):
+        self._upstream = StandInServer()
+        self._upstream.start()
+        self._upstream.add_handler('/cgi?4ZUJkoujou', self._get_word_entry)
+        self._upstream.add_handler('/cgi?1ZMJ%E4%BB%98', self._get_kanji_entry)
+        
+        self._cache = jdic.MemoryCache()
+        client = jdic.Client(dict(base_url=self._upstream.url + '/cgi?', cache=self._cache))
+        self._server = jdic.LookupServer(dict(client=client, cache=self._cache, port=0))
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        self._client = jdic.RemoteClient(dict(url=self._server.url))
+    
+    def tearDown(self):
+        self._client.close()
+        self._server.shutdown()
+        self._server.server_close()
+        self._upstream.stop()
+    
+    def _get_word_entry(self):
+        return u"<pre>\n向上 [こうじょう] /(n) improvement/\n</pre>".encode('utf-8')
+    
+    def _get_kanji_entry(self):
+        return u"<pre>\n付 4955 U4ed8 B9 G4 S5 フ つ.ける T1 つけ {adhere} {attach} \n</pre>".encode('utf-8')
+    
+    def test_lookup(self):
+        entries = self._client.get_word_jp('koujou')
+        self.assertEqual(entries, [dict(word=u'向上', reading=u'こうじょう', wordtype=[u'n'], definition=u'improvement')])
+    
+    def test_lookup_kanji(self):
+        entries = self._client.get_kanji(u'付')
+        self.assertEqual(entries[0]['kanji'], u'付')
+        self.assertEqual(entries[0]['readings']['kun'], [u'つ.ける'])
+    
+    def test_shared_cache_and_stats(self):
+        for i in range(3):
+            self._client.get_word_jp('koujou')
+        
+        stats = self._client.stats()
+        self.assertEqual(stats['lookups'], 3)
+        self.assertEqual(stats['cache']['hits'], 2)
+        self.assertEqual(self._upstream.connections, 1)
+    
+    def test_concurrent_clients(self):
+        results = []
+        
+        def lookup():
+            client = jdic.RemoteClient(dict(url=self._server.url))
+            results.append(client.get_word_jp('koujou')[0]['word'])
+            client.close()
+        
+        threads = [threading.Thread(target=lookup) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [u'向上'] * 8)
+    
+    def test_radical_index_routing(self):
+        self._upstream.add_handler('/cgi?1ZFX%E4%B8%80',
+            lambda: u'<pre>\n一 306C U4e00 {one}\n中 4366 U4e2d {in}\n</pre>'.encode('utf-8'))
+        index = jdic.RadicalIndex.from_radkfile(os.path.join(FIXTURES, 'radkfile_sample.txt'), 'utf-8')
+        self._server.client.close()
+        self._server.client = jdic.Client(dict(base_url=self._upstream.url + '/cgi?', radical_index=index))
+        
+        self.assertEqual([entry['kanji'] for entry in self._client.get_kanji_by_radical(u'一')], [u'一'])
+    
+    def test_bad_request(self):
+        self.assertRaises(IOError, self._client._get, 'unknown', 'koujou')
+        self.assertEqual(self._client.stats()['errors'], 1)
+    
+    def test_invalid_utf8(self):
+        self.assertRaises(IOError, self._client._request, '/lookup?type=word_en&q=%FF')
+        self.assertEqual(self._client.stats()['errors'], 1)
+    
+    def test_non_json_error(self):
+        client = jdic.RemoteClient(dict(url=self._upstream.url))
+        try:
+            client.stats()
+        except IOError as e:
+            self.assertTrue(str(e).startswith('jdic server error 404'))
+        else:
+            self.fail('expected an IOError')
+        finally:
+            client.close()
+    
+    def test_upstream_error(self):
+        self._upstream.stop()
+        self.assertRaises(IOError, self._client.get_word_en, 'factory')
+
+class BatchModeTests(unittest.TestCase):
+    def _get_entry(self):
+        return u"<pre>\n工場 [こうじょう] /(n) factory/\n</pre>".encode('utf-8')
+    
+    def test_json_lines(self):
+        client = jdic.Client(dict(pool=MockPool(self._get_entry)))
+        output = StringIO.StringIO()
+        lookups, errors = jdic.run_batch(client, jdic.SearchType.WORD_EN, ['factory\n', '\n', '  plant \n'], output, 2)
+        
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual((lookups, errors), (2, 0))
+        self.assertEqual(sorted(result['search_value'] for result in results), ['factory', 'plant'])
+        self.assertEqual(results[0]['entries'][0]['word'], u'工場')
+    
+    def test_radical_index_routing(self):
+        pool = MockPool(lambda: u'<pre>\n一 306C U4e00 {one}\n中 4366 U4e2d {in}\n</pre>'.encode('utf-8'))
+        index = jdic.RadicalIndex.from_radkfile(os.path.join(FIXTURES, 'radkfile_sample.txt'), 'utf-8')
+        client = jdic.Client(dict(pool=pool, radical_index=index))
+        output = StringIO.StringIO()
+        jdic.run_batch(client, jdic.SearchType.KANJI_BY_RADICAL, [u'一'], output, 1)
+        
+        result = json.loads(output.getvalue())
+        self.assertEqual([entry['kanji'] for entry in result['entries']], [u'一'])
+    
+    def test_errors_per_line(self):
+        pool = MockPool(self._get_entry)
+        open = pool.open
+        
+        def failing_open(url, headers=None, timeout=None):
+            if url.endswith('bad'):
+                raise IOError('connection refused')
+            return open(url, headers, timeout)
+        pool.open = failing_open
+        
+        output = StringIO.StringIO()
+        lookups, errors = jdic.run_batch(jdic.Client(dict(pool=pool)), jdic.SearchType.WORD_EN, ['good', 'bad'], output, 2)
+        results = dict((result['search_value'], result) for result in map(json.loads, output.getvalue().splitlines()))
+        
+        self.assertEqual(errors, 1)
+        self.assertEqual(results['bad']['error'], 'IOError: connection refused')
+        self.assertEqual(len(results['good']['entries']), 1)
+    
+    def test_input_read_lazily(self):
+        pulled = []
+        
+        def terms():
+            for i in range(100):
+                pulled.append(i)
+                yield 'term{0}'.format(i)
+        
+        class Output(object):
+            def write(self, line):
+                #no more than the window of pending lookups is read ahead of the output
+                assert len(pulled) - written[0] <= 4
+                written[0] += 1
+            
+            def flush(self):
+                pass
+        
+        written = [0]
+        client = jdic.Client(dict(pool=MockPool(self._get_entry)))
+        self.assertEqual(jdic.run_batch(client, jdic.SearchType.WORD_EN, terms(), Output(), 2), (100, 0))
+
+class MirrorTests(unittest.TestCase):
+    def setUp(self):
+        self._servers = [StandInServer(), StandInServer()]
+        for server in self._servers:
+            server.start()
+            server.hits = []
+        self._mirrors = [server.url + '/cgi?' for server in self._servers]
+    
+    def tearDown(self):
+        for server in self._servers:
+            server.stop()
+    
+    def _add_handler(self, server, delay=0):
+        def entry():
+            server.hits.append(1)
+            time.sleep(delay)
+            return u"<pre>\n向上 [こうじょう] /(n) improvement/\n</pre>".encode('utf-8')
+        server.add_handler('/cgi?4ZUJkoujou', entry)
+    
+    def test_fastest_mirror_selected(self):
+        mirrors = jdic.MirrorSet(dict(mirrors=self._mirrors))
+        mirrors.record_success(self._mirrors[0], 0.5)
+        mirrors.record_success(self._mirrors[1], 0.1)
+        self.assertEqual(mirrors.select(), self._mirrors[1])
+        
+        mirrors.record_success(self._mirrors[1], 2.0)
+        self.assertEqual(mirrors.select(), self._mirrors[0])
+    
+    def test_failed_mirror_ejected_with_backoff(self):
+        mirrors = jdic.MirrorSet(dict(mirrors=self._mirrors, backoff=60))
+        mirrors.record_failure(self._mirrors[0])
+        self.assertTrue(mirrors.is_ejected(self._mirrors[0]))
+        self.assertEqual(mirrors.select(), self._mirrors[1])
+        
+        #all mirrors ejected, the one that comes back first is used
+        mirrors.record_failure(self._mirrors[0])
+        mirrors.record_failure(self._mirrors[1])
+        self.assertEqual(mirrors.select(), self._mirrors[1])
+        
+        mirrors.record_success(self._mirrors[0], 0.1)
+        self.assertFalse(mirrors.is_ejected(self._mirrors[0]))
+    
+    def test_failover(self):
+        #nothing listens on a port that was just released
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        dead = 'http://127.0.0.1:{0}/cgi?'.format(sock.getsockname()[1])
+        sock.close()
+        
+        self._add_handler(self._servers[1])
+        mirrors = jdic.MirrorSet(dict(mirrors=[dead, self._mirrors[1]]))
+        mirrors.record_success(dead, 0.01)
+        mirrors.record_success(self._mirrors[1], 0.1)
+        client = jdic.Client(dict(mirrors=mirrors))
+        
+        self.assertEqual(client.get_word_jp('koujou')[0]['word'], u'向上')
+        self.assertTrue(mirrors.is_ejected(dead))
+        self.assertEqual(len(self._servers[1].hits), 1)
+        client.close()
+    
+    def test_error_status_fails_over(self):
+        server = FakeWwwjdic(dict(error_rate=1)).start()
+        self._add_handler(self._servers[1])
+        mirrors = jdic.MirrorSet(dict(mirrors=[server.base_url, self._mirrors[1]]))
+        client = jdic.Client(dict(mirrors=mirrors, cache=jdic.MemoryCache()))
+        try:
+            self.assertEqual(client.get_word_jp('koujou')[0]['word'], u'向上')
+            self.assertTrue(mirrors.is_ejected(server.base_url))
+            self.assertEqual((server.requests, len(self._servers[1].hits)), (1, 1))
+        finally:
+            client.close()
+            server.stop()
+    
+    def test_deadline_does_not_eject(self):
+        self._add_handler(self._servers[0], delay=0.3)
+        mirrors = jdic.MirrorSet(dict(mirrors=self._mirrors[:1]))
+        client = jdic.Client(dict(mirrors=mirrors))
+        
+        self.assertRaises(jdic.DeadlineExceeded, client.get_word_jp, 'koujou', 0.1)
+        self.assertFalse(mirrors.is_ejected(self._mirrors[0]))
+        client.close()
+    
+    def test_hedge_percentile_fraction(self):
+        self.assertRaises(ValueError, jdic.MirrorSet, dict(mirrors=self._mirrors, hedge_percentile=95))
+        self.assertRaises(ValueError, jdic.MirrorSet, dict(mirrors=self._mirrors, hedge_percentile=0))
+    
+    def test_hedged_request(self):
+        self._add_handler(self._servers[0], delay=0.5)
+        self._add_handler(self._servers[1])
+        mirrors = jdic.MirrorSet(dict(mirrors=self._mirrors, hedge_percentile=0.5, hedge_min_samples=2))
+        #the slow mirror looks fastest, the hedge fires after 0.2s
+        mirrors.record_success(self._mirrors[0], 0.01)
+        mirrors.record_success(self._mirrors[1], 0.2)
+        client = jdic.Client(dict(mirrors=mirrors))
+        
+        start = time.time()
+        self.assertEqual(len(client.get_word_jp('koujou')), 1)
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual((len(self._servers[0].hits), len(self._servers[1].hits)), (1, 1))
+        client.close()
+    
+    def test_mirror_urls_option(self):
+        self._add_handler(self._servers[0])
+        self._add_handler(self._servers[1])
+        client = jdic.Client(dict(mirrors=self._mirrors))
+        
+        for i in range(3):
+            client.get_word_jp('koujou')
+        self.assertEqual(len(self._servers[0].hits) + len(self._servers[1].hits), 3)
+        self.assertEqual(list(client.iter_word_jp('koujou'))[0]['reading'], u'こうじょう')
+        client.close()
+
+class SchedulerTests(unittest.TestCase):
+    def test_token_bucket(self):
+        bucket = jdic.TokenBucket(10, burst=2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        self.assertTrue(0.05 < bucket.delay() <= 0.1)
+    
+    def test_rate_limit(self):
+        scheduler = jdic.Scheduler(dict(rate=20, burst=1))
+        start = time.time()
+        for i in range(5):
+            scheduler.run(lambda: None)
+        self.assertTrue(time.time() - start >= 0.18)
+    
+    def test_interactive_before_bulk(self):
+        scheduler = jdic.Scheduler(dict(concurrency=1, max_concurrency=1))
+        blocker = threading.Event()
+        order = []
+        
+        def run(name, priority):
+            scheduler.run(lambda: order.append(name), priority)
+        
+        def start(name, priority, queued):
+            thread = threading.Thread(target=run, args=(name, priority))
+            thread.start()
+            while scheduler.queued() < queued:
+                time.sleep(0.01)
+            return thread
+        
+        holder = threading.Thread(target=scheduler.run, args=(blocker.wait,))
+        holder.start()
+        while scheduler.running() < 1:
+            time.sleep(0.01)
+        
+        threads = [start('bulk{0}'.format(i), jdic.Priority.BULK, i + 1) for i in range(3)]
+        threads.append(start('interactive', jdic.Priority.INTERACTIVE, 4))
+        blocker.set()
+        for thread in [holder] + threads:
+            thread.join()
+        self.assertEqual(order, ['interactive', 'bulk0', 'bulk1', 'bulk2'])
+    
+    def test_adaptive_limit(self):
+        scheduler = jdic.Scheduler(dict(concurrency=4, max_concurrency=8, latency_target=0.05))
+        scheduler.acquire()
+        scheduler.release(0.01, error=True)
+        self.assertEqual(scheduler.limit(), 2)
+        
+        for i in range(10):
+            scheduler.acquire()
+            scheduler.release(0.01)
+        self.assertTrue(scheduler.limit() > 2)
+        
+        #slow responses cut the limit, at most once per round trip
+        time.sleep(0.1)
+        limit = scheduler._limit
+        scheduler.acquire()
+        scheduler.release(0.2)
+        scheduler.acquire()
+        scheduler.release(0.2)
+        self.assertEqual(scheduler.limit(), int(limit * 0.7))
+    
+    def test_caller_aborts_not_counted(self):
+        scheduler = jdic.Scheduler(dict(concurrency=4, latency_target=0.05))
+        
+        def fail(error):
+            def run():
+                time.sleep(0.1)
+                raise error
+            return run
+        
+        self.assertRaises(jdic.DeadlineExceeded, scheduler.run, fail(jdic.DeadlineExceeded('lookup timed out')))
+        self.assertRaises(jdic.CancelledError, scheduler.run, fail(jdic.CancelledError()))
+        self.assertEqual((scheduler.limit(), scheduler.running()), (4, 0))
+        
+        #the slot is freed whatever fn raises
+        self.assertRaises(KeyboardInterrupt, scheduler.run, fail(KeyboardInterrupt()))
+        self.assertEqual(scheduler.running(), 0)
+    
+    def test_client_concurrency(self):
+        server = StandInServer()
+        server.start()
+        active = [0, 0]
+        lock = threading.Lock()
+        
+        def slow_entry():
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.1)
+            with lock:
+                active[0] -= 1
+            return u"<pre>\n向上 [こうじょう] /(n) improvement/\n</pre>".encode('utf-8')
+        
+        values = ['koujou{0}'.format(i) for i in range(6)]
+        for value in values:
+            server.add_handler('/cgi?4ZUJ' + value, slow_entry)
+        
+        scheduler = jdic.Scheduler(dict(concurrency=2, max_concurrency=2, latency_target=0.05))
+        client = jdic.Client(dict(base_url=server.url + '/cgi?', scheduler=scheduler))
+        try:
+            results = client.get_many(jdic.SearchType.WORD_JP, values, workers=6)
+            self.assertEqual([len(result['entries']) for result in results], [1] * 6)
+            self.assertEqual(active[1], 2)
+            #responses were slower than the latency target
+            self.assertEqual(scheduler.limit(), 1)
+            self.assertEqual(len(list(client.iter_word_jp('koujou0'))), 1)
+            self.assertEqual(scheduler.running(), 0)
+        finally:
+            client.close()
+            server.stop()
+
+class CompressionTests(unittest.TestCase):
+    def setUp(self):
+        self._server = StandInServer()
+        self._server.start()
+        self._body = (u"<pre>\n" + u"向上 [こうじょう] /(n) improvement/\n" * 2000 + u"</pre>").encode('utf-8')
+        self._server.add_handler('/cgi?4ZUJkoujou', lambda: self._body)
+    
+    def tearDown(self):
+        self._server.stop()
+    
+    def test_decompressing_response(self):
+        for encoding, data in (('gzip', compress(self._body, 'gzip')), ('deflate', zlib.compress(self._body))):
+            response = jdic.DecompressingResponse(MockFileLike(data), encoding)
+            chunks = []
+            while True:
+                chunk = response.read(100)
+                if not chunk:
+                    break
+                self.assertTrue(len(chunk) <= 100)
+                chunks.append(chunk)
+            self.assertEqual(''.join(chunks), self._body)
+            self.assertEqual(response.compressed_bytes, len(data))
+    
+    def test_raw_deflate(self):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = compressor.compress(self._body) + compressor.flush()
+        response = jdic.DecompressingResponse(MockFileLike(data), 'deflate')
+        self.assertEqual(response.read(), self._body)
+    
+    def test_gzip_response(self):
+        self._server.compression = 'gzip'
+        instrumentation = jdic.Instrumentation()
+        collector = jdic.HistogramCollector().install(instrumentation)
+        client = jdic.Client(dict(base_url=self._server.url + '/cgi?', instrumentation=instrumentation))
+        
+        entries = client.get_word_jp('koujou')
+        self.assertEqual(len(entries), 2000)
+        self.assertEqual(entries[0]['word'], u'向上')
+        self.assertEqual(self._server.accept_encodings, ['gzip, deflate'])
+        
+        counters = collector.snapshot()['counters']
+        self.assertEqual(counters['bytes'], len(self._body))
+        self.assertTrue(counters['compressed_bytes'] < len(self._body) / 10)
+        
+        #the connection goes back to the pool once the compressed body is read
+        self.assertEqual(client._pool.idle_count(), 1)
+        client.close()
+    
+    def test_streaming_deflate_response(self):
+        self._server.compression = 'deflate'
+        client = jdic.Client(dict(base_url=self._server.url + '/cgi?'))
+        self.assertEqual(len(list(client.iter_word_jp('koujou'))), 2000)
+        client.close()
+    
+    def test_compression_disabled(self):
+        self._server.compression = 'gzip'
+        client = jdic.Client(dict(base_url=self._server.url + '/cgi?', compression=False))
+        self.assertEqual(len(client.get_word_jp('koujou')), 2000)
+        self.assertFalse('gzip' in self._server.accept_encodings[0])
+        client.close()
+    
+    def test_compressed_disk_cache(self):
+        path = tempfile.mkdtemp()
+        try:
+            key = (jdic.SearchType.WORD_JP, u'向上')
+            entries = [dict(word=u'向上', reading=u'こうじょう', definition='improvement')] * 100
+            
+            plain = jdic.DiskCache(dict(path=path))
+            plain.set(key, entries)
+            size = os.path.getsize(plain._filename(key))
+            
+            cache = jdic.DiskCache(dict(path=path, compress=6))
+            self.assertEqual(cache.get(key), entries)
+            cache.set(key, entries)
+            self.assertTrue(os.path.getsize(cache._filename(key)) < size)
+            self.assertEqual(cache.get(key), entries)
+            self.assertEqual(plain.get(key), entries)
+        finally:
+            shutil.rmtree(path)
+
+class SearchIndexTests(unittest.TestCase):
+    def setUp(self):
+        self._index = jdic.SearchIndex.from_edict(os.path.join(FIXTURES, 'edict_sample.txt'), 'utf-8')
+        self._index.add(dict(word=u'コーヒー', reading=u'コーヒー', wordtype=['n'], definition='coffee'))
+    
+    def _words(self, entries):
+        return [entry['word'] for entry in entries]
+    
+    def test_romanize(self):
+        from jdic.search import romanize
+        self.assertEqual(romanize(u'こうじょう'), 'koujou')
+        self.assertEqual(romanize(u'きょう'), 'kyou')
+        self.assertEqual(romanize(u'がっこう'), 'gakkou')
+        self.assertEqual(romanize(u'マッチ'), 'matchi')
+        self.assertEqual(romanize(u'コーヒー'), 'koohii')
+        self.assertEqual(romanize(u'向上'), None)
+    
+    def test_prefix(self):
+        self.assertEqual(len(self._index), 6)
+        #priority entries first, then insertion order
+        self.assertEqual(self._words(self._index.prefix('kou')), [u'工場', u'向上', u'控除'])
+        #exact matches first
+        self.assertEqual(self._words(self._index.prefix('koujo')), [u'控除', u'工場', u'向上'])
+        self.assertEqual(self._words(self._index.prefix(u'コウジョ', limit=2)), [u'控除', u'工場'])
+        self.assertEqual(self._words(self._index.prefix(u'降')), [u'下る;降る'])
+        self.assertEqual(self._words(self._index.prefix(u'こーひ')), [u'コーヒー'])
+        self.assertEqual(self._words(self._index.prefix('KOOH')), [u'コーヒー'])
+        self.assertEqual(self._index.prefix('x'), [])
+    
+    def test_fuzzy(self):
+        self.assertEqual(self._words(self._index.fuzzy('tabru')), [u'食べる'])
+        self.assertEqual(self._words(self._index.fuzzy(u'たべう')), [u'食べる'])
+        self.assertEqual(self._words(self._index.fuzzy('koujyou')), [u'工場', u'向上'])
+        self.assertEqual(self._words(self._index.fuzzy('koujyou', max_distance=2)), [u'工場', u'向上', u'控除'])
+        self.assertEqual(self._index.fuzzy('k'), [])
+    
+    def test_search(self):
+        self.assertEqual(self._words(self._index.search('tabe')), [u'食べる'])
+        self.assertEqual(self._words(self._index.search('kudaru')), [u'下る;降る'])
+        self.assertEqual(self._words(self._index.search('kudaro')), [u'下る;降る'])
+    
+    def test_precomputed_top(self):
+        expected = self._words(self._index.prefix('k', limit=2))
+        index = jdic.SearchIndex.from_edict(os.path.join(FIXTURES, 'edict_sample.txt'), 'utf-8')
+        index.top_threshold = 0
+        self.assertEqual(self._words(index.prefix('k', limit=2)), expected)
+        self.assertTrue('k' in index._top)
+
+@unittest.skipIf(jdic.kanjitable.numpy is None, 'numpy is not installed')
+class KanjiTableTests(unittest.TestCase):
+    def setUp(self):
+        self._table = jdic.KanjiTable.from_kanjidic(os.path.join(FIXTURES, 'kanjidic_sample.txt'), 'utf-8')
+    
+    def test_columns(self):
+        self.assertEqual(len(self._table), 4)
+        self.assertEqual(self._table.column('strokes').tolist(), [1, 2, 3, 5])
+        self.assertEqual(self._table.get(u'付'), dict(kanji=u'付', grade=4, strokes=5, frequency=322, jlpt=2,
+            radical=9, nelson=363, skip_type=1, skip_1=2, skip_2=3))
+        self.assertEqual(self._table.get(u'乃'), None)
+    
+    def test_extension_a(self):
+        table = jdic.KanjiTable.from_kanjidic(os.path.join(FIXTURES, 'kanjidic_ext_sample.txt'), 'utf-8')
+        self.assertEqual(table.select(), [u'\u3402'])
+        self.assertEqual(table.get(u'\u3402')['strokes'], 6)
+    
+    def test_unparseable_lines_skipped(self):
+        path = tempfile.mkdtemp()
+        try:
+            kanjidic = os.path.join(path, 'kanjidic')
+            with open(kanjidic, 'w') as f:
+                f.write(u'\U00020000 2E22 U20000 B1 S2 カ {ancient character}\n丁 437A U4e01 B1 G3 S2 チョウ {street}\n'
+                    .encode('utf-8'))
+            self.assertEqual(jdic.KanjiTable.from_kanjidic(kanjidic, 'utf-8').select(), [u'丁'])
+        finally:
+            shutil.rmtree(path)
+    
+    def test_select(self):
+        self.assertEqual(self._table.select(grade=(None, 3), strokes=(1, 3), order_by='frequency'), [u'一', u'下', u'丁'])
+        self.assertEqual(self._table.select(jlpt=4), [u'一', u'下'])
+        self.assertEqual(self._table.select(order_by='-frequency', limit=2), [u'丁', u'付'])
+        self.assertEqual(self._table.select(grade=(5, None)), [])
+    
+    def test_missing_values(self):
+        entries = jdic.KanjiRequestHandler(dict(entry_format='object')).parse_response(
+            u"<pre>\n乃 4735 U4e43 B4 S2 N145 P3-1-1 ナイ {from}\n丁 437A U4e01 B1 G3 S2 F1312 J1 N2 P4-2-1 チョウ {street}\n</pre>")
+        table = jdic.KanjiTable.from_entries(entries)
+        self.assertEqual(table.get(u'乃')['grade'], None)
+        self.assertEqual(table.select(grade=(None, 6)), [u'丁'])
+        #missing values sort last either way
+        self.assertEqual(table.select(order_by='frequency'), [u'丁', u'乃'])
+        self.assertEqual(table.select(order_by='-frequency'), [u'丁', u'乃'])
+    
+    def test_dict_entries_rejected(self):
+        entries = jdic.KanjiRequestHandler().parse_response(u"<pre>\n丁 437A U4e01 B1 G3 S2 チョウ {street}\n</pre>")
+        self.assertRaises(ValueError, jdic.KanjiTable.from_entries, entries)
+    
+    def test_save_load(self):
+        path = tempfile.mkdtemp()
+        try:
+            self._table.save(path)
+            table = jdic.KanjiTable.load(path)
+            self.assertTrue(isinstance(table.column('grade'), jdic.kanjitable.numpy.memmap))
+            self.assertEqual(table.select(grade=(None, 3), order_by='frequency'), [u'一', u'下', u'丁'])
+            del table
+        finally:
+            shutil.rmtree(path)
+
+class CountingRequest(jdic.jdic.Request):
+    """
+    Request backend recording the search values it is asked for
+    """
+    def __init__(self, request):
+        super(CountingRequest, self).__init__()
+        self._request = request
+        self.search_values = []
+    
+    def get(self, options):
+        self.search_values.append(options['search_value'])
+        return self._request.get(options)
+
+class AnnotatorTests(unittest.TestCase):
+    def setUp(self):
+        self._request = CountingRequest(jdic.LocalRequest(dict(
+            edict=os.path.join(FIXTURES, 'edict_sample.txt'),
+            kanjidic=os.path.join(FIXTURES, 'kanjidic_sample.txt'),
+            encoding='utf-8'
+        )))
+        self._client = jdic.Client(dict(request=self._request, cache=jdic.MemoryCache()))
+    
+    def tearDown(self):
+        self._client.close()
+    
+    def test_packed_kanji(self):
+        results = self._client.get_kanji_many([u'一', u'丁', u'下', u'付', u'一'])
+        self.assertEqual(self._request.search_values, [u'一丁下付'])
+        self.assertEqual([result['search_value'] for result in results], [u'一', u'丁', u'下', u'付', u'一'])
+        self.assertEqual([result['entries'][0]['kanji'] for result in results], [u'一', u'丁', u'下', u'付', u'一'])
+        
+        #every kanji is cached on its own
+        self.assertEqual(self._client.get_kanji(u'丁')[0]['kanji'], u'丁')
+        self._client.get_kanji_many([u'付', u'下'])
+        self.assertEqual(self._request.search_values, [u'一丁下付'])
+    
+    def test_pack_size(self):
+        self._client.get_kanji_many([u'一', u'丁', u'下', u'付'], pack_size=3)
+        self.assertEqual(sorted(self._request.search_values), [u'一丁下', u'付'])
+    
+    def test_missing_kanji_looked_up_alone(self):
+        results = self._client.get_kanji_many([u'一', u'乃'])
+        self.assertEqual(self._request.search_values, [u'一乃', u'乃'])
+        self.assertEqual(results[1]['entries'], [])
+    
+    def test_unpacked_backend_fans_out(self):
+        #a backend that doesn't understand packed queries finds nothing, every kanji is then looked up in parallel
+        running = [0, 0]
+        lock = threading.Lock()
+        request = self._request
+        class UnpackedRequest(jdic.jdic.Request):
+            def get(self, options):
+                if len(options['search_value']) > 1:
+                    return []
+                with lock:
+                    running[0] += 1
+                    running[1] = max(running)
+                time.sleep(0.05)
+                with lock:
+                    running[0] -= 1
+                return request.get(options)
+        
+        client = jdic.Client(dict(request=UnpackedRequest(), workers=4))
+        try:
+            results = client.get_kanji_many([u'一', u'丁', u'下', u'付'])
+        finally:
+            client.close()
+        self.assertEqual([result['entries'][0]['kanji'] for result in results], [u'一', u'丁', u'下', u'付'])
+        self.assertTrue(running[1] > 1)
+    
+    def test_annotate(self):
+        documents = [u'向上と控除', u'下る', u'一丁']
+        annotations = list(jdic.Annotator(self._client, dict(window=2)).annotate(documents))
+        self.assertEqual([annotation['text'] for annotation in annotations], documents)
+        
+        annotation = annotations[0]
+        self.assertEqual(annotation['kanji'].keys(), [u'向', u'上', u'控', u'除'])
+        self.assertEqual(annotation['kanji'][u'上'], [])
+        self.assertEqual(annotation['words'].keys(), [u'向上', u'控除'])
+        self.assertEqual(annotation['words'][u'向上'][0]['definition'], 'elevation')
+        self.assertEqual(annotation['errors'], {})
+        
+        self.assertEqual(annotations[1]['kanji'][u'下'][0]['kanji'], u'下')
+        self.assertEqual(annotations[2]['kanji'].keys(), [u'一', u'丁'])
+        #kanji of a window are packed together, 下 was cached with the first window
+        self.assertTrue(u'向上控除下' in self._request.search_values)
+        self.assertTrue(u'一丁' in self._request.search_values)
+    
+    def test_annotate_streams(self):
+        consumed = []
+        def documents():
+            for i in range(10):
+                consumed.append(i)
+                yield u'一丁'
+        
+        annotations = jdic.Annotator(self._client, dict(window=3, words=False)).annotate(documents())
+        self.assertEqual(next(annotations)['kanji'].keys(), [u'一', u'丁'])
+        self.assertEqual(len(consumed), 3)
+        self.assertEqual(len(list(annotations)), 9)
+        self.assertEqual(self._request.search_values, [u'一丁'])
+
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._snapshot = os.path.join(self._path, 'jdic.snapshot')
+        self._local = jdic.LocalRequest(dict(
+            edict=os.path.join(FIXTURES, 'edict_sample.txt'),
+            kanjidic=os.path.join(FIXTURES, 'kanjidic_sample.txt'),
+            encoding='utf-8'
+        ))
+    
+    def tearDown(self):
+        self._local.close()
+        shutil.rmtree(self._path)
+    
+    def _client(self, cache=None):
+        request = CountingRequest(self._local)
+        return jdic.Client(dict(request=request, cache=cache)), request
+    
+    def test_warm_up_and_load(self):
+        cache = jdic.MemoryCache()
+        client, request = self._client(cache)
+        self.assertEqual(jdic.warm_up(client, jdic.SearchType.WORD_JP, [u'向上\n', u'工場\n', u'\n']), (2, 0))
+        self.assertEqual(jdic.warm_up(client, jdic.SearchType.KANJI_SINGLE, [u'一丁下', u'付']), (4, 0))
+        self.assertEqual(len(request.search_values), 3)
+        jdic.write_snapshot(self._snapshot, cache.items())
+        client.close()
+        
+        snapshot = jdic.SnapshotCache(dict(path=self._snapshot))
+        self.assertEqual(len(snapshot), 6)
+        client, request = self._client(jdic.TieredCache(jdic.MemoryCache(), snapshot))
+        self.assertEqual(client.get_word_jp(u'向上')[0]['definition'], 'elevation')
+        self.assertEqual(client.get_kanji(u'付')[0]['kanji'], u'付')
+        self.assertEqual(request.search_values, [])
+        
+        #lookups missing from the snapshot still go upstream
+        self.assertEqual(len(client.get_word_jp(u'控除')), 1)
+        self.assertEqual(request.search_values, [u'控除'])
+        self.assertEqual(snapshot.stats()['hits'], 2)
+        client.close()
+        snapshot.close()
+    
+    def test_expired_entries(self):
+        now = time.time()
+        jdic.write_snapshot(self._snapshot, [
+            ((jdic.SearchType.WORD_JP, u'向上'), now - 10, [dict(word=u'old')]),
+            ((jdic.SearchType.WORD_JP, u'工場'), now + 3600, [dict(word=u'fresh')]),
+            ((jdic.SearchType.WORD_JP, u'食べる'), None, [])
+        ])
+        snapshot = jdic.SnapshotCache(dict(path=self._snapshot))
+        self.assertEqual(snapshot.get((jdic.SearchType.WORD_JP, u'向上')), None)
+        self.assertEqual(snapshot.get((jdic.SearchType.WORD_JP, u'工場')), [dict(word=u'fresh')])
+        self.assertEqual(snapshot.get((jdic.SearchType.WORD_JP, u'食べる')), [])
+        self.assertEqual(snapshot.stats()['expirations'], 1)
+        self.assertEqual(sorted(key[1] for key, expires, entries in snapshot.items()), [u'工場', u'食べる'])
+        snapshot.close()
+    
+    def test_refresh_stale_only(self):
+        now = time.time()
+        jdic.write_snapshot(self._snapshot, [
+            ((jdic.SearchType.WORD_JP, u'向上'), now - 10, [dict(word=u'old')]),
+            ((jdic.SearchType.WORD_JP, u'工場'), now + 3600, [dict(word=u'fresh')])
+        ])
+        snapshot = jdic.SnapshotCache(dict(path=self._snapshot))
+        client, request = self._client()
+        
+        self.assertEqual(jdic.refresh_snapshot(client, self._snapshot, dict(ttl=3600)), (1, 0))
+        self.assertEqual(request.search_values, [u'向上'])
+        
+        #a snapshot opened before the refresh keeps reading the old file
+        self.assertEqual(snapshot.get((jdic.SearchType.WORD_JP, u'向上')), None)
+        snapshot.close()
+        
+        snapshot = jdic.SnapshotCache(dict(path=self._snapshot))
+        self.assertEqual(snapshot.get((jdic.SearchType.WORD_JP, u'向上'))[0]['definition'], 'elevation')
+        self.assertEqual(snapshot.get((jdic.SearchType.WORD_JP, u'工場')), [dict(word=u'fresh')])
+        snapshot.close()
+        
+        #entries expiring within the margin are refreshed as well, without a ttl they no longer expire
+        self.assertEqual(jdic.refresh_snapshot(client, self._snapshot, dict(margin=7200)), (2, 0))
+        snapshot = jdic.SnapshotCache(dict(path=self._snapshot))
+        self.assertEqual([expires for key, expires, entries in snapshot.items()], [None, None])
+        snapshot.close()
+        client.close()
+    
+    def test_refresh_errors_keep_entries(self):
+        jdic.write_snapshot(self._snapshot, [((jdic.SearchType.WORD_JP, u'向上'), time.time() - 10, [dict(word=u'old')])])
+        client = jdic.Client(dict(pool=MockPool(lambda: 1 / 0)))
+        self.assertEqual(jdic.refresh_snapshot(client, self._snapshot), (0, 1))
+        
+        snapshot = jdic.SnapshotCache(dict(path=self._snapshot))
+        self.assertEqual(len(snapshot), 1)
+        snapshot.close()
+    
+    def test_not_a_snapshot(self):
+        with open(self._snapshot, 'wb') as f:
+            f.write('not a snapshot')
+        self.assertRaises(ValueError, jdic.SnapshotCache, dict(path=self._snapshot))
+
+class FakeServerTests(unittest.TestCase):
+    def setUp(self):
+        self._server = FakeWwwjdic().start()
+        self._client = jdic.Client(dict(base_url=self._server.base_url, coalesce=False))
+    
+    def tearDown(self):
+        self._client.close()
+        self._server.stop()
+    
+    def test_query_codes(self):
+        self.assertEqual([entry['word'] for entry in self._client.get_word_en('factory')], [u'工場'])
+        self.assertEqual([entry['word'] for entry in self._client.get_word_jp(u'食べる')], [u'食べる'])
+        self.assertEqual([entry['kanji'] for entry in self._client.get_kanji(u'付')], [u'付'])
+        self.assertEqual([entry['kanji'] for entry in self._client.get_kanji_by_radical(u'一')], [u'一', u'丁', u'下'])
+    
+    def test_fill(self):
+        self._server.fill = True
+        self.assertEqual(len(self._client.get_word_en('factory')), FakeWwwjdic.page_sizes['4ZUE'])
+        self.assertEqual(self._client.get_word_en('nothing'), [])
+    
+    def test_latency(self):
+        self._server.latency = 0.1
+        start = time.time()
+        self._client.get_kanji(u'一')
+        self.assertGreaterEqual(time.time() - start, 0.1)
+    
+    def test_errors(self):
+        self._server.error_rate = 1
+        pool = jdic.ConnectionPool()
+        response = pool.open(self._server.base_url + '1ZMJ%E4%B8%80')
+        try:
+            self.assertEqual(response.status, 503)
+        finally:
+            response.close()
+            pool.close()
+        
+        self.assertRaises(urllib2.HTTPError, self._client.get_kanji, u'付')
+        
+        self._server.error_rate = 0
+        self._server.drop_rate = 1
+        self.assertRaises(Exception, self._client.get_kanji, u'一')
+    
+    def test_run_load(self):
+        client = loadtest.load_client(self._server)
+        try:
+            result = loadtest.run_load(client, jdic.SearchType.WORD_JP, [u'工場', u'向上'], 20, 4)
+        finally:
+            client.close()
+        self.assertEqual(result['errors'], 0)
+        self.assertEqual(self._server.requests, 20)
+        self.assertTrue(result['p50'] <= result['p99'])
+        self.assertTrue(result['parse_ms'] is not None)
+
+class DeadlineTests(unittest.TestCase):
+    def setUp(self):
+        self._server = FakeWwwjdic().start()
+        self._pool = jdic.ConnectionPool()
+        self._client = jdic.Client(dict(base_url=self._server.base_url, pool=self._pool, coalesce=False))
+    
+    def tearDown(self):
+        self._client.close()
+        self._pool.close()
+        self._server.stop()
+    
+    def test_deadline(self):
+        deadline = jdic.Deadline(0.05)
+        self.assertTrue(0 < deadline.remaining() <= 0.05)
+        self.assertEqual(jdic.deadline.remaining(deadline, 0.01), 0.01)
+        self.assertEqual(jdic.deadline.remaining(None, 0.01), 0.01)
+        time.sleep(0.06)
+        self.assertTrue(deadline.expired())
+        self.assertRaises(jdic.DeadlineExceeded, deadline.remaining)
+        self.assertTrue(issubclass(jdic.DeadlineExceeded, jdic.TimeoutError))
+    
+    def test_stalled_lookup(self):
+        self._server.latency = 0.5
+        start = time.time()
+        self.assertRaises(jdic.DeadlineExceeded, self._client.get_kanji, u'一', 0.1)
+        self.assertTrue(time.time() - start < 0.4)
+        #the connection was abandoned mid request, it can't go back to the pool
+        self.assertEqual(self._pool.idle_count(), 0)
+    
+    def test_client_timeout(self):
+        client = jdic.Client(dict(base_url=self._server.base_url, pool=self._pool, timeout=0.1))
+        self._server.latency = 0.5
+        self.assertRaises(jdic.DeadlineExceeded, client.get_word_jp, u'工場')
+        self._server.latency = 0
+        self.assertEqual(len(client.get_word_jp(u'工場')), 1)
+    
+    def test_deadline_covers_failover(self):
+        slow = FakeWwwjdic(dict(latency=0.5)).start()
+        try:
+            client = jdic.Client(dict(mirrors=[slow.base_url, self._server.base_url], retries=1, pool=self._pool))
+            self._server.latency = 0.5
+            start = time.time()
+            self.assertRaises(jdic.DeadlineExceeded, client.get_kanji, u'一', 0.2)
+            #both mirrors are slow, the retry only gets what is left of the deadline
+            self.assertTrue(time.time() - start < 0.45)
+        finally:
+            slow.stop()
+    
+    def test_scheduler_deadline(self):
+        scheduler = jdic.Scheduler(dict(concurrency=1, max_concurrency=1))
+        scheduler.acquire()
+        self.assertRaises(jdic.DeadlineExceeded, scheduler.acquire, jdic.Priority.BULK, jdic.Deadline(0.05))
+        self.assertEqual(scheduler.queued(), 0)
+        self.assertEqual(scheduler.running(), 1)
+    
+    def test_batch_deadline(self):
+        self._server.latency = 0.3
+        start = time.time()
+        results = self._client.get_many(jdic.SearchType.KANJI_SINGLE, [u'一', u'丁', u'下', u'付'], workers=2, timeout=0.1)
+        self.assertTrue(time.time() - start < 0.25)
+        self.assertEqual([result['search_value'] for result in results], [u'一', u'丁', u'下', u'付'])
+        for result in results:
+            self.assertTrue(isinstance(result['error'], jdic.DeadlineExceeded))
+    
+    def test_cancel(self):
+        self._server.latency = 0.2
+        request = jdic.HttpRequest(dict(pool=self._pool, base_url=self._server.base_url))
+        threading.Timer(0.05, request.cancel).start()
+        self.assertRaises(jdic.CancelledError, request.get, dict(search_type=jdic.SearchType.KANJI_SINGLE, search_value=u'一'))
+        self.assertEqual(self._pool.idle_count(), 0)
+    
+    def test_abort_response(self):
+        self._server.fill = True
+        response = self._pool.open(self._server.base_url + '4ZUEfactory')
+        response.read()
+        response.abort()
+        response.close()
+        self.assertEqual(self._pool.idle_count(), 0)
+
+class IndexerTests(unittest.TestCase):
+    def setUp(self):
+        self._path = tempfile.mkdtemp()
+        self._edict = os.path.join(self._path, 'edict.txt')
+        self._kanjidic = os.path.join(self._path, 'kanjidic.txt')
+        shutil.copy(os.path.join(FIXTURES, 'edict_sample.txt'), self._edict)
+        shutil.copy(os.path.join(FIXTURES, 'kanjidic_sample.txt'), self._kanjidic)
+        self._options = dict(encoding='utf-8', processes=2, chunk_lines=2)
+    
+    def tearDown(self):
+        shutil.rmtree(self._path)
+    
+    def _request(self, indexed):
+        options = dict(edict=self._edict, kanjidic=self._kanjidic, encoding='utf-8')
+        if indexed:
+            options.update(edict_index=self._edict + '.index', kanjidic_index=self._kanjidic + '.index')
+        return jdic.LocalRequest(options)
+    
+    def _lookups(self, request):
+        queries = [
+            (jdic.SearchType.WORD_JP, u'こうじょう'),
+            (jdic.SearchType.WORD_JP, u'降る'),
+            (jdic.SearchType.WORD_EN, 'to eat'),
+            (jdic.SearchType.WORD_EN, 'spaceship'),
+            (jdic.SearchType.KANJI_SINGLE, u'付一'),
+        ]
+        try:
+            return [request.get(dict(search_type=search_type, search_value=value)) for search_type, value in queries]
+        finally:
+            request.close()
+    
+    def test_detect_kind(self):
+        self.assertEqual(jdic.indexer.detect_kind(self._edict), 'edict')
+        self.assertEqual(jdic.indexer.detect_kind(self._kanjidic), 'kanjidic')
+    
+    def test_indexed_lookups(self):
+        self.assertEqual(jdic.build_index(self._edict, self._edict + '.index', self._options)[1], 0)
+        jdic.build_index(self._kanjidic, self._kanjidic + '.index', self._options)
+        
+        index = jdic.DictionaryIndex(self._edict + '.index')
+        try:
+            self.assertEqual(index.kind, 'edict')
+            self.assertEqual(index.tables(), ['keywords', 'words'])
+            self.assertEqual(len(index['words'].get(u'こうじょう')), 2)
+            self.assertEqual(index['words'].get(u'ない'), None)
+        finally:
+            index.close()
+        
+        self.assertEqual(self._lookups(self._request(True)), self._lookups(self._request(False)))
+    
+    def test_search_index_from_index(self):
+        jdic.build_index(self._edict, self._edict + '.index', self._options)
+        index = jdic.SearchIndex.from_index(self._edict + '.index')
+        expected = jdic.SearchIndex.from_edict(self._edict, 'utf-8')
+        self.assertEqual(len(index), len(expected))
+        self.assertEqual(index.prefix('kou'), expected.prefix('kou'))
+    
+    def test_incremental_rebuild(self):
+        path = self._edict + '.index'
+        jdic.build_index(self._kanjidic, self._kanjidic + '.index', self._options)
+        parsed, reused = jdic.build_index(self._edict, path, self._options)
+        self.assertTrue(parsed > 1)
+        self.assertEqual(jdic.build_index(self._edict, path, self._options), (0, parsed))
+        
+        with open(self._edict, 'ab') as f:
+            f.write(u'珈琲 [コーヒー] /(n) coffee/(P)/\n'.encode('utf-8'))
+        parsed, reused = jdic.build_index(self._edict, path, self._options)
+        self.assertEqual(parsed, 1)
+        self.assertTrue(reused > 0)
+        
+        lookups = self._lookups(self._request(True))
+        self.assertEqual(lookups, self._lookups(self._request(False)))
+        request = self._request(True)
+        try:
+            self.assertEqual(request.get(dict(search_type=jdic.SearchType.WORD_EN, search_value='coffee'))[0]['word'], u'珈琲')
+        finally:
+            request.close()
+    
+    def test_stale_index(self):
+        jdic.build_index(self._edict, self._edict + '.index', self._options)
+        with open(self._edict, 'ab') as f:
+            f.write('\n')
+        request = self._request(True)
+        self.assertRaises(ValueError, request.get, dict(search_type=jdic.SearchType.WORD_EN, search_value='eat'))
+        request.close()
+    
+    def test_same_size_edit(self):
+        path = self._edict + '.index'
+        jdic.build_index(self._edict, path, self._options)
+        mtime = os.path.getmtime(self._edict)
+        
+        #a touched file with the same content is still indexed
+        os.utime(self._edict, (mtime + 10, mtime + 10))
+        request = self._request(True)
+        self.assertEqual(len(request.get(dict(search_type=jdic.SearchType.WORD_EN, search_value='factory'))), 1)
+        request.close()
+        
+        with open(self._edict, 'rb') as f:
+            data = f.read()
+        with open(self._edict, 'wb') as f:
+            f.write(data.replace('factory', 'fact0ry'))
+        os.utime(self._edict, (mtime + 20, mtime + 20))
+        request = self._request(True)
+        self.assertRaises(ValueError, request.get, dict(search_type=jdic.SearchType.WORD_EN, search_value='factory'))
+        request.close()
+
+class StandInServer(object):
+    """
+    Local keep-alive http server standing in for wwwjdic. Responses are registered per request path
+    """
+    def __init__(self):
+        handlers = self._handlers = {}
+        server = self
+        self.connections = 0
+        #content coding ('gzip' or 'deflate') applied when the client accepts it
+        self.compression = None
+        self.accept_encodings = []
+        
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def setup(self):
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+                server.connections += 1
+            
+            def do_GET(self):
+                callback = handlers.get(self.path)
+                body = callback() if callback else ''
+                accept_encoding = self.headers.getheader('Accept-Encoding', '')
+                server.accept_encodings.append(accept_encoding)
+                
+                self.send_response(200 if callback else 404)
+                self.send_header('Content-Type', 'text/html; charset=UTF-8')
+                if server.compression and server.compression in accept_encoding:
+                    body = compress(body, server.compression)
+                    self.send_header('Content-Encoding', server.compression)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+        
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+    
+    def add_handler(self, path, callback):
+        self._handlers[path] = callback
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def compress(data, encoding):
+    """
+    Compresses data with the gzip or deflate content coding
+    """
+    if encoding == 'deflate':
+        return zlib.compress(data)
+    
+    buf = StringIO.StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+class MockPool(object):
+    """
+    Mock for ConnectionPool, returns the same body for every url
+    """
+    def __init__(self, callback):
+        self._callback = callback
+        self.urls = []
+    
+    def open(self, url, headers=None, timeout=None):
+        self.urls.append(url)
+        self.response = MockFileLike(self._callback())
+        return self.response
+    
+    def close(self):
+        pass
 
 class MockUrllib(object):
     """
@@ -307,6 +2198,7 @@ class MockOpener(object):
     def __init__(self, handlers):
         self._handlers = handlers
         self._opened = False
+        self.addheaders = []
 
     def open(self, url, data=None):
         if url in self._handlers:
@@ -326,11 +2218,33 @@ class MockFileLike(object):
     """
     Mock for FileLike. Request handler uses read() in jdic api, so we need to mock this in testing.
     """
-    def __init__(self, data):
+    def __init__(self, data, headers=None, status=200):
         self.data = data
+        self.offset = 0
+        self.closed = False
+        self.headers = headers or {}
+        self.status = status
+        self.reason = 'OK' if status == 200 else 'Error'
+    
+    def getcode(self):
+        return self.status
     
-    def read(self):
-        return self.data
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+    
+    def info(self):
+        return self
+    
+    def read(self, size=None):
+        if size is None:
+            return self.data
+        
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+    
+    def close(self):
+        self.closed = True
 
 if __name__ == "__main__":
     unittest.main()